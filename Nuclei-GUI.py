@@ -1,46 +1,1700 @@
+import sys
+
+# 无界面模式（run / daemon / submit）只加载扫描引擎，不导入tkinter
+if __name__ == "__main__" and len(sys.argv) > 1 and sys.argv[1] in ('run', 'daemon', 'submit'):
+    from nuclei_engine import main as engine_main
+    sys.exit(engine_main(sys.argv[1:]))
+
 import tkinter as tk
-from tkinter import ttk, messagebox, scrolledtext, filedialog
-import subprocess
+from tkinter import ttk, messagebox, scrolledtext, filedialog, simpledialog
+import tkinter.font as tkfont
 import threading
 import os
-from pathlib import Path
 import re
 import json
 from datetime import datetime
-import tempfile
+import queue
+import time
+import mmap
+import sqlite3
+import shutil
+
+from nuclei_engine import (
+    TemplateSearchIndex, TemplateCatalog, CatalogView, CatalogSelection, TemplateCache, TemplateMetadataIndex,
+    CustomTemplateScanner, FindingsStore,
+    BatchJob, ScanEngine, ScanJob, ScanMetrics, ScanQueue, QueueRunner, RateBudget, TargetStore, TargetExpression, SEVERITY_COLORS,
+    atomic_write_text, find_templates_dir, official_templates_fingerprint,
+    parse_template_list_line, query_narrows, format_duration, format_skipped_targets, save_preset, list_presets, DIAGNOSTICS,
+)
+
+
+# ANSI转义序列（预编译，所有渲染器共享）
+ANSI_ESCAPE_RE = re.compile(r'\x1B\[([0-9;]*)([A-Za-z])')
+# 行尾被截断的不完整转义序列（\Z：$ 也会匹配结尾换行符之前的位置）
+ANSI_PARTIAL_RE = re.compile(r'\x1B(\[[0-9;]*)?\Z')
+
+# 标准16色，名称即文本框中的颜色标签名
+ANSI_BASIC_COLORS = [
+    'black', 'red', 'green', 'yellow', 'blue', 'magenta', 'cyan', 'white',
+    'gray', 'lightcoral', 'lightgreen', 'lightyellow', 'lightblue', 'pink', 'lightcyan', 'white'
+]
+
+
+def ansi_256_color(n):
+    """将256色索引转换为颜色名或#rrggbb"""
+    if n < 16:
+        return ANSI_BASIC_COLORS[n]
+    if n < 232:
+        n -= 16
+        levels = (0, 95, 135, 175, 215, 255)
+        return '#%02x%02x%02x' % (levels[n // 36], levels[(n // 6) % 6], levels[n % 6])
+    gray = 8 + (n - 232) * 10
+    return '#%02x%02x%02x' % (gray, gray, gray)
+
+
+class AnsiRenderer:
+    """有状态的ANSI渲染器：跨块保留SGR状态，并合并相同样式的相邻片段
+    
+    SGR状态在每个换行处清除：多个任务的输出按行交错写入，一个任务未关闭的样式不会带到其他任务的行中
+    """
+    
+    def __init__(self, ensure_tag=None, default_fg='black'):
+        # ensure_tag(tag_name, options) 在首次遇到某个样式标签时调用，用于按需创建标签
+        self.ensure_tag = ensure_tag
+        self.default_fg = default_fg
+        self.fg = None
+        self.bg = None
+        self.bold = False
+        self._pending = ''
+        self._known_tags = set()
+        self._style_cache = {}
+    
+    def reset(self):
+        """清除SGR状态"""
+        self.fg = None
+        self.bg = None
+        self.bold = False
+        self._pending = ''
+    
+    def feed(self, text):
+        """解析一段文本，返回合并后的 [(文本, 标签元组), ...]"""
+        if self._pending:
+            text = self._pending + text
+            self._pending = ''
+        
+        partial = ANSI_PARTIAL_RE.search(text)
+        if partial:
+            self._pending = text[partial.start():]
+            text = text[:partial.start()]
+        
+        runs = []
+        if '\x1b' not in text and self.fg is None and self.bg is None and not self.bold:
+            # 没有转义序列、也没有遗留样式（最常见）：整段一个片段
+            if text:
+                runs.append((text, self._current_tags()))
+            return runs
+        
+        start = 0
+        while start < len(text):
+            end = text.find('\n', start) + 1 or len(text)
+            self._feed_line(runs, text[start:end])
+            if text[end - 1] == '\n':
+                self.fg = None
+                self.bg = None
+                self.bold = False
+            start = end
+        return runs
+    
+    def _feed_line(self, runs, text):
+        last_end = 0
+        tags = self._current_tags()
+        
+        for match in ANSI_ESCAPE_RE.finditer(text):
+            start = match.start()
+            if start > last_end:
+                self._append_run(runs, text[last_end:start], tags)
+            last_end = match.end()
+            
+            # 只处理SGR，其余控制序列（光标移动、清行等）直接丢弃
+            if match.group(2) == 'm':
+                self._apply_sgr(match.group(1))
+                tags = self._current_tags()
+        
+        if last_end < len(text):
+            self._append_run(runs, text[last_end:], tags)
+    
+    @staticmethod
+    def _append_run(runs, chunk, tags):
+        if runs and runs[-1][1] == tags:
+            runs[-1] = (runs[-1][0] + chunk, tags)
+        else:
+            runs.append((chunk, tags))
+    
+    def _apply_sgr(self, params):
+        """应用一组SGR参数"""
+        codes = params.split(';') if params else ['0']
+        i = 0
+        count = len(codes)
+        while i < count:
+            code = int(codes[i]) if codes[i] else 0
+            if code == 0:
+                self.fg = None
+                self.bg = None
+                self.bold = False
+            elif code == 1:
+                self.bold = True
+            elif code == 22:
+                self.bold = False
+            elif 30 <= code <= 37:
+                self.fg = ANSI_BASIC_COLORS[code - 30]
+            elif 90 <= code <= 97:
+                self.fg = ANSI_BASIC_COLORS[code - 90 + 8]
+            elif code == 39:
+                self.fg = None
+            elif 40 <= code <= 47:
+                self.bg = ANSI_BASIC_COLORS[code - 40]
+            elif 100 <= code <= 107:
+                self.bg = ANSI_BASIC_COLORS[code - 100 + 8]
+            elif code == 49:
+                self.bg = None
+            elif code in (38, 48) and i + 1 < count:
+                # 扩展颜色：38;5;n / 38;2;r;g;b
+                color = None
+                mode = codes[i + 1]
+                if mode == '5' and i + 2 < count:
+                    color = ansi_256_color(int(codes[i + 2] or 0) & 0xFF)
+                    i += 2
+                elif mode == '2' and i + 4 < count:
+                    rgb = [int(c or 0) & 0xFF for c in codes[i + 2:i + 5]]
+                    color = '#%02x%02x%02x' % tuple(rgb)
+                    i += 4
+                if color:
+                    if code == 38:
+                        self.fg = color
+                    else:
+                        self.bg = color
+            i += 1
+    
+    def _current_tags(self):
+        """返回当前样式对应的标签元组（带缓存）"""
+        key = (self.fg, self.bg, self.bold)
+        tags = self._style_cache.get(key)
+        if tags is None:
+            fg = self.fg or self.default_fg
+            tags = [self._tag('fg' + fg if fg.startswith('#') else fg, {'foreground': fg})]
+            if self.bg:
+                tags.append(self._tag('bg' + self.bg, {'background': self.bg}))
+            if self.bold:
+                tags.append(self._tag('bold', {'bold': True}))
+            tags = tuple(tags)
+            self._style_cache[key] = tags
+        return tags
+    
+    def _tag(self, name, options):
+        if name not in self._known_tags:
+            self._known_tags.add(name)
+            if self.ensure_tag:
+                self.ensure_tag(name, options)
+        return name
+
+
+class OutputPipeline:
+    """输出管道：工作线程只负责入队，主线程通过after循环按批次刷新到文本框
+    
+    也是后台线程到界面的唯一通道：call() 入队的函数按顺序在主线程中执行，排在它之前的输出已经显示；
+    call_soon() 的函数与输出无关（搜索结果、结果浏览器的查询），放在单独的队列中，每次刷新先于输出执行，
+    不会排在大量积压的扫描输出之后
+    """
+    
+    # 队列中表示函数调用的标记（代替颜色）
+    CALL = object()
+    
+    def __init__(self, root, text_widget, render, interval_ms=40,
+                 max_batch_lines=2000, max_batch_ms=15):
+        self.root = root
+        self.text_widget = text_widget
+        # render(text, color) -> [(片段文本, 标签), ...]
+        self.render = render
+        self.interval_ms = interval_ms
+        self.max_batch_lines = max_batch_lines
+        self.max_batch_ms = max_batch_ms
+        self.queue = queue.SimpleQueue()
+        self.urgent = queue.SimpleQueue()
+        self.on_stats = None
+        # 完整输出同时写入会话日志文件
+        self.session_log = None
+        
+        # 滚动缓冲上限：超出后按块裁剪最早的行
+        self.max_lines = 5000
+        self.trim_chunk = 1000
+        self.trimmed_lines = 0
+        
+        # 吞吐统计
+        self.total_lines = 0
+        self.lines_per_sec = 0.0
+        self._window_lines = 0
+        self._window_start = time.monotonic()
+        self._running = False
+    
+    def write(self, text, color=None):
+        """线程安全：写入一段输出（可在任意线程调用）"""
+        self.queue.put((text, color))
+    
+    def call(self, func, *args):
+        """线程安全：在主线程中调用 func(*args)"""
+        self.queue.put(((func, args), self.CALL))
+    
+    def call_soon(self, func, *args):
+        """线程安全：在下一次刷新时先于积压的输出在主线程中调用 func(*args)（不保证与输出的先后）"""
+        self.urgent.put((func, args))
+    
+    def depth(self):
+        """当前队列积压的条数"""
+        return self.queue.qsize()
+    
+    def start(self):
+        """启动主线程刷新循环"""
+        if not self._running:
+            self._running = True
+            self.root.after(self.interval_ms, self._drain)
+    
+    def stop(self):
+        """停止刷新循环，尚未显示的输出仍写入会话日志"""
+        self._running = False
+        if self.session_log:
+            while True:
+                try:
+                    text, color = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if color is not self.CALL:
+                    self.session_log.write(text)
+            self.session_log.flush()
+    
+    def _invoke(self, func, args):
+        try:
+            with DIAGNOSTICS.span(f"ui_call.{getattr(func, '__name__', 'func')}"):
+                func(*args)
+        except Exception as e:
+            self.write(f"界面回调出错: {e}\n", 'red')
+    
+    def _drain(self):
+        """从队列中取出一批输出，合并为一次插入和一次滚动"""
+        if not self._running:
+            return
+        
+        while True:
+            try:
+                func, args = self.urgent.get_nowait()
+            except queue.Empty:
+                break
+            self._invoke(func, args)
+        
+        deadline = time.perf_counter() + self.max_batch_ms / 1000.0
+        insert_args = []
+        run_parts = []
+        run_tags = None
+        lines = 0
+        
+        while lines < self.max_batch_lines:
+            try:
+                text, color = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            
+            if color is self.CALL:
+                # 先插入已合并的输出，再执行回调
+                self._flush_runs(insert_args, run_parts, run_tags)
+                insert_args, run_parts, run_tags = [], [], None
+                self._invoke(*text)
+                continue
+            
+            if self.session_log:
+                self.session_log.write(text)
+            
+            # 合并整批中样式相同的相邻片段
+            for part_text, part_tags in self.render(text, color):
+                if part_tags != run_tags:
+                    if run_parts:
+                        insert_args.append(''.join(run_parts))
+                        insert_args.append(run_tags)
+                    run_parts = []
+                    run_tags = part_tags
+                run_parts.append(part_text)
+            lines += 1
+            
+            # 每批的处理时间也有上限，避免一次刷新占用主线程过久
+            if time.perf_counter() >= deadline:
+                break
+        
+        self._flush_runs(insert_args, run_parts, run_tags)
+        self._update_stats(lines)
+        self.root.after(self.interval_ms, self._drain)
+    
+    def _flush_runs(self, insert_args, run_parts, run_tags):
+        """把合并好的片段一次性插入文本框"""
+        if run_parts:
+            insert_args.append(''.join(run_parts))
+            insert_args.append(run_tags)
+        
+        if insert_args:
+            try:
+                with DIAGNOSTICS.span('output.insert'):
+                    # 只有当用户停留在底部时才自动滚动
+                    follow = self.text_widget.yview()[1] >= 0.999
+                    self.text_widget.insert(tk.END, *insert_args)
+                    self._trim()
+                    if follow:
+                        self.text_widget.see(tk.END)
+            except tk.TclError:
+                pass
+    
+    def _trim(self):
+        """超出滚动缓冲上限时，一次性删除最早的一整块行"""
+        if not self.max_lines:
+            return
+        line_count = int(self.text_widget.index('end-1c').split('.')[0])
+        if line_count > self.max_lines + self.trim_chunk:
+            excess = line_count - self.max_lines
+            self.text_widget.delete('1.0', f'{excess + 1}.0')
+            self.trimmed_lines += excess
+    
+    def _update_stats(self, lines):
+        """统计每秒处理的行数，并上报队列深度"""
+        self.total_lines += lines
+        self._window_lines += lines
+        now = time.monotonic()
+        elapsed = now - self._window_start
+        if elapsed >= 1.0:
+            self.lines_per_sec = self._window_lines / elapsed
+            self._window_lines = 0
+            self._window_start = now
+            if self.on_stats:
+                self.on_stats(self.lines_per_sec, self.depth())
+
+
+class SessionLog:
+    """会话日志：完整输出追加写入磁盘，可通过内存映射分页读回
+    
+    write() 只入队，由单独的写线程编码并写入文件，主线程不做文件IO；队列写空时写线程自行刷新到磁盘
+    """
+    
+    def __init__(self, log_dir="./work/logs"):
+        os.makedirs(log_dir, exist_ok=True)
+        self.path = os.path.join(log_dir, datetime.now().strftime("session_%Y%m%d_%H%M%S.log"))
+        self._file = open(self.path, 'ab')
+        # 已写入文件的字节数，关闭后仍可读取
+        self._size = self._file.tell()
+        self._closed = False
+        self._queue = queue.SimpleQueue()
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+    
+    def write(self, text):
+        """线程安全：追加一段输出（只入队）"""
+        if not self._closed:
+            self._queue.put(text)
+    
+    def flush(self):
+        """等待已入队的输出全部写入磁盘（关闭后直接返回）"""
+        if self._closed:
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        while not done.wait(0.5) and self._writer.is_alive():
+            pass
+    
+    def size(self):
+        return self._size
+    
+    def close(self):
+        """写完队列中剩余的输出后关闭"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._writer.join()
+    
+    def _write_loop(self):
+        f = self._file
+        while True:
+            item = self._queue.get()
+            # 一次取空队列中的输出，最后刷新一次
+            while True:
+                if item is None:
+                    f.close()
+                    return
+                try:
+                    if isinstance(item, threading.Event):
+                        f.flush()
+                        item.set()
+                    else:
+                        self._size += f.write(item.encode('utf-8', 'replace'))
+                except OSError:
+                    pass
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            try:
+                f.flush()
+            except OSError:
+                pass
+    
+    def read_page(self, offset, page_size=256 * 1024, backwards=False):
+        """读取一页日志，返回 (文本, 起始偏移, 结束偏移)，边界对齐到整行
+        
+        backwards=True 时读取 offset 之前的一页，否则读取 offset 之后的一页
+        """
+        self.flush()
+        with open(self.path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return '', 0, 0
+            
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if backwards:
+                    end = min(max(offset, 0), size)
+                    start = max(0, end - page_size)
+                    if start > 0:
+                        newline = mm.find(b'\n', start, end)
+                        if newline != -1:
+                            start = newline + 1
+                else:
+                    start = min(max(offset, 0), size)
+                    if 0 < start < size and mm[start - 1] != 0x0A:
+                        newline = mm.find(b'\n', start)
+                        start = newline + 1 if newline != -1 else size
+                    end = min(size, start + page_size)
+                    if end < size:
+                        newline = mm.rfind(b'\n', start, end)
+                        if newline != -1:
+                            end = newline + 1
+                
+                data = mm[start:end]
+        
+        return data.decode('utf-8', 'replace'), start, end
+
+
+class LogViewer:
+    """会话日志查看器：按页从磁盘加载更早的输出"""
+    
+    def __init__(self, root, session_log):
+        self.session_log = session_log
+        self.start = 0
+        self.end = 0
+        
+        self.window = tk.Toplevel(root)
+        self.window.title(f"完整扫描日志 - {os.path.basename(session_log.path)}")
+        self.window.geometry("900x600")
+        
+        toolbar = ttk.Frame(self.window)
+        toolbar.pack(fill=tk.X, padx=4, pady=4)
+        
+        ttk.Button(toolbar, text="最早", command=self.show_first).pack(side=tk.LEFT, padx=(0, 4))
+        ttk.Button(toolbar, text="加载更早", command=self.show_previous).pack(side=tk.LEFT, padx=(0, 4))
+        ttk.Button(toolbar, text="加载更新", command=self.show_next).pack(side=tk.LEFT, padx=(0, 4))
+        ttk.Button(toolbar, text="最新", command=self.show_last).pack(side=tk.LEFT, padx=(0, 8))
+        
+        ttk.Label(toolbar, text="跳转到(%):").pack(side=tk.LEFT)
+        self.jump_entry = ttk.Entry(toolbar, width=6)
+        self.jump_entry.pack(side=tk.LEFT, padx=(4, 4))
+        self.jump_entry.bind('<Return>', self.jump_to)
+        ttk.Button(toolbar, text="跳转", command=self.jump_to).pack(side=tk.LEFT)
+        
+        self.position_var = tk.StringVar()
+        ttk.Label(toolbar, textvariable=self.position_var).pack(side=tk.RIGHT)
+        
+        self.text = scrolledtext.ScrolledText(self.window, wrap=tk.WORD, font=("Consolas", 9))
+        self.text.pack(fill=tk.BOTH, expand=True, padx=4, pady=(0, 4))
+        
+        self.show_last()
+    
+    def ensure_tag(self, tag_name, options):
+        if options.get('bold'):
+            self.text.tag_config(tag_name, font=("Consolas", 9, "bold"))
+        else:
+            self.text.tag_config(tag_name, **options)
+    
+    def render_page(self, page):
+        """渲染一页日志"""
+        text, self.start, self.end = page
+        renderer = AnsiRenderer(ensure_tag=self.ensure_tag)
+        insert_args = []
+        for part_text, part_tags in renderer.feed(text):
+            insert_args.append(part_text)
+            insert_args.append(part_tags)
+        
+        self.text.config(state='normal')
+        self.text.delete('1.0', tk.END)
+        if insert_args:
+            self.text.insert(tk.END, *insert_args)
+        self.text.config(state='disabled')
+        
+        size = self.session_log.size()
+        self.position_var.set(f"字节 {self.start:,} - {self.end:,} / {size:,}")
+    
+    def show_first(self):
+        self.render_page(self.session_log.read_page(0))
+        self.text.see('1.0')
+    
+    def show_last(self):
+        self.session_log.flush()
+        self.render_page(self.session_log.read_page(self.session_log.size(), backwards=True))
+        self.text.see(tk.END)
+    
+    def show_previous(self):
+        if self.start > 0:
+            self.render_page(self.session_log.read_page(self.start, backwards=True))
+            self.text.see(tk.END)
+    
+    def show_next(self):
+        if self.end < self.session_log.size():
+            self.render_page(self.session_log.read_page(self.end))
+            self.text.see('1.0')
+    
+    def jump_to(self, event=None):
+        try:
+            percent = float(self.jump_entry.get().strip())
+        except ValueError:
+            messagebox.showwarning("警告", "请输入0-100之间的数字", parent=self.window)
+            return
+        
+        percent = min(max(percent, 0.0), 100.0)
+        offset = int(self.session_log.size() * percent / 100.0)
+        self.render_page(self.session_log.read_page(offset))
+        self.text.see('1.0')
+
+
+class SearchController:
+    """搜索控制器：按键防抖，在后台线程执行查询，只应用最新一次查询的结果"""
+    
+    def __init__(self, root, on_result, call, delay_ms=150):
+        self.root = root
+        # on_result(匹配的模板路径序列：TemplateCatalog 或 CatalogView)，在主线程调用
+        self.on_result = on_result
+        # call(func, *args)：线程安全地在主线程执行（OutputPipeline.call_soon）
+        self.call = call
+        self.delay_ms = delay_ms
+        self.index = TemplateSearchIndex([])
+        self.query = ''
+        self._seq = 0
+        self._after_id = None
+        # 上一次查询及结果，用于增量缩小范围
+        self._last_query = None
+        self._last_ids = None
+        self._tasks = queue.Queue()
+        threading.Thread(target=self._worker, daemon=True).start()
+    
+    def rebuild(self, templates, field_lookup=None):
+        """在后台重建索引，完成后重新执行当前查询"""
+        self._seq += 1
+        self._tasks.put(('build', self._seq, (templates, field_lookup)))
+        self._submit()
+    
+    def apply_delta(self, added, removed):
+        """增量更新索引（不重建），完成后重新执行当前查询"""
+        self._seq += 1
+        self._tasks.put(('delta', self._seq, (added, removed)))
+        self._submit()
+    
+    def schedule(self, query):
+        """按键时调用：延迟执行，连续输入只执行最后一次"""
+        self.query = query
+        if self._after_id is not None:
+            self.root.after_cancel(self._after_id)
+        self._after_id = self.root.after(self.delay_ms, self._submit)
+    
+    def _submit(self):
+        self._after_id = None
+        self._seq += 1
+        self._tasks.put(('search', self._seq, self.query))
+    
+    def _worker(self):
+        while True:
+            kind, seq, payload = self._tasks.get()
+            if kind == 'build':
+                templates, field_lookup = payload
+                self.index = TemplateSearchIndex(templates, field_lookup)
+                self._last_query = None
+                self._last_ids = None
+                continue
+            if kind == 'delta':
+                added, removed = payload
+                self.index.remove(removed)
+                self.index.add(added)
+                self._last_query = None
+                self._last_ids = None
+                continue
+            
+            # 已有更新的查询时直接跳过
+            if seq != self._seq:
+                continue
+            
+            index = self.index
+            query = payload.strip().lower()
+            candidates = None
+            if query_narrows(self._last_query, query):
+                candidates = self._last_ids
+            
+            with DIAGNOSTICS.span('search.query'):
+                ids = index.search(query, candidates)
+            self._last_query = query
+            self._last_ids = ids
+            
+            # 结果是模板目录上的id视图，不复制路径列表
+            if not query:
+                paths = index.live_templates()
+            else:
+                paths = CatalogView(index.templates, ids)
+            self.call(self._apply, seq, paths)
+    
+    def _apply(self, seq, paths):
+        if seq == self._seq:
+            with DIAGNOSTICS.span('search.apply'):
+                self.on_result(paths)
+
+
+class KeySelection(dict):
+    """按键保存的选择（有序字典），用于目标列表等没有模板目录的键；接口与 CatalogSelection 相同"""
+    
+    def add(self, key):
+        self[key] = None
+    
+    def discard(self, key):
+        self.pop(key, None)
+    
+    def add_all(self, keys):
+        self.update(dict.fromkeys(keys))
+    
+    def retain(self, keys):
+        kept = [key for key in self if key in keys]
+        self.clear()
+        self.update(dict.fromkeys(kept))
+
+
+class VirtualListView:
+    """虚拟列表：只渲染可见的行，选择状态保存在以键（模板路径）为索引的模型中
+    
+    模板列表使用 CatalogSelection（模板目录上的位集），其他列表默认使用 KeySelection
+    """
+    
+    def __init__(self, parent, height=4, display=None, on_select=None, selection=None):
+        self.display = display or str
+        self.on_select = on_select
+        # 当前视图（过滤后）的键序列，只保存引用不复制
+        self.items = []
+        # 选中的键，与过滤条件无关
+        self.selected = selection if selection is not None else KeySelection()
+        self.top = 0
+        self.visible_rows = height
+        
+        self.listbox = tk.Listbox(parent, height=height, selectmode=tk.MULTIPLE,
+                                  exportselection=False, activestyle='none')
+        self.scrollbar = ttk.Scrollbar(parent, orient=tk.VERTICAL, command=self._on_scrollbar)
+        self.listbox.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        self.scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
+        
+        font = tkfont.nametofont(self.listbox.cget('font'))
+        self.row_height = font.metrics('linespace') + 1
+        
+        self.listbox.bind('<Configure>', self._on_configure)
+        self.listbox.bind('<<ListboxSelect>>', self._on_listbox_select)
+        self.listbox.bind('<MouseWheel>', self._on_mousewheel)
+        self.listbox.bind('<Button-4>', lambda e: self.scroll(-3))
+        self.listbox.bind('<Button-5>', lambda e: self.scroll(3))
+        self.listbox.bind('<Prior>', lambda e: self.scroll(-self.visible_rows))
+        self.listbox.bind('<Next>', lambda e: self.scroll(self.visible_rows))
+        self.listbox.bind('<Home>', lambda e: self.scroll_to(0))
+        self.listbox.bind('<End>', lambda e: self.scroll_to(len(self.items)))
+    
+    def set_items(self, items):
+        """替换当前显示的键列表（选择状态保留）"""
+        self.items = items
+        self.top = min(self.top, max(0, len(self.items) - self.visible_rows))
+        self.render()
+    
+    def item_count(self):
+        return len(self.items)
+    
+    def selected_keys(self):
+        return list(self.selected)
+    
+    def selection_count(self):
+        return len(self.selected)
+    
+    def select_all(self):
+        """选中当前视图中的所有键"""
+        self.selected.add_all(self.items)
+        self.render()
+        return len(self.items)
+    
+    def clear_selection(self):
+        """清除所有选择，返回被清除的数量"""
+        count = len(self.selected)
+        self.selected.clear()
+        self.render()
+        return count
+    
+    def discard(self, keys):
+        """取消选择指定的键（如已被删除的模板）"""
+        for key in keys:
+            self.selected.discard(key)
+    
+    def retain(self, keys):
+        """只保留仍存在于 keys 中的选择（keys 为新的模板目录时选择迁移到新目录上）"""
+        self.selected.retain(keys)
+    
+    def scroll(self, rows):
+        self.scroll_to(self.top + rows)
+        return "break"
+    
+    def scroll_to(self, top):
+        self.top = min(max(0, int(top)), max(0, len(self.items) - self.visible_rows))
+        self.render()
+        return "break"
+    
+    def render(self):
+        """只把可见窗口内的行写入Listbox"""
+        window = self.items[self.top:self.top + self.visible_rows + 1]
+        self.listbox.delete(0, tk.END)
+        if window:
+            self.listbox.insert(0, *[self.display(key) for key in window])
+            if self.selected:
+                for i, key in enumerate(window):
+                    if key in self.selected:
+                        self.listbox.selection_set(i)
+        self._update_scrollbar()
+    
+    def _update_scrollbar(self):
+        total = len(self.items)
+        if total <= self.visible_rows:
+            self.scrollbar.set(0.0, 1.0)
+        else:
+            self.scrollbar.set(self.top / total, min(1.0, (self.top + self.visible_rows) / total))
+    
+    def _on_scrollbar(self, action, value, unit=None):
+        if action == 'moveto':
+            self.scroll_to(float(value) * len(self.items))
+        elif action == 'scroll':
+            step = self.visible_rows if unit == 'pages' else 1
+            self.scroll(int(value) * step)
+    
+    def _on_mousewheel(self, event):
+        return self.scroll(-3 if event.delta > 0 else 3)
+    
+    def _on_configure(self, event):
+        rows = max(1, event.height // self.row_height)
+        if rows != self.visible_rows:
+            self.visible_rows = rows
+            self.scroll_to(self.top)
+    
+    def _on_listbox_select(self, event=None):
+        """把可见窗口中的选择变化同步回模型"""
+        current = set(self.listbox.curselection())
+        window = self.items[self.top:self.top + self.visible_rows + 1]
+        for i, key in enumerate(window):
+            if i in current:
+                self.selected.add(key)
+            else:
+                self.selected.discard(key)
+        if self.on_select:
+            self.on_select()
+
+
+class FindingsBrowser:
+    """扫描结果浏览器：按 严重级别 → 模板 → 主机 分组的懒加载树
+    
+    节点展开或“加载更多”进入可见区域时才从结果库分页读取，过滤和排序都在SQL中完成；
+    树只反映 id <= horizon 的结果，扫描中新写入的结果按id增量合并，不重建整棵树
+    """
+    
+    PAGE_SIZE = 200
+    SEVERITY_ORDER = ('critical', 'high', 'medium', 'low', 'info', 'unknown')
+    GROUP_SORTS = {"数量": 'count', "名称": 'name'}
+    LEAF_SORTS = {"时间": 'timestamp', "地址": 'matched_at'}
+    # 节点层级
+    SEVERITY, TEMPLATE, HOST, FINDING = range(4)
+    
+    def __init__(self, root, store, call, interval_ms=1000):
+        self.store = store
+        # call(func, *args)：线程安全地在主线程执行（OutputPipeline.call_soon），查询结果经它交回
+        self.call = call
+        self.interval_ms = interval_ms
+        self.filters = {}
+        # 树中已包含的最大结果id（顶层节点加载完成前为None，此时不轮询）
+        self.horizon = None
+        # 过滤/排序变化后递增，丢弃旧的异步查询结果
+        self.generation = 0
+        # 节点iid -> {'level', 'filters', 'count', 'populated', 'more', 'loading', 'children': {键: iid}}
+        self.nodes = {}
+        self.roots = {}
+        # “加载更多”节点iid -> 父节点iid
+        self.more_nodes = {}
+        self._polling = False
+        self._tasks = queue.Queue()
+        threading.Thread(target=self._worker, daemon=True).start()
+        
+        self.window = tk.Toplevel(root)
+        self.window.title("扫描结果")
+        self.window.geometry("1000x650")
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+        
+        toolbar = ttk.Frame(self.window)
+        toolbar.pack(fill=tk.X, padx=4, pady=4)
+        
+        ttk.Label(toolbar, text="严重级别:").pack(side=tk.LEFT)
+        self.severity_var = tk.StringVar(value="全部")
+        severity_box = ttk.Combobox(toolbar, textvariable=self.severity_var, width=9, state='readonly',
+                                    values=("全部",) + self.SEVERITY_ORDER)
+        severity_box.pack(side=tk.LEFT, padx=(4, 8))
+        severity_box.bind('<<ComboboxSelected>>', self.apply_filters)
+        
+        ttk.Label(toolbar, text="过滤:").pack(side=tk.LEFT)
+        self.text_var = tk.StringVar()
+        text_entry = ttk.Entry(toolbar, textvariable=self.text_var, width=30)
+        text_entry.pack(side=tk.LEFT, padx=(4, 8))
+        text_entry.bind('<Return>', self.apply_filters)
+        
+        ttk.Label(toolbar, text="分组排序:").pack(side=tk.LEFT)
+        self.group_sort_var = tk.StringVar(value="数量")
+        group_sort_box = ttk.Combobox(toolbar, textvariable=self.group_sort_var, width=6, state='readonly',
+                                      values=tuple(self.GROUP_SORTS))
+        group_sort_box.pack(side=tk.LEFT, padx=(4, 8))
+        group_sort_box.bind('<<ComboboxSelected>>', self.apply_filters)
+        
+        ttk.Label(toolbar, text="结果排序:").pack(side=tk.LEFT)
+        self.leaf_sort_var = tk.StringVar(value="时间")
+        leaf_sort_box = ttk.Combobox(toolbar, textvariable=self.leaf_sort_var, width=6, state='readonly',
+                                     values=tuple(self.LEAF_SORTS))
+        leaf_sort_box.pack(side=tk.LEFT, padx=(4, 8))
+        leaf_sort_box.bind('<<ComboboxSelected>>', self.apply_filters)
+        
+        ttk.Button(toolbar, text="刷新", command=self.apply_filters).pack(side=tk.LEFT)
+        
+        self.summary_var = tk.StringVar()
+        ttk.Label(toolbar, textvariable=self.summary_var).pack(side=tk.RIGHT)
+        
+        frame = ttk.Frame(self.window)
+        frame.pack(fill=tk.BOTH, expand=True, padx=4, pady=(0, 4))
+        self.tree = ttk.Treeview(frame, columns=('count', 'time'))
+        self.tree.heading('#0', text="严重级别 / 模板 / 主机 / 地址")
+        self.tree.heading('count', text="数量")
+        self.tree.heading('time', text="时间")
+        self.tree.column('#0', width=650)
+        self.tree.column('count', width=80, stretch=False, anchor=tk.E)
+        self.tree.column('time', width=220, stretch=False)
+        self.scrollbar = ttk.Scrollbar(frame, orient=tk.VERTICAL, command=self.tree.yview)
+        self.tree.configure(yscrollcommand=self.on_scroll)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        
+        for severity, color in SEVERITY_COLORS.items():
+            self.tree.tag_configure(severity, foreground=color)
+        self.tree.tag_configure('more', foreground='gray')
+        
+        self.tree.bind('<<TreeviewOpen>>', self.on_open)
+        self.tree.bind('<Double-1>', self.on_double_click)
+        
+        self.apply_filters()
+        self.window.after(self.interval_ms, self.poll)
+    
+    def _worker(self):
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                return
+            generation, query, callback, on_error = task
+            if generation != self.generation:
+                continue
+            try:
+                result = query()
+            except sqlite3.Error as e:
+                result = e
+            self.call(self._deliver, generation, callback, on_error, result)
+    
+    def _deliver(self, generation, callback, on_error, result):
+        if generation != self.generation or not self.window.winfo_exists():
+            return
+        if isinstance(result, Exception):
+            self.summary_var.set(f"查询失败: {result}")
+            if on_error:
+                on_error(result)
+            return
+        callback(result)
+    
+    def close(self):
+        self.generation += 1
+        self._tasks.put(None)
+        self.window.destroy()
+    
+    def submit(self, query, callback, on_error=None):
+        """在后台线程执行查询，结果在主线程交给callback，查询失败时交给on_error（过滤条件已变化时丢弃）"""
+        self._tasks.put((self.generation, query, callback, on_error))
+    
+    def apply_filters(self, event=None):
+        """过滤或排序条件变化：清空树并重新加载顶层节点"""
+        self.generation += 1
+        self.filters = {}
+        if self.severity_var.get() in self.SEVERITY_ORDER:
+            self.filters['severity'] = self.severity_var.get()
+        if self.text_var.get().strip():
+            self.filters['text'] = self.text_var.get().strip()
+        self.group_sort = self.GROUP_SORTS.get(self.group_sort_var.get(), 'count')
+        self.leaf_sort = self.LEAF_SORTS.get(self.leaf_sort_var.get(), 'timestamp')
+        
+        self.tree.delete(*self.tree.get_children())
+        self.nodes = {}
+        self.roots = {}
+        self.more_nodes = {}
+        # 旧条件下未完成的轮询结果会被丢弃，新的horizon读出之前不轮询
+        self._polling = False
+        self.horizon = None
+        self.summary_var.set("加载中...")
+        
+        def query():
+            horizon = self.store.max_id()
+            return horizon, self.store.severity_counts(dict(self.filters, max_id=horizon))
+        
+        self.submit(query, self.on_roots_loaded)
+    
+    def on_roots_loaded(self, result):
+        self.horizon, counts = result
+        for severity, count in counts.items():
+            self.add_severity_node(severity or 'unknown', count)
+        self.update_summary()
+    
+    def update_summary(self):
+        total = sum(self.nodes[iid]['count'] for iid in self.roots.values())
+        self.summary_var.set(f"共 {total} 条结果")
+    
+    def add_node(self, parent, level, key, filters, count, text, index=tk.END, tags=()):
+        iid = self.tree.insert(parent, index, text=text, values=(count, ''), tags=tags)
+        self.nodes[iid] = {'level': level, 'filters': filters, 'count': count,
+                           'populated': False, 'more': None, 'loading': False, 'children': {}}
+        if parent:
+            self.nodes[parent]['children'][key] = iid
+        # 占位子节点，使节点可以展开
+        self.tree.insert(iid, tk.END, text="...")
+        return iid
+    
+    def add_severity_node(self, severity, count):
+        order = {name: i for i, name in enumerate(self.SEVERITY_ORDER)}
+        position = sum(1 for name in self.roots if order.get(name, 99) < order.get(severity, 99))
+        filters = dict(self.filters, severity=severity)
+        iid = self.add_node('', self.SEVERITY, severity, filters, count, severity, position, (severity,))
+        self.roots[severity] = iid
+        return iid
+    
+    def on_open(self, event=None):
+        iid = self.tree.focus()
+        node = self.nodes.get(iid)
+        if node and not node['populated']:
+            node['populated'] = True
+            self.tree.delete(*self.tree.get_children(iid))
+            self.load_page(iid)
+    
+    def load_page(self, iid):
+        """读取一个节点的下一页子节点"""
+        node = self.nodes[iid]
+        node['loading'] = True
+        offset = len(node['children'])
+        filters = dict(node['filters'], max_id=self.horizon)
+        level = node['level']
+        if level == self.SEVERITY:
+            query = lambda: self.store.group_counts(filters, 'template_id', self.group_sort, self.PAGE_SIZE, offset)
+        elif level == self.TEMPLATE:
+            query = lambda: self.store.group_counts(filters, 'host', self.group_sort, self.PAGE_SIZE, offset)
+        else:
+            query = lambda: self.store.query(filters, self.leaf_sort, self.PAGE_SIZE, offset)
+        horizon = self.horizon
+        self.submit(query, lambda rows: self.on_page_loaded(iid, horizon, rows),
+                    lambda error: self.on_page_failed(iid))
+    
+    def on_page_failed(self, iid):
+        """读取失败：允许再次展开或滚动到“加载更多”时重试"""
+        node = self.nodes.get(iid)
+        if node is None:
+            return
+        node['loading'] = False
+        if node['more']:
+            self.tree.item(node['more'], text="加载更多...")
+        elif not node['children']:
+            # 第一页就失败：恢复占位子节点，折叠后再次展开时重新读取
+            node['populated'] = False
+            self.tree.insert(iid, tk.END, text="...")
+    
+    def on_page_loaded(self, iid, horizon, rows):
+        node = self.nodes.get(iid)
+        if node is None:
+            return
+        if horizon != self.horizon:
+            # 查询期间合并了新结果，按新的horizon重新读取，避免计数不一致
+            self.load_page(iid)
+            return
+        
+        node['loading'] = False
+        if node['more']:
+            self.more_nodes.pop(node['more'], None)
+            self.tree.delete(node['more'])
+            node['more'] = None
+        
+        severity = node['filters']['severity']
+        for row in rows:
+            if node['level'] == self.HOST:
+                if row[0] not in node['children']:
+                    self.add_finding(iid, row)
+                continue
+            key, count = row
+            if key in node['children']:
+                continue
+            if node['level'] == self.SEVERITY:
+                filters = dict(node['filters'], template_id=key)
+                self.add_node(iid, self.TEMPLATE, key, filters, count, key, tags=(severity,))
+            else:
+                filters = dict(node['filters'], host=key)
+                self.add_node(iid, self.HOST, key, filters, count, key)
+        
+        if len(rows) == self.PAGE_SIZE:
+            node['more'] = self.tree.insert(iid, tk.END, text="加载更多...", tags=('more',))
+            self.more_nodes[node['more']] = iid
+    
+    def add_finding(self, parent, row, index=tk.END):
+        finding_id, template_id, severity, host, matched_at, timestamp = row
+        iid = self.tree.insert(parent, index, text=matched_at, values=('', timestamp))
+        self.nodes[parent]['children'][finding_id] = iid
+        self.nodes[iid] = {'level': self.FINDING, 'id': finding_id}
+    
+    def on_scroll(self, first, last):
+        """滚动时检查“加载更多”节点是否进入可见区域"""
+        self.scrollbar.set(first, last)
+        for more, iid in list(self.more_nodes.items()):
+            if not self.nodes[iid]['loading'] and self.tree.bbox(more):
+                self.tree.item(more, text="加载中...")
+                self.load_page(iid)
+    
+    def on_double_click(self, event):
+        iid = self.tree.identify_row(event.y)
+        if iid in self.more_nodes:
+            parent = self.more_nodes[iid]
+            if not self.nodes[parent]['loading']:
+                self.load_page(parent)
+            return
+        node = self.nodes.get(iid)
+        if node is None:
+            return
+        if node['level'] != self.FINDING:
+            return
+        
+        data = self.store.get(node['id'])
+        detail = tk.Toplevel(self.window)
+        detail.title(self.tree.item(iid, 'text'))
+        detail.geometry("700x500")
+        text = scrolledtext.ScrolledText(detail, wrap=tk.WORD, font=("Consolas", 9))
+        text.pack(fill=tk.BOTH, expand=True)
+        try:
+            text.insert(tk.END, json.dumps(json.loads(data), ensure_ascii=False, indent=2))
+        except (TypeError, ValueError):
+            text.insert(tk.END, data or '')
+        text.config(state='disabled')
+    
+    def poll(self):
+        """定时把新写入的结果增量合并到树中"""
+        if not self.window.winfo_exists():
+            return
+        self.window.after(self.interval_ms, self.poll)
+        if self._polling or self.horizon is None:
+            return
+        
+        self._polling = True
+        generation = self.generation
+        filters = dict(self.filters, min_id=self.horizon)
+        
+        def query():
+            return self.store.query(filters, 'id', 5000)
+        
+        def failed(error):
+            # 查询失败（如写线程提交时数据库被锁）也要结束本次轮询，下次定时再试
+            if generation == self.generation:
+                self._polling = False
+        
+        def done(rows):
+            if generation != self.generation or self.horizon is None:
+                return
+            self._polling = False
+            # 查询期间horizon可能已前移，id不超过horizon的结果已经计入树中
+            rows = [row for row in rows if row[0] > self.horizon]
+            if rows:
+                self.merge(rows)
+        
+        self.submit(query, done, failed)
+    
+    def bump(self, iid, added=1):
+        node = self.nodes[iid]
+        node['count'] += added
+        self.tree.set(iid, 'count', node['count'])
+    
+    def merge(self, rows):
+        """合并一批新结果：更新各级计数，已展开且已完整加载的节点追加新的子节点
+        
+        正在加载的节点只更新已有子节点的计数：页面返回时horizon已变化，新的子节点按新的horizon重新读取
+        """
+        for row in rows:
+            finding_id, template_id, severity, host, matched_at, timestamp = row
+            severity = severity or 'unknown'
+            self.horizon = max(self.horizon, finding_id)
+            
+            iid = self.roots.get(severity)
+            if iid is None:
+                self.add_severity_node(severity, 1)
+                continue
+            self.bump(iid)
+            
+            for level, key in ((self.TEMPLATE, template_id), (self.HOST, host)):
+                node = self.nodes[iid]
+                if not node['populated']:
+                    break
+                child = node['children'].get(key)
+                if child is not None:
+                    self.bump(child)
+                    iid = child
+                    continue
+                if node['more'] is None and not node['loading']:
+                    filters = dict(node['filters'], **{'template_id' if level == self.TEMPLATE else 'host': key})
+                    tags = (severity,) if level == self.TEMPLATE else ()
+                    self.add_node(iid, level, key, filters, 1, key, tags=tags)
+                break
+            else:
+                node = self.nodes[iid]
+                if node['populated'] and not node['loading'] and node['more'] is None:
+                    self.add_finding(iid, row)
+        self.update_summary()
+
+
+class Sparkline:
+    """迷你折线图：按最近的一组取值画折线，右上角标注最新值"""
+    
+    def __init__(self, parent, title, width=180, height=40, color='#1f77b4'):
+        self.width = width
+        self.height = height
+        self.color = color
+        self.frame = ttk.Frame(parent)
+        ttk.Label(self.frame, text=title).pack(anchor=tk.W)
+        self.canvas = tk.Canvas(self.frame, width=width, height=height, bg='white',
+                                highlightthickness=1, highlightbackground='#cccccc')
+        self.canvas.pack()
+    
+    def set_values(self, values):
+        self.canvas.delete('all')
+        if not values:
+            return
+        top = max(values) or 1
+        step = (self.width - 4) / max(len(values) - 1, 1)
+        points = []
+        for i, value in enumerate(values):
+            points.extend((2 + i * step, self.height - 3 - value / top * (self.height - 14)))
+        if len(points) >= 4:
+            self.canvas.create_line(*points, fill=self.color)
+        self.canvas.create_text(self.width - 3, 2, anchor=tk.NE, text=str(values[-1]), font=('TkDefaultFont', 8))
+
+
+class ScanJobsWindow:
+    """扫描任务状态和监控窗口：定时刷新每个任务的状态、用时和 nuclei 统计，整体指标画成迷你折线图"""
+    
+    def __init__(self, root, scheduler, metrics=None, interval_ms=500):
+        self.scheduler = scheduler
+        self.metrics = metrics
+        self.interval_ms = interval_ms
+        # 任务序号 -> 已显示的状态，只刷新有变化的行
+        self.shown = {}
+        
+        self.window = tk.Toplevel(root)
+        self.window.title("扫描任务状态")
+        self.window.geometry("900x480")
+        
+        toolbar = ttk.Frame(self.window)
+        toolbar.pack(fill=tk.X, padx=4, pady=4)
+        ttk.Button(toolbar, text="取消选中任务", command=self.cancel_selected).pack(side=tk.LEFT, padx=(0, 4))
+        ttk.Button(toolbar, text="全部取消", command=self.scheduler.cancel_all).pack(side=tk.LEFT, padx=(0, 4))
+        ttk.Button(toolbar, text="导出监控数据", command=self.export_metrics).pack(side=tk.LEFT, padx=(0, 8))
+        self.summary_var = tk.StringVar()
+        ttk.Label(toolbar, textvariable=self.summary_var).pack(side=tk.LEFT)
+        
+        # 整体指标和时间序列
+        dashboard = ttk.Frame(self.window)
+        dashboard.pack(fill=tk.X, padx=4, pady=(0, 4))
+        self.metrics_var = tk.StringVar(value="等待 nuclei 统计输出...")
+        ttk.Label(dashboard, textvariable=self.metrics_var).pack(anchor=tk.W)
+        charts = ttk.Frame(dashboard)
+        charts.pack(fill=tk.X)
+        self.sparklines = []
+        for title, color in (("请求/秒", '#1f77b4'), ("错误数", '#d62728'), ("匹配数", '#2ca02c'), ("完成 %", '#9467bd')):
+            sparkline = Sparkline(charts, title, color=color)
+            sparkline.frame.pack(side=tk.LEFT, padx=(0, 8))
+            self.sparklines.append(sparkline)
+        
+        frame = ttk.Frame(self.window)
+        frame.pack(fill=tk.BOTH, expand=True, padx=4, pady=(0, 4))
+        columns = ('index', 'target', 'status', 'duration', 'progress', 'rps', 'errors', 'matched', 'eta')
+        self.tree = ttk.Treeview(frame, columns=columns, show='headings', selectmode='extended')
+        for column, title, width in (('index', "序号", 50), ('target', "目标", 300),
+                                     ('status', "状态", 70), ('duration', "用时", 70),
+                                     ('progress', "进度", 60), ('rps', "请求/秒", 60),
+                                     ('errors', "错误", 60), ('matched', "匹配", 60), ('eta', "剩余", 70)):
+            self.tree.heading(column, text=title)
+            self.tree.column(column, width=width, stretch=(column == 'target'))
+        scrollbar = ttk.Scrollbar(frame, orient=tk.VERTICAL, command=self.tree.yview)
+        self.tree.configure(yscrollcommand=scrollbar.set)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        
+        for job in scheduler.jobs:
+            self.tree.insert('', tk.END, iid=str(job.index),
+                             values=(job.index, job.target, ScanJob.STATUS_NAMES[job.status]))
+            self.shown[job.index] = job.status
+        
+        self.refresh()
+    
+    def cancel_selected(self):
+        jobs = {str(job.index): job for job in self.scheduler.jobs}
+        for iid in self.tree.selection():
+            job = jobs.get(iid)
+            if job and job.status in (ScanJob.QUEUED, ScanJob.RUNNING):
+                self.scheduler.cancel(job)
+    
+    def refresh(self):
+        if not self.window.winfo_exists():
+            return
+        
+        for job in self.scheduler.jobs:
+            if job.status == ScanJob.QUEUED:
+                continue
+            if job.status == ScanJob.RUNNING or self.shown[job.index] != job.status:
+                self.shown[job.index] = job.status
+                self.tree.item(str(job.index), values=self.job_values(job))
+        
+        counts = self.scheduler.counts()
+        self.summary_var.set("  ".join(f"{ScanJob.STATUS_NAMES[status]}: {count}"
+                                       for status, count in counts.items()))
+        self.refresh_metrics()
+        if self.scheduler.finished is None:
+            self.window.after(self.interval_ms, self.refresh)
+    
+    def job_values(self, job):
+        values = (job.index, job.target, ScanJob.STATUS_NAMES[job.status], format_duration(job.duration()))
+        stats, fraction, eta = self.metrics.job_stats(job) if self.metrics else (None, 0.0, None)
+        if not stats:
+            return values
+        return values + (f"{fraction * 100:.0f}%", stats['rps'] if job.status == ScanJob.RUNNING else '',
+                         stats['errors'], stats['matched'], format_duration(eta) if eta else '')
+    
+    def refresh_metrics(self):
+        if not self.metrics or not self.metrics.latest:
+            return
+        total = self.metrics.aggregate()
+        text = (f"速率 {total['rps']} 请求/秒 | 请求 {total['requests']} | 错误 {total['errors']} | "
+                f"匹配 {total['matched']} | 完成 {total['progress'] * 100:.1f}%")
+        if total['eta'] is not None and self.scheduler.finished is None:
+            text += f" | 预计剩余 {format_duration(total['eta'])}"
+        self.metrics_var.set(text)
+        history = self.metrics.history()
+        for i, sparkline in enumerate(self.sparklines, 1):
+            values = [sample[i] for sample in history]
+            # 完成比例显示为百分数
+            sparkline.set_values([round(value * 100) for value in values] if i == 4 else values)
+    
+    def export_metrics(self):
+        """把本次扫描的 nuclei 统计导出为 CSV（原始 JSONL 保存在 work/metrics 下）"""
+        if not self.metrics or not self.metrics.path or not self.metrics.latest:
+            messagebox.showinfo("提示", "还没有监控数据", parent=self.window)
+            return
+        path = filedialog.asksaveasfilename(
+            parent=self.window, title="导出监控数据", defaultextension=".csv",
+            initialfile=os.path.splitext(os.path.basename(self.metrics.path))[0] + ".csv",
+            filetypes=[("CSV文件", "*.csv"), ("JSONL文件", "*.jsonl")])
+        if not path:
+            return
+        self.metrics.flush()
+        try:
+            if path.endswith('.jsonl'):
+                shutil.copyfile(self.metrics.path, path)
+                rows = None
+            else:
+                rows = ScanMetrics.export_csv(self.metrics.path, path)
+        except OSError as e:
+            messagebox.showerror("错误", f"导出失败: {e}", parent=self.window)
+            return
+        messagebox.showinfo("提示", f"已导出到 {path}" + (f"（{rows} 条统计）" if rows is not None else ""),
+                            parent=self.window)
+
+
+class ResumeJobsDialog:
+    """未完成批量任务列表：选择要恢复或删除的任务"""
+    
+    def __init__(self, root, jobs, on_resume, on_delete):
+        self.jobs = jobs
+        self.on_resume = on_resume
+        self.on_delete = on_delete
+        
+        self.window = tk.Toplevel(root)
+        self.window.title("恢复批量扫描任务")
+        self.window.geometry("760x300")
+        
+        self.listbox = tk.Listbox(self.window, exportselection=False)
+        self.listbox.pack(fill=tk.BOTH, expand=True, padx=4, pady=4)
+        for job in jobs:
+            self.listbox.insert(tk.END, job.describe())
+        if jobs:
+            self.listbox.selection_set(0)
+        
+        buttons = ttk.Frame(self.window)
+        buttons.pack(fill=tk.X, padx=4, pady=(0, 4))
+        ttk.Button(buttons, text="恢复", command=self.resume).pack(side=tk.LEFT, padx=(0, 4))
+        ttk.Button(buttons, text="删除", command=self.delete).pack(side=tk.LEFT, padx=(0, 4))
+        ttk.Button(buttons, text="关闭", command=self.window.destroy).pack(side=tk.RIGHT)
+    
+    def selected(self):
+        selection = self.listbox.curselection()
+        return self.jobs[selection[0]] if selection else None
+    
+    def resume(self):
+        job = self.selected()
+        if job:
+            self.window.destroy()
+            self.on_resume(job)
+    
+    def delete(self):
+        job = self.selected()
+        if job and messagebox.askyesno("确认删除", f"删除任务 {job.id} 及其结果文件？", parent=self.window):
+            self.on_delete(job)
+            index = self.jobs.index(job)
+            del self.jobs[index]
+            self.listbox.delete(index)
+
+
+class QueueWindow:
+    """任务队列窗口：调整顺序和优先级，暂停、继续、取消或删除任务，设置同时运行的任务数"""
+    
+    def __init__(self, root, runner, on_remove, interval_ms=1000):
+        self.runner = runner
+        self.on_remove = on_remove
+        self.interval_ms = interval_ms
+        # 队列任务id -> 已显示的行，只刷新有变化的行
+        self.shown = {}
+        
+        self.window = tk.Toplevel(root)
+        self.window.title("任务队列")
+        self.window.geometry("900x400")
+        
+        toolbar = ttk.Frame(self.window)
+        toolbar.pack(fill=tk.X, padx=4, pady=4)
+        for text, command in (("上移", lambda: self.move(-1)), ("下移", lambda: self.move(1)),
+                              ("提高优先级", lambda: self.change_priority(1)),
+                              ("降低优先级", lambda: self.change_priority(-1)),
+                              ("暂停", lambda: self.apply(runner.pause)), ("继续", lambda: self.apply(runner.resume)),
+                              ("取消", lambda: self.apply(runner.cancel)), ("删除", self.remove)):
+            ttk.Button(toolbar, text=text, command=command).pack(side=tk.LEFT, padx=(0, 4))
+        ttk.Label(toolbar, text="同时运行:").pack(side=tk.LEFT, padx=(8, 4))
+        self.limit_var = tk.IntVar(value=runner.limit)
+        ttk.Spinbox(toolbar, from_=1, to=16, width=4, textvariable=self.limit_var,
+                    command=self.change_limit).pack(side=tk.LEFT)
+        self.summary_var = tk.StringVar()
+        ttk.Label(toolbar, textvariable=self.summary_var).pack(side=tk.LEFT, padx=(8, 0))
+        
+        frame = ttk.Frame(self.window)
+        frame.pack(fill=tk.BOTH, expand=True, padx=4, pady=(0, 4))
+        columns = ('id', 'title', 'priority', 'state', 'progress', 'targets', 'created', 'message')
+        self.tree = ttk.Treeview(frame, columns=columns, show='headings', selectmode='extended')
+        for column, title, width in (('id', "编号", 50), ('title', "任务", 260), ('priority', "优先级", 60),
+                                     ('state', "状态", 70), ('progress', "分片", 80), ('targets', "目标数", 70),
+                                     ('created', "加入时间", 140), ('message', "说明", 200)):
+            self.tree.heading(column, text=title)
+            self.tree.column(column, width=width, stretch=(column in ('title', 'message')))
+        scrollbar = ttk.Scrollbar(frame, orient=tk.VERTICAL, command=self.tree.yview)
+        self.tree.configure(yscrollcommand=scrollbar.set)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        
+        self.refresh()
+    
+    def selected_ids(self):
+        return [int(iid) for iid in self.tree.selection()]
+    
+    def apply(self, action):
+        for entry_id in self.selected_ids():
+            action(entry_id)
+        self.refresh(reschedule=False)
+    
+    def move(self, delta):
+        ids = self.selected_ids()
+        # 多选下移时从最后一个开始移动，保持相对顺序
+        for entry_id in (reversed(ids) if delta > 0 else ids):
+            self.runner.queue.move(entry_id, delta)
+        self.refresh(reschedule=False)
+    
+    def change_priority(self, delta):
+        for entry_id in self.selected_ids():
+            entry = self.runner.queue.get(entry_id)
+            if entry:
+                self.runner.queue.set_priority(entry_id, entry['priority'] + delta)
+        self.refresh(reschedule=False)
+    
+    def change_limit(self):
+        try:
+            self.runner.set_limit(self.limit_var.get())
+        except (tk.TclError, ValueError):
+            pass
+    
+    def remove(self):
+        ids = self.selected_ids()
+        if ids and self.on_remove(ids, parent=self.window):
+            self.refresh(reschedule=False)
+    
+    def refresh(self, reschedule=True):
+        if not self.window.winfo_exists():
+            return
+        
+        entries = self.runner.queue.entries()
+        order = [str(entry['id']) for entry in entries]
+        for iid in set(self.shown) - set(order):
+            self.tree.delete(iid)
+            del self.shown[iid]
+        for index, entry in enumerate(entries):
+            iid = order[index]
+            completed, shards = self.runner.progress(entry)
+            values = (entry['id'], entry['title'], entry['priority'], ScanQueue.STATE_NAMES[entry['state']],
+                      f"{completed}/{shards}", entry['targets'], entry['created'] or '', entry['message'])
+            if iid not in self.shown:
+                self.tree.insert('', index, iid=iid, values=values)
+            elif self.shown[iid] != values:
+                self.tree.item(iid, values=values)
+            if self.tree.index(iid) != index:
+                self.tree.move(iid, '', index)
+            self.shown[iid] = values
+        
+        counts = self.runner.queue.counts()
+        self.summary_var.set("  ".join(f"{ScanQueue.STATE_NAMES[state]}: {count}"
+                                       for state, count in counts.items() if count))
+        if reschedule:
+            self.window.after(self.interval_ms, self.refresh)
+
+
+class LagProbe:
+    """主循环延迟探针：定时用 after 安排回调，实际执行时间比预定时间晚多少就是主线程被占用的时长"""
+    
+    # 超过该延迟（毫秒）记为一次卡顿
+    STALL_MS = 200
+    
+    def __init__(self, root, interval_ms=100, diagnostics=DIAGNOSTICS):
+        self.root = root
+        self.interval_ms = interval_ms
+        self.diagnostics = diagnostics
+        self.stalls = 0
+        self.worst_ms = 0.0
+        self._expected = None
+    
+    def start(self):
+        self._expected = time.perf_counter() + self.interval_ms / 1000.0
+        self.root.after(self.interval_ms, self._tick)
+    
+    def _tick(self):
+        lag_ms = max((time.perf_counter() - self._expected) * 1000, 0.0)
+        self.diagnostics.record('mainloop.lag', lag_ms)
+        if lag_ms >= self.STALL_MS:
+            self.stalls += 1
+        self.worst_ms = max(self.worst_ms, lag_ms)
+        self.start()
+
+
+class DiagnosticsWindow:
+    """诊断窗口：热点路径和主循环延迟的计时统计，性能采集开关，导出诊断JSON"""
+    
+    COLUMNS = (('name', "计时点", 220), ('count', "次数", 70), ('p50_ms', "p50(ms)", 80),
+               ('p95_ms', "p95(ms)", 80), ('max_ms', "最大(ms)", 80), ('total_ms', "合计(ms)", 90))
+    
+    def __init__(self, root, on_export, interval_ms=1000):
+        self.on_export = on_export
+        self.interval_ms = interval_ms
+        self.window = tk.Toplevel(root)
+        self.window.title("诊断")
+        self.window.geometry("720x420")
+        
+        toolbar = ttk.Frame(self.window)
+        toolbar.pack(fill=tk.X, padx=4, pady=4)
+        self.profile_btn = ttk.Button(toolbar, command=self.toggle_profile)
+        self.profile_btn.pack(side=tk.LEFT, padx=(0, 4))
+        # 采样模式：后台线程定时抓取所有线程的调用栈；否则用 cProfile 采集主线程
+        self.sampling_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(toolbar, text="采样模式（所有线程）", variable=self.sampling_var).pack(side=tk.LEFT, padx=(0, 8))
+        ttk.Button(toolbar, text="导出诊断JSON", command=self.on_export).pack(side=tk.LEFT)
+        self.update_profile_button()
+        
+        frame = ttk.Frame(self.window)
+        frame.pack(fill=tk.BOTH, expand=True, padx=4, pady=(0, 4))
+        self.tree = ttk.Treeview(frame, columns=[c[0] for c in self.COLUMNS], show='headings')
+        for column, title, width in self.COLUMNS:
+            self.tree.heading(column, text=title)
+            self.tree.column(column, width=width, stretch=(column == 'name'))
+        scrollbar = ttk.Scrollbar(frame, orient=tk.VERTICAL, command=self.tree.yview)
+        self.tree.configure(yscrollcommand=scrollbar.set)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.refresh()
+    
+    def refresh(self):
+        if not self.window.winfo_exists():
+            return
+        for name, stats in DIAGNOSTICS.summary().items():
+            values = (name,) + tuple(stats[column] for column, _, _ in self.COLUMNS[1:])
+            if self.tree.exists(name):
+                self.tree.item(name, values=values)
+            else:
+                self.tree.insert('', tk.END, iid=name, values=values)
+        self.window.after(self.interval_ms, self.refresh)
+    
+    def update_profile_button(self):
+        self.profile_btn.config(text="停止性能采集" if DIAGNOSTICS.profiling() else "开始性能采集")
+    
+    def toggle_profile(self):
+        if DIAGNOSTICS.profiling():
+            profile = DIAGNOSTICS.stop_profile()
+            top = "\n".join(row['function'] for row in profile['functions'][:10])
+            messagebox.showinfo("性能采集", f"采集结束，导出诊断JSON可查看完整结果。耗时最多的函数:\n{top}",
+                                parent=self.window)
+        else:
+            DIAGNOSTICS.start_profile(sampling=self.sampling_var.get())
+        self.update_profile_button()
+
+
+class StartupTimeline:
+    """启动各阶段的时间点（毫秒，从创建主窗口前开始计），同时记入诊断计时（startup.阶段名）"""
+    
+    def __init__(self, started=None, diagnostics=DIAGNOSTICS):
+        self.started = started if started is not None else time.perf_counter()
+        self.diagnostics = diagnostics
+        self.marks = {}
+    
+    def mark(self, name):
+        """记录阶段完成的时间（每个阶段只记录第一次），返回距启动的秒数"""
+        if name not in self.marks:
+            self.marks[name] = round((time.perf_counter() - self.started) * 1000, 3)
+            self.diagnostics.record(f"startup.{name}", self.marks[name])
+        return self.marks[name] / 1000
+
 
 class NucleiGUI:
-    def __init__(self, root):
+    # nuclei -tl 读取过程中刷新已读部分的间隔（秒）
+    STREAM_INTERVAL = 0.25
+    
+    def __init__(self, root, started=None):
+        # 启动计时：started 为创建主窗口前的 time.perf_counter()，界面先显示，模板和任务在后台分阶段加载
+        self.startup = StartupTimeline(started)
         self.root = root
         self.root.title("Nuclei GUI Tool v1.0 -by Jielun")
         self.root.geometry("1100x800")
         
-        # 存储模板列表
-        self.templates = []
+        # 官方模板目录（TemplateCatalog，路径按目录压缩、用整数id表示）
+        self.templates = TemplateCatalog()
         self.filtered_templates = []
-        # 存储批量扫描的目标URL列表
-        self.batch_targets = []
-        # 存储自定义POC模板
-        self.custom_templates = []
+        # 扫描目标（按规范化URL去重，大文件在后台分块读取）
+        self.target_store = TargetStore()
+        self.target_loading = False
+        # 自定义POC模板目录
+        self.custom_templates = TemplateCatalog()
         self.filtered_custom_templates = []
-        
-        # 模板缓存文件路径
-        self.cache_file = "templates_cache.json"
-        self.cache_expiry_hours = 24
-        
-        # ANSI颜色到Tkinter颜色的映射
-        self.ansi_color_map = {
-            '30': 'black', '31': 'red', '32': 'green', '33': 'yellow',
-            '34': 'blue', '35': 'magenta', '36': 'cyan', '37': 'white',
-            '90': 'gray', '91': 'lightcoral', '92': 'lightgreen', 
-            '93': 'lightyellow', '94': 'lightblue', '95': 'pink', '96': 'lightcyan'
-        }
+        # 扫描引擎：命令构建、进程调度和超时、结果入库、可恢复的批量任务（不访问界面控件）
+        self.engine = ScanEngine("./work")
+        # 界面扫描和所有队列任务共用的速率预算和进程数上限（取界面上的设置）
+        self.rate_budget = RateBudget()
+        self.engine.budget = self.rate_budget
+        
+        # 模板缓存：官方和自定义模板分开存放，按目录指纹判断是否有效
+        self.official_cache = TemplateCache("./work/templates_official.cache")
+        self.custom_cache = TemplateCache("./work/templates_custom.cache")
+        # 旧版本使用的JSON缓存，清除缓存时一并删除
+        self.legacy_cache_file = "templates_cache.json"
+        # 自定义POC目录扫描器：记录每个目录的mtime，定时轮询只处理有变化的目录
+        self.custom_scanner = CustomTemplateScanner()
+        self.custom_state_file = self.custom_cache.path + ".dirs"
+        self.custom_poll_ms = 30000
+        self.custom_scan_busy = False
+        
+        # 模板元数据索引（严重级别/标签/协议/作者），保存在本地SQLite中
+        self.templates_dir = find_templates_dir()
+        try:
+            self.metadata_index = TemplateMetadataIndex()
+        except sqlite3.Error:
+            self.metadata_index = None
+        self.metadata_ready = {'official': False, 'custom': False}
+        self.engine.metadata_index = self.metadata_index
         
         # 创建界面
         self.create_widgets()
         
-        # 启动时尝试从缓存加载模板列表
-        self.load_template_list_from_cache()
+        # ANSI渲染器：保留跨块的颜色状态（换行处清除），按需创建标签
+        self.ansi_renderer = AnsiRenderer(ensure_tag=self.ensure_text_tag)
+        
+        # 输出管道：所有线程的输出统一经由队列批量刷新
+        self.output_pipeline = OutputPipeline(self.root, self.output_text, self.render_output)
+        self.output_pipeline.on_stats = self.update_output_stats
+        self.output_pipeline.max_lines = self.scrollback_var.get()
+        
+        # 模板搜索：后台索引 + 按键防抖，结果经输出管道交给主线程（先于积压的输出）
+        self.template_search = SearchController(self.root, self.apply_template_search, self.output_pipeline.call_soon)
+        self.custom_template_search = SearchController(self.root, self.apply_custom_template_search,
+                                                       self.output_pipeline.call_soon)
+        
+        # 本次会话的完整输出写入磁盘，界面只保留最近的部分
+        try:
+            self.session_log = SessionLog()
+            self.output_pipeline.session_log = self.session_log
+        except OSError as e:
+            self.session_log = None
+            messagebox.showwarning("警告", f"无法创建会话日志: {e}")
+        
+        # 结构化扫描结果库
+        self.findings_browser = None
+        self.diagnostics_window = None
+        try:
+            self.findings_store = FindingsStore()
+            self.findings_store.on_insert = lambda added: self.output_pipeline.call(self.update_findings_stats)
+            self.findings_store.on_error = lambda text: self.insert_colored_text(f"{text}\n", 'red')
+        except (OSError, sqlite3.Error) as e:
+            self.findings_store = None
+            messagebox.showwarning("警告", f"无法打开扫描结果库: {e}")
+        self.engine.findings_store = self.findings_store
+        # 引擎的日志经输出管道显示；结束回调在进程事件循环线程中调用，经输出管道转到主线程
+        self.engine.on_log = self.insert_colored_text
+        self.engine.on_start = self.on_scan_started
+        self.engine.on_finish = lambda scheduler: self.output_pipeline.call(self.on_scan_finished, scheduler)
+        
+        # 持久化的任务队列：扫描进行中时新的扫描排队运行，程序重启后继续
+        self.queue_window = None
+        self.templates_updating = False
+        try:
+            self.scan_queue = ScanQueue()
+            # 界面直接发起的扫描也计入队列的同时运行数
+            self.queue_runner = QueueRunner(self.scan_queue, self.make_queue_engine,
+                                            external=lambda: int(self.engine.is_running()))
+            self.queue_limit_var.set(self.queue_runner.limit)
+        except (OSError, sqlite3.Error) as e:
+            self.scan_queue = None
+            self.queue_runner = None
+            messagebox.showwarning("警告", f"无法打开任务队列: {e}")
+        
+        self.output_pipeline.start()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        # 主循环延迟探针，数据在“诊断”窗口中查看
+        self.lag_probe = LagProbe(self.root)
+        self.lag_probe.start()
+        
+        if self.session_log:
+            self.insert_colored_text(f"本次会话完整日志: {self.session_log.path}\n", 'gray')
+        
+        # 窗口先显示，模板缓存、自定义模板状态和未完成的任务在后台读取
+        self.startup.mark('init')
+        self.root.after_idle(self.start_staged_loading)
+        self.root.after(self.custom_poll_ms, self.poll_custom_templates)
     
     def create_widgets(self):
         """创建GUI组件"""
@@ -111,7 +1765,7 @@ class NucleiGUI:
         single_url_frame = ttk.Frame(url_frame)
         single_url_frame.grid(row=0, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(0, 4))
         
-        ttk.Label(single_url_frame, text="单个目标URL:").grid(row=0, column=0, sticky=tk.W)
+        ttk.Label(single_url_frame, text="目标URL/表达式:").grid(row=0, column=0, sticky=tk.W)
         self.url_entry = ttk.Entry(single_url_frame)
         self.url_entry.grid(row=0, column=1, sticky=(tk.W, tk.E), padx=(4, 4), pady=(0, 4))
         
@@ -139,13 +1793,8 @@ class NucleiGUI:
         batch_display_frame.columnconfigure(0, weight=1)
         batch_display_frame.rowconfigure(0, weight=1)
         
-        # 批量目标列表框
-        self.batch_listbox = tk.Listbox(batch_display_frame, height=3, selectmode=tk.EXTENDED, exportselection=False)
-        batch_scrollbar = ttk.Scrollbar(batch_display_frame, orient=tk.VERTICAL, command=self.batch_listbox.yview)
-        self.batch_listbox.configure(yscrollcommand=batch_scrollbar.set)
-        
-        self.batch_listbox.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
-        batch_scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
+        # 批量目标列表（虚拟列表，只渲染可见行，百万级目标也不卡顿）
+        self.batch_listbox = VirtualListView(batch_display_frame, height=3)
         
         # 批量操作按钮框架
         batch_buttons_frame = ttk.Frame(url_frame)
@@ -170,6 +1819,76 @@ class NucleiGUI:
                                        command=self.start_batch_scan_all)
         self.batch_scan_btn.pack(side=tk.LEFT)
         
+        # 同时运行的nuclei进程数
+        ttk.Label(scan_buttons_frame, text="并发数:").pack(side=tk.LEFT, padx=(10, 4))
+        self.scan_workers_var = tk.IntVar(value=4)
+        ttk.Spinbox(scan_buttons_frame, from_=1, to=64, width=4,
+                    textvariable=self.scan_workers_var).pack(side=tk.LEFT, padx=(0, 5))
+        
+        ttk.Button(scan_buttons_frame, text="任务状态",
+                  command=self.open_jobs_window).pack(side=tk.LEFT, padx=(0, 5))
+        
+        self.resume_btn = ttk.Button(scan_buttons_frame, text="恢复任务",
+                                    command=self.resume_batch_scan)
+        self.resume_btn.pack(side=tk.LEFT, padx=(0, 5))
+        
+        self.stop_btn = ttk.Button(scan_buttons_frame, text="停止扫描",
+                                  command=self.stop_scan, state='disabled')
+        self.stop_btn.pack(side=tk.LEFT)
+        
+        # 超时设置：每个目标的整体超时和无输出超时，0表示不限制
+        timeout_frame = ttk.Frame(url_frame)
+        timeout_frame.grid(row=6, column=0, columnspan=2, sticky=tk.W, pady=(4, 0))
+        
+        ttk.Label(timeout_frame, text="单目标超时(秒):").pack(side=tk.LEFT)
+        self.wall_timeout_var = tk.IntVar(value=0)
+        ttk.Spinbox(timeout_frame, from_=0, to=86400, increment=60, width=6,
+                    textvariable=self.wall_timeout_var).pack(side=tk.LEFT, padx=(4, 8))
+        
+        ttk.Label(timeout_frame, text="无输出超时(秒):").pack(side=tk.LEFT)
+        self.idle_timeout_var = tk.IntVar(value=0)
+        ttk.Spinbox(timeout_frame, from_=0, to=86400, increment=60, width=6,
+                    textvariable=self.idle_timeout_var).pack(side=tk.LEFT, padx=(4, 8))
+        
+        ttk.Button(timeout_frame, text="重试超时目标",
+                  command=self.retry_timed_out_targets).pack(side=tk.LEFT)
+        
+        # 速率预算：所有nuclei进程合计，按运行中的进程自动拆分为每个进程的 -rl/-c/-bs，0表示不限制
+        rate_frame = ttk.Frame(url_frame)
+        rate_frame.grid(row=7, column=0, columnspan=2, sticky=tk.W, pady=(4, 0))
+        
+        ttk.Label(rate_frame, text="总速率(请求/秒):").pack(side=tk.LEFT)
+        self.rate_limit_var = tk.IntVar(value=0)
+        ttk.Spinbox(rate_frame, from_=0, to=100000, increment=50, width=6,
+                    textvariable=self.rate_limit_var).pack(side=tk.LEFT, padx=(4, 8))
+        
+        ttk.Label(rate_frame, text="总并发:").pack(side=tk.LEFT)
+        self.max_concurrency_var = tk.IntVar(value=0)
+        ttk.Spinbox(rate_frame, from_=0, to=10000, increment=25, width=6,
+                    textvariable=self.max_concurrency_var).pack(side=tk.LEFT, padx=(4, 8))
+        
+        ttk.Label(rate_frame, text="单主机(请求/秒):").pack(side=tk.LEFT)
+        self.host_rate_limit_var = tk.IntVar(value=0)
+        ttk.Spinbox(rate_frame, from_=0, to=10000, increment=5, width=6,
+                    textvariable=self.host_rate_limit_var).pack(side=tk.LEFT, padx=(4, 8))
+        
+        # 任务队列：按优先级排队，按“同时运行”的任务数运行；扫描进行中时点击扫描按钮也会加入队列
+        queue_frame = ttk.Frame(url_frame)
+        queue_frame.grid(row=8, column=0, columnspan=2, sticky=tk.W, pady=(4, 0))
+        
+        ttk.Button(queue_frame, text="加入队列",
+                  command=self.add_to_queue).pack(side=tk.LEFT, padx=(0, 5))
+        ttk.Label(queue_frame, text="优先级:").pack(side=tk.LEFT)
+        self.queue_priority_var = tk.IntVar(value=0)
+        ttk.Spinbox(queue_frame, from_=-9, to=9, width=4,
+                    textvariable=self.queue_priority_var).pack(side=tk.LEFT, padx=(4, 8))
+        ttk.Label(queue_frame, text="同时运行:").pack(side=tk.LEFT)
+        self.queue_limit_var = tk.IntVar(value=1)
+        ttk.Spinbox(queue_frame, from_=1, to=16, width=4, textvariable=self.queue_limit_var,
+                    command=self.change_queue_limit).pack(side=tk.LEFT, padx=(4, 8))
+        ttk.Button(queue_frame, text="任务队列",
+                  command=self.open_queue_window).pack(side=tk.LEFT)
+        
         # 搜索和模板选择框架
         template_frame = ttk.LabelFrame(left_frame, text="官方POC模板选择", padding="4")
         template_frame.grid(row=4, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S), pady=(8, 0))
@@ -200,21 +1919,18 @@ class NucleiGUI:
                                               command=self.deselect_all_official_templates)
         deselect_all_official_btn.pack(side=tk.LEFT)
         
+        # 保存选中的模板（官方+自定义）为预设，命令行模式可直接使用
+        ttk.Button(official_buttons_frame, text="保存为预设",
+                   command=self.save_preset).pack(side=tk.RIGHT)
+        
         # 模板列表框
         list_frame = ttk.Frame(template_frame)
         list_frame.grid(row=2, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
         list_frame.columnconfigure(0, weight=1)
         list_frame.rowconfigure(0, weight=1)
         
-        # 滚动条
-        scrollbar = ttk.Scrollbar(list_frame)
-        scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
-        
-        # 模板列表
-        self.template_listbox = tk.Listbox(list_frame, yscrollcommand=scrollbar.set, height=4,
-                                          selectmode=tk.MULTIPLE, exportselection=False)
-        self.template_listbox.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
-        scrollbar.config(command=self.template_listbox.yview)
+        # 模板列表（虚拟列表，只渲染可见行）
+        self.template_listbox = VirtualListView(list_frame, height=4, selection=CatalogSelection())
         
         # 新增：自定义POC模板选择框架
         custom_template_frame = ttk.LabelFrame(left_frame, text="自定义POC模板", padding="4")
@@ -266,15 +1982,10 @@ class NucleiGUI:
         custom_list_frame.columnconfigure(0, weight=1)
         custom_list_frame.rowconfigure(0, weight=1)
         
-        # 自定义POC滚动条
-        custom_scrollbar = ttk.Scrollbar(custom_list_frame)
-        custom_scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
-        
-        # 自定义POC列表
-        self.custom_template_listbox = tk.Listbox(custom_list_frame, yscrollcommand=custom_scrollbar.set, height=3,
-                                                selectmode=tk.MULTIPLE, exportselection=False)
-        self.custom_template_listbox.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
-        custom_scrollbar.config(command=self.custom_template_listbox.yview)
+        # 自定义POC列表（显示文件名，选择按完整路径记录）
+        self.custom_template_listbox = VirtualListView(custom_list_frame, height=3,
+                                                       display=os.path.basename,
+                                                       selection=CatalogSelection())
         
         # 右侧输出框
         output_frame = ttk.LabelFrame(right_frame, text="扫描输出", padding="4")
@@ -286,13 +1997,46 @@ class NucleiGUI:
                                                     wrap=tk.WORD, font=("Consolas", 9))
         self.output_text.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
         
+        # 滚动缓冲设置和完整日志查看
+        output_buttons_frame = ttk.Frame(output_frame)
+        output_buttons_frame.grid(row=1, column=0, sticky=(tk.W, tk.E), pady=(4, 0))
+        
+        ttk.Label(output_buttons_frame, text="保留行数:").pack(side=tk.LEFT)
+        self.scrollback_var = tk.IntVar(value=5000)
+        scrollback_spinbox = ttk.Spinbox(output_buttons_frame, from_=1000, to=1000000, increment=1000,
+                                         width=8, textvariable=self.scrollback_var,
+                                         command=self.update_scrollback_limit)
+        scrollback_spinbox.pack(side=tk.LEFT, padx=(4, 8))
+        scrollback_spinbox.bind('<FocusOut>', self.update_scrollback_limit)
+        scrollback_spinbox.bind('<Return>', self.update_scrollback_limit)
+        
+        ttk.Button(output_buttons_frame, text="查看完整日志",
+                  command=self.open_log_viewer).pack(side=tk.LEFT)
+        ttk.Button(output_buttons_frame, text="浏览扫描结果",
+                  command=self.open_findings_browser).pack(side=tk.LEFT, padx=(4, 0))
+        ttk.Button(output_buttons_frame, text="诊断",
+                  command=self.open_diagnostics).pack(side=tk.LEFT, padx=(4, 0))
+        
         # 预定义颜色标签
         self.setup_text_tags()
         
         # 状态栏
+        status_frame = ttk.Frame(self.root)
+        status_frame.pack(side=tk.BOTTOM, fill=tk.X, padx=8, pady=(0, 8))
+        
         self.status_var = tk.StringVar(value="就绪")
-        status_bar = ttk.Label(self.root, textvariable=self.status_var, relief=tk.SUNKEN)
-        status_bar.pack(side=tk.BOTTOM, fill=tk.X, padx=8, pady=(0, 8))
+        status_bar = ttk.Label(status_frame, textvariable=self.status_var, relief=tk.SUNKEN)
+        status_bar.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        
+        # 输出吞吐和队列积压
+        self.output_stats_var = tk.StringVar(value="输出: 0 行/秒 | 队列: 0")
+        output_stats_bar = ttk.Label(status_frame, textvariable=self.output_stats_var, relief=tk.SUNKEN)
+        output_stats_bar.pack(side=tk.RIGHT, padx=(4, 0))
+        
+        # 本次会话写入结果库的结果数
+        self.findings_var = tk.StringVar(value="结果: 新增 0 | 重复 0")
+        findings_bar = ttk.Label(status_frame, textvariable=self.findings_var, relief=tk.SUNKEN)
+        findings_bar.pack(side=tk.RIGHT, padx=(4, 0))
     
     def setup_text_tags(self):
         """设置文本颜色标签"""
@@ -303,67 +2047,121 @@ class NucleiGUI:
             'lightblue': 'lightblue', 'pink': 'pink', 'lightcyan': 'lightcyan', 'black': 'black'
         }
         
-        for tag_name, color in colors.items():
-            self.output_text.tag_config(tag_name, foreground=color)
-    
-    def parse_ansi_colors(self, text):
-        """解析ANSI颜色代码"""
-        ansi_escape = re.compile(r'\x1B\[([0-9;]*)([a-zA-Z])')
-        result_parts = []
-        last_end = 0
-        current_color = 'black'
-        
-        for match in ansi_escape.finditer(text):
-            if match.start() > last_end:
-                result_parts.append((text[last_end:match.start()], current_color))
-            
-            ansi_code = match.group(1)
-            ansi_command = match.group(2)
-            
-            if ansi_command == 'm':
-                codes = ansi_code.split(';')
-                for code in codes:
-                    if code in self.ansi_color_map:
-                        current_color = self.ansi_color_map[code]
-                        break
-            
-            last_end = match.end()
-        
-        if last_end < len(text):
-            result_parts.append((text[last_end:], current_color))
-        
-        return result_parts if result_parts else [(text, 'black')]
+        for tag_name, color in colors.items():
+            self.output_text.tag_config(tag_name, foreground=color)
+    
+    def ensure_text_tag(self, tag_name, options):
+        """按需创建ANSI样式标签"""
+        if options.get('bold'):
+            self.output_text.tag_config(tag_name, font=("Consolas", 9, "bold"))
+        else:
+            self.output_text.tag_config(tag_name, **options)
     
+    def render_output(self, text, color=None):
+        """将一段输出转换为 (文本, 标签) 片段列表"""
+        if color:
+            return [(text, (color,))]
+        return self.ansi_renderer.feed(text)
+    
+    @DIAGNOSTICS.timed('insert_colored_text')
     def insert_colored_text(self, text, color=None):
-        """向输出框插入带颜色的文本"""
+        """向输出框插入带颜色的文本（线程安全，实际插入由输出管道批量完成）"""
+        self.output_pipeline.write(text, color)
+    
+    def update_scrollback_limit(self, event=None):
+        """修改输出框保留的最大行数"""
         try:
-            if color:
-                self.output_text.insert(tk.END, text, color)
-            else:
-                colored_parts = self.parse_ansi_colors(text)
-                for part_text, part_color in colored_parts:
-                    if part_text.strip():
-                        self.output_text.insert(tk.END, part_text, part_color)
-            
-            self.output_text.see(tk.END)
-            self.root.update_idletasks()
-            
-        except Exception as e:
-            self.output_text.insert(tk.END, text)
-            self.output_text.see(tk.END)
+            max_lines = int(self.scrollback_var.get())
+        except (tk.TclError, ValueError):
+            return
+        self.output_pipeline.max_lines = max(max_lines, 100)
+    
+    def open_log_viewer(self):
+        """打开完整会话日志查看器"""
+        if not self.session_log:
+            messagebox.showwarning("警告", "会话日志不可用")
+            return
+        LogViewer(self.root, self.session_log)
+    
+    def open_findings_browser(self):
+        """打开扫描结果浏览器（已打开时切到前台）"""
+        if not self.findings_store:
+            messagebox.showwarning("警告", "扫描结果库不可用")
+            return
+        browser = self.findings_browser
+        if browser and browser.window.winfo_exists():
+            browser.window.lift()
+            return
+        self.findings_browser = FindingsBrowser(self.root, self.findings_store, self.output_pipeline.call_soon)
+    
+    def open_diagnostics(self):
+        """打开诊断窗口（已打开时切到前台）"""
+        window = self.diagnostics_window
+        if window and window.window.winfo_exists():
+            window.window.lift()
+            return
+        self.diagnostics_window = DiagnosticsWindow(self.root, self.export_diagnostics)
+    
+    def export_diagnostics(self):
+        """把计时统计、性能采集结果和当前界面状态写入 work/diagnostics 下的JSON文件，可附在问题报告中"""
+        pipeline = self.output_pipeline
+        scheduler = self.engine.scheduler
+        extra = {
+            'mainloop': {'stalls': self.lag_probe.stalls, 'stall_threshold_ms': LagProbe.STALL_MS,
+                         'worst_lag_ms': round(self.lag_probe.worst_ms, 3)},
+            'output': {'total_lines': pipeline.total_lines, 'lines_per_sec': round(pipeline.lines_per_sec, 1),
+                       'queue_depth': pipeline.depth(), 'trimmed_lines': pipeline.trimmed_lines},
+            'state': {'templates': len(self.templates), 'filtered_templates': len(self.filtered_templates),
+                      'custom_templates': len(self.custom_templates), 'targets': len(self.target_store),
+                      'target_entries': len(self.target_store.targets)},
+            'scan': {'running': self.engine.is_running(), 'title': self.engine.title,
+                     'jobs': scheduler.counts() if scheduler else None},
+            'startup_ms': self.startup.marks,
+            'memory': {'official_catalog': self.templates.memory(), 'custom_catalog': self.custom_templates.memory(),
+                       'official_search_index': self.template_search.index.memory(),
+                       'template_selection_bytes': sys.getsizeof(self.template_listbox.selected.bits)},
+        }
+        path = os.path.join("./work/diagnostics", datetime.now().strftime("diagnostics_%Y%m%d_%H%M%S.json"))
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            DIAGNOSTICS.dump(path, extra)
+        except OSError as e:
+            self.insert_colored_text(f"导出诊断数据失败: {e}\n", 'red')
+            return
+        self.insert_colored_text(f"诊断数据已导出到 {os.path.abspath(path)}\n", 'green')
+    
+    def on_close(self):
+        """关闭窗口前落盘会话日志"""
+        # 终止并回收所有nuclei进程，不留下孤儿进程；记录已完成的分片，下次启动后可以恢复
+        self.engine.shutdown()
+        if self.queue_runner:
+            # 运行中的队列任务记录检查点，下次启动后继续
+            self.queue_runner.shutdown()
+            self.scan_queue.close()
+        self.output_pipeline.stop()
+        if self.findings_store:
+            self.findings_store.close()
+        if self.session_log:
+            self.session_log.close()
+        self.root.destroy()
+    
+    def update_output_stats(self, lines_per_sec, depth):
+        """刷新输出吞吐统计"""
+        self.output_stats_var.set(f"输出: {lines_per_sec:.0f} 行/秒 | 队列: {depth}")
     
     def add_single_url(self):
-        """添加单个URL到目标列表"""
-        url = self.url_entry.get().strip()
-        if not url:
+        """添加单个URL或目标表达式（如 10.20.0.0/16:80,443）到目标列表"""
+        text = self.url_entry.get().strip()
+        if not text:
             messagebox.showwarning("警告", "请输入目标URL")
             return
         
-        if not url.startswith(('http://', 'https://')):
-            url = f"http://{url}"
-        
-        if url not in self.batch_targets:
-            self.batch_targets.append(url)
+        try:
+            url = self.target_store.add(text)
+        except ValueError as e:
+            messagebox.showwarning("警告", f"目标表达式无效: {e}")
+            return
+        if url:
             self.update_batch_listbox()
             self.insert_colored_text(f"已添加目标: {url}\n", 'green')
             self.url_entry.delete(0, tk.END)
@@ -380,75 +2178,92 @@ class NucleiGUI:
         if file_path:
             self.load_batch_targets(file_path)
     
+    @DIAGNOSTICS.timed('load_batch_targets')
     def load_batch_targets(self, file_path):
-        """加载批量目标URL"""
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-            
-            new_targets = []
-            valid_urls = 0
-            
-            for line in lines:
-                url = line.strip()
-                if url and not url.startswith('#'):
-                    if url.startswith(('http://', 'https://')):
-                        if url not in self.batch_targets and url not in new_targets:
-                            new_targets.append(url)
-                            valid_urls += 1
-                    else:
-                        full_url = f"http://{url}"
-                        if full_url not in self.batch_targets and full_url not in new_targets:
-                            new_targets.append(full_url)
-                            valid_urls += 1
-            
-            self.batch_targets.extend(new_targets)
-            self.batch_file_var.set(f"已选择: {os.path.basename(file_path)} (+{valid_urls}个目标)")
-            self.update_batch_listbox()
-            self.insert_colored_text(f"成功加载批量目标文件: {file_path}\n", 'green')
-            self.insert_colored_text(f"新增 {valid_urls} 个有效目标，总计 {len(self.batch_targets)} 个目标\n", 'green')
-            
-        except Exception as e:
-            messagebox.showerror("错误", f"读取文件失败: {e}")
-            self.insert_colored_text(f"读取批量目标文件失败: {e}\n", 'red')
+        """在后台分块读取批量目标文件，每读完一块刷新一次列表"""
+        if self.target_loading:
+            messagebox.showwarning("警告", "正在读取目标文件，请稍候")
+            return
+        self.target_loading = True
+        name = os.path.basename(file_path)
+        self.batch_file_var.set(f"正在读取: {name}")
+        
+        def on_progress(added, lines):
+            self.output_pipeline.call(self.on_targets_progress, name, added, lines)
+        
+        def run_load():
+            start = time.perf_counter()
+            skipped = []
+            try:
+                added, duplicates = self.target_store.load_file(file_path, on_progress, skipped)
+            except OSError as e:
+                self.output_pipeline.call(self.on_targets_loaded, file_path, None, e)
+                return
+            self.output_pipeline.call(self.on_targets_loaded, file_path,
+                                      (added, duplicates, skipped, time.perf_counter() - start), None)
+        
+        threading.Thread(target=run_load, daemon=True).start()
+    
+    def on_targets_progress(self, name, added, lines):
+        self.batch_file_var.set(f"正在读取: {name}（{lines} 行，+{added}个目标）")
+        self.update_batch_listbox()
     
+    def on_targets_loaded(self, file_path, result, error):
+        """目标文件读取结束（主线程）"""
+        self.target_loading = False
+        self.update_batch_listbox()
+        if error is not None:
+            self.batch_file_var.set("读取失败")
+            messagebox.showerror("错误", f"读取文件失败: {error}")
+            self.insert_colored_text(f"读取批量目标文件失败: {error}\n", 'red')
+            return
+        
+        added, duplicates, skipped, elapsed = result
+        # 后台读取的总耗时（load_batch_targets 本身只计主线程部分）
+        DIAGNOSTICS.record('load_batch_targets.read', elapsed * 1000)
+        self.batch_file_var.set(f"已选择: {os.path.basename(file_path)} (+{added}个目标)")
+        self.insert_colored_text(f"成功加载批量目标文件: {file_path}\n", 'green')
+        self.insert_colored_text(f"新增 {added} 个有效目标，重复 {duplicates} 个，"
+                                 f"总计 {len(self.target_store)} 个目标（{elapsed:.1f}s）\n", 'green')
+        if skipped:
+            self.insert_colored_text(format_skipped_targets(skipped), 'red')
+    
+    @DIAGNOSTICS.timed('update_batch_listbox')
     def update_batch_listbox(self):
-        """更新批量目标列表框"""
-        self.batch_listbox.delete(0, tk.END)
-        for target in self.batch_targets:
-            self.batch_listbox.insert(tk.END, target)
+        """刷新批量目标列表（只重绘可见行）"""
+        self.batch_listbox.set_items(self.target_store.targets)
     
     def clear_batch_list(self):
-        """清空批量目标列表"""
-        self.batch_targets = []
-        self.batch_listbox.delete(0, tk.END)
+        """清空批量目标列表（正在读取的文件随之停止）"""
+        self.target_store.clear()
+        self.batch_listbox.clear_selection()
+        self.update_batch_listbox()
         self.batch_file_var.set("未选择文件")
         self.insert_colored_text("已清空目标列表\n", 'green')
     
     def delete_selected_targets(self):
         """删除选中的目标"""
-        selected_indices = self.batch_listbox.curselection()
-        if selected_indices:
-            removed_count = 0
-            for index in sorted(selected_indices, reverse=True):
-                if index < len(self.batch_targets):
-                    removed_target = self.batch_targets.pop(index)
-                    removed_count += 1
-                    self.insert_colored_text(f"已移除目标: {removed_target}\n", 'red')
-            
-            self.update_batch_listbox()
-            self.insert_colored_text(f"已删除 {removed_count} 个目标，剩余 {len(self.batch_targets)} 个目标\n", 'green')
-        else:
+        selected = self.batch_listbox.selected_keys()
+        if not selected:
             messagebox.showwarning("警告", "请先选择要删除的目标")
+            return
+        
+        removed_count = self.target_store.remove(selected)
+        self.batch_listbox.discard(selected)
+        self.update_batch_listbox()
+        for target in selected[:20]:
+            self.insert_colored_text(f"已移除目标: {target}\n", 'red')
+        if len(selected) > 20:
+            self.insert_colored_text(f"... 等 {len(selected)} 个目标\n", 'red')
+        self.insert_colored_text(f"已删除 {removed_count} 个目标，剩余 {len(self.target_store)} 个目标\n", 'green')
     
     def select_all_official_templates(self):
         """全选官方POC模板"""
         try:
-            # 获取所有可见的模板（考虑搜索过滤）[8](@ref)
-            all_indices = list(range(len(self.filtered_templates)))
-            if all_indices:
-                self.template_listbox.selection_set(0, tk.END)
-                self.insert_colored_text(f"已全选 {len(all_indices)} 个官方POC模板\n", 'green')
+            # 选中所有可见的模板（考虑搜索过滤），已选中的其它模板保持不变
+            if self.filtered_templates:
+                count = self.template_listbox.select_all()
+                self.insert_colored_text(f"已全选 {count} 个官方POC模板\n", 'green')
             else:
                 self.insert_colored_text("官方POC模板列表为空，无法全选\n", 'red')
         except Exception as e:
@@ -457,10 +2272,9 @@ class NucleiGUI:
     def deselect_all_official_templates(self):
         """取消全选官方POC模板"""
         try:
-            selected_indices = self.template_listbox.curselection()
-            if selected_indices:
-                self.template_listbox.selection_clear(0, tk.END)
-                self.insert_colored_text(f"已取消选择 {len(selected_indices)} 个官方POC模板\n", 'green')
+            if self.template_listbox.selection_count():
+                count = self.template_listbox.clear_selection()
+                self.insert_colored_text(f"已取消选择 {count} 个官方POC模板\n", 'green')
             else:
                 self.insert_colored_text("没有选中的官方POC模板\n", 'red')
         except Exception as e:
@@ -469,11 +2283,10 @@ class NucleiGUI:
     def select_all_custom_templates(self):
         """全选自定义POC模板"""
         try:
-            # 获取所有可见的自定义模板（考虑搜索过滤）[8](@ref)
-            all_indices = list(range(len(self.filtered_custom_templates)))
-            if all_indices:
-                self.custom_template_listbox.selection_set(0, tk.END)
-                self.insert_colored_text(f"已全选 {len(all_indices)} 个自定义POC模板\n", 'green')
+            # 选中所有可见的自定义模板（考虑搜索过滤）
+            if self.filtered_custom_templates:
+                count = self.custom_template_listbox.select_all()
+                self.insert_colored_text(f"已全选 {count} 个自定义POC模板\n", 'green')
             else:
                 self.insert_colored_text("自定义POC模板列表为空，无法全选\n", 'red')
         except Exception as e:
@@ -482,10 +2295,9 @@ class NucleiGUI:
     def deselect_all_custom_templates(self):
         """取消全选自定义POC模板"""
         try:
-            selected_indices = self.custom_template_listbox.curselection()
-            if selected_indices:
-                self.custom_template_listbox.selection_clear(0, tk.END)
-                self.insert_colored_text(f"已取消选择 {len(selected_indices)} 个自定义POC模板\n", 'green')
+            if self.custom_template_listbox.selection_count():
+                count = self.custom_template_listbox.clear_selection()
+                self.insert_colored_text(f"已取消选择 {count} 个自定义POC模板\n", 'green')
             else:
                 self.insert_colored_text("没有选中的自定义POC模板\n", 'red')
         except Exception as e:
@@ -497,141 +2309,249 @@ class NucleiGUI:
         if not folder_path:
             return
         
+        self.add_custom_roots([folder_path])
+    
+    def add_custom_roots(self, roots):
+        """在后台扫描新增的自定义POC根目录，结果以增量方式合并到列表（可同时加载多个根目录）"""
+        if self.custom_scan_busy:
+            self.insert_colored_text("正在读取自定义POC文件夹，请稍后再试\n", 'red')
+            return
+        
+        self.custom_scan_busy = True
+        self.load_custom_btn.config(state='disabled')
+        self.status_var.set("正在读取自定义POC文件夹...")
+        
         def run_load_custom():
-            self.load_custom_btn.config(state='disabled')
-            self.status_var.set("正在读取自定义POC文件夹...")
-            self.insert_colored_text(f"正在读取自定义POC文件夹: {folder_path}\n", 'blue')
-            
+            added, removed = [], []
             try:
-                # 使用os.walk递归遍历文件夹
-                new_custom_templates = []
-                for root_dir, dirs, files in os.walk(folder_path):
-                    for file in files:
-                        if file.endswith('.yaml') or file.endswith('.yml'):
-                            full_path = os.path.join(root_dir, file)
-                            new_custom_templates.append(full_path)
+                for folder_path in roots:
+                    self.insert_colored_text(f"正在读取自定义POC文件夹: {folder_path}\n", 'blue')
+                    start = time.perf_counter()
+                    delta = self.custom_scanner.add_root(folder_path)
+                    if delta is None:
+                        self.insert_colored_text(f"{folder_path} 已包含在已加载的目录中\n", 'gray')
+                        continue
+                    added.extend(delta[0])
+                    removed.extend(delta[1])
+                    self.insert_colored_text(
+                        f"读取完成: {len(delta[0])} 个模板，用时 {time.perf_counter() - start:.1f}s\n", 'green')
                 
-                if new_custom_templates:
-                    self.custom_templates = new_custom_templates
-                    self.filtered_custom_templates = self.custom_templates.copy()
-                    
-                    # 保存自定义POC模板到缓存
-                    self.save_templates_to_cache()
-                    
-                    # 更新自定义POC列表框
-                    self.root.after(0, self.update_custom_template_listbox)
-                    self.insert_colored_text(f"成功加载 {len(new_custom_templates)} 个自定义POC模板\n", 'green')
-                    self.status_var.set(f"已加载 {len(new_custom_templates)} 个自定义POC")
-                else:
+                if added or removed:
+                    self.save_custom_cache()
+                elif not self.custom_scanner.dirs:
                     self.insert_colored_text("在所选文件夹中未找到.yaml或.yml文件\n", 'red')
-                    self.status_var.set("未找到自定义POC")
-                    
             except Exception as e:
                 self.insert_colored_text(f"读取自定义POC文件夹失败: {e}\n", 'red')
-                self.status_var.set("读取自定义POC失败")
-            finally:
-                self.load_custom_btn.config(state='normal')
+            
+            # 列表和控件只在主线程中修改
+            self.output_pipeline.call(self.on_custom_scanned, added, removed)
         
         threading.Thread(target=run_load_custom, daemon=True).start()
     
+    def poll_custom_templates(self):
+        """定时检查自定义POC目录的变化"""
+        self.root.after(self.custom_poll_ms, self.poll_custom_templates)
+        self.rescan_custom_templates()
+    
+    def rescan_custom_templates(self):
+        """在后台重新检查已加载的根目录，只重新列出mtime变化的目录"""
+        if self.custom_scan_busy or not self.custom_scanner.roots:
+            return
+        
+        self.custom_scan_busy = True
+        
+        def run_rescan():
+            added, removed = [], []
+            try:
+                added, removed = self.custom_scanner.rescan()
+                if added or removed:
+                    self.save_custom_cache()
+            except Exception as e:
+                self.insert_colored_text(f"检查自定义POC目录变化失败: {e}\n", 'red')
+            self.output_pipeline.call(self.on_custom_scanned, added, removed, True)
+        
+        threading.Thread(target=run_rescan, daemon=True).start()
+    
+    def on_custom_scanned(self, added, removed, watching=False):
+        """扫描结束（主线程）：合并增量并恢复控件状态"""
+        self.custom_scan_busy = False
+        self.load_custom_btn.config(state='normal')
+        if added or removed:
+            self.apply_custom_delta(added, removed)
+            if watching:
+                self.insert_colored_text(
+                    f"自定义POC目录有变化: +{len(added)} -{len(removed)}\n", 'blue')
+        if not watching:
+            if self.custom_templates:
+                self.status_var.set(f"已加载 {len(self.custom_templates)} 个自定义POC")
+            else:
+                self.status_var.set("未找到自定义POC")
+    
+    def apply_custom_delta(self, added, removed):
+        """把新增/删除的模板合并到自定义POC列表，搜索索引和元数据索引只处理增量"""
+        if not self.custom_templates:
+            self.custom_templates = TemplateCatalog(added)
+            self.update_custom_template_listbox()
+            return
+        
+        # 生成新的目录对象，视图中仍引用旧目录的搜索结果不受影响
+        if removed:
+            removed_set = set(removed)
+            templates = TemplateCatalog(tpl for tpl in self.custom_templates if tpl not in removed_set)
+            templates.extend(added)
+        else:
+            templates = self.custom_templates.extended(added)
+        self.custom_templates = templates
+        
+        # 选择迁移到新目录上（已删除的模板随之取消选择）
+        self.custom_template_listbox.retain(self.custom_templates)
+        self.custom_template_search.query = self.custom_search_var.get()
+        self.custom_template_search.apply_delta(added, removed)
+        
+        if not self.metadata_index:
+            return
+        
+        def run_index():
+            try:
+                self.metadata_index.apply_delta('custom', added, removed, self.resolve_template_path)
+            except Exception as e:
+                self.insert_colored_text(f"模板元数据索引失败: {e}\n", 'red')
+                return
+            # 新模板的元数据入库后重新执行当前查询
+            self.output_pipeline.call(self.custom_template_search.apply_delta, [], [])
+        
+        threading.Thread(target=run_index, daemon=True).start()
+    
     def update_custom_template_listbox(self):
         """更新自定义POC模板列表框显示"""
-        self.custom_template_listbox.delete(0, tk.END)
-        for template in self.custom_templates:
-            display_name = os.path.basename(template)
-            self.custom_template_listbox.insert(tk.END, f"{display_name}")
-        self.filtered_custom_templates = self.custom_templates.copy()
+        self.custom_template_listbox.retain(self.custom_templates)
+        # 重建搜索索引，完成后按当前搜索条件刷新视图
+        self.custom_template_search.query = self.custom_search_var.get()
+        self.custom_template_search.rebuild(self.custom_templates, self.metadata_lookup('custom'))
+        self.index_template_metadata('custom')
     
     def clear_custom_templates(self):
         """清空自定义POC列表"""
-        self.custom_templates = []
+        if self.custom_scan_busy:
+            self.insert_colored_text("正在读取自定义POC文件夹，请稍后再试\n", 'red')
+            return
+        
+        self.custom_scanner.clear()
+        self.custom_templates = TemplateCatalog()
         self.filtered_custom_templates = []
-        self.custom_template_listbox.delete(0, tk.END)
+        self.custom_template_listbox.clear_selection()
+        self.update_custom_template_listbox()
         self.insert_colored_text("已清空自定义POC列表\n", 'green')
         self.status_var.set("已清空自定义POC")
     
     def search_custom_templates(self, event=None):
-        """搜索过滤自定义POC模板"""
-        search_term = self.custom_search_var.get().lower()
-        
-        if not search_term:
-            self.filtered_custom_templates = self.custom_templates
-        else:
-            self.filtered_custom_templates = [tpl for tpl in self.custom_templates 
-                                           if search_term in tpl.lower()]
-        
-        # 更新自定义POC列表框显示
-        self.custom_template_listbox.delete(0, tk.END)
-        for template in self.filtered_custom_templates:
-            display_name = os.path.basename(template)
-            self.custom_template_listbox.insert(tk.END, f"{display_name} | {template}")
-    
-    def is_cache_valid(self):
-        """检查缓存是否有效"""
-        if not os.path.exists(self.cache_file):
-            return False
-        
-        try:
-            with open(self.cache_file, 'r', encoding='utf-8') as f:
-                cache_data = json.load(f)
-            
-            cache_time = datetime.fromisoformat(cache_data.get('timestamp', ''))
-            time_diff = datetime.now() - cache_time
-            return time_diff.total_seconds() < (self.cache_expiry_hours * 3600)
-            
-        except Exception:
-            return False
+        """搜索过滤自定义POC模板（防抖后在后台执行）"""
+        self.custom_template_search.schedule(self.custom_search_var.get())
+    
+    def apply_custom_template_search(self, templates):
+        """应用自定义POC搜索结果（只渲染可见行）"""
+        self.filtered_custom_templates = templates
+        self.custom_template_listbox.set_items(self.filtered_custom_templates)
     
-    def save_templates_to_cache(self):
-        """将模板列表保存到缓存文件"""
+    def save_official_cache(self):
+        """将官方模板列表连同当前模板目录指纹写入缓存"""
         try:
-            cache_data = {
-                'timestamp': datetime.now().isoformat(),
-                'templates': self.templates,
-                'custom_templates': self.custom_templates
-            }
-            
-            with open(self.cache_file, 'w', encoding='utf-8') as f:
-                json.dump(cache_data, f, ensure_ascii=False, indent=2)
-            
-            self.insert_colored_text(f"模板列表已缓存到 {self.cache_file}\n", 'green')
-            
+            fingerprint = official_templates_fingerprint(self.templates_dir)
+            self.official_cache.save(self.templates, fingerprint)
+            self.insert_colored_text(f"官方模板列表已缓存到 {self.official_cache.path}\n", 'green')
         except Exception as e:
             self.insert_colored_text(f"缓存保存失败: {e}\n", 'red')
     
-    def load_templates_from_cache(self):
-        """从缓存文件加载模板列表"""
+    def save_custom_cache(self):
+        """将自定义模板列表和各目录mtime写入缓存（不影响官方模板缓存，可在后台线程调用）"""
         try:
-            with open(self.cache_file, 'r', encoding='utf-8') as f:
-                cache_data = json.load(f)
-            
-            self.templates = cache_data.get('templates', [])
-            self.custom_templates = cache_data.get('custom_templates', [])
-            
-            # 更新模板列表框
-            self.root.after(0, self.update_template_listbox)
-            # 更新自定义POC列表框
-            self.root.after(0, self.update_custom_template_listbox)
-            
-            cache_time = datetime.fromisoformat(cache_data.get('timestamp', ''))
-            time_diff = datetime.now() - cache_time
-            hours = int(time_diff.total_seconds() / 3600)
-            
-            self.status_var.set(f"从缓存加载完成（{hours}小时前）")
-            self.insert_colored_text(f"从缓存加载了 {len(self.templates)} 个官方模板和 {len(self.custom_templates)} 个自定义模板\n", 'green')
-            return True
-            
+            scanner = self.custom_scanner
+            self.custom_cache.save(scanner.templates(), scanner.fingerprint(), roots=scanner.roots)
+            atomic_write_text(self.custom_state_file, json.dumps(scanner.export_state(), ensure_ascii=False))
+            self.insert_colored_text(f"自定义模板列表已缓存到 {self.custom_cache.path}\n", 'green')
         except Exception as e:
-            return False
+            self.insert_colored_text(f"缓存保存失败: {e}\n", 'red')
+    
+    @staticmethod
+    def cache_age_hours(header):
+        try:
+            cache_time = datetime.fromisoformat(header.get('timestamp', ''))
+        except (TypeError, ValueError):
+            return 0
+        return int((datetime.now() - cache_time).total_seconds() / 3600)
+    
+    def start_staged_loading(self):
+        """窗口显示后开始分阶段加载：后台线程依次读取，读完一项经输出管道在主线程显示一项"""
+        self.root.update_idletasks()
+        self.startup.mark('window')
+        threading.Thread(target=self.read_startup_data, daemon=True).start()
+    
+    def read_startup_data(self):
+        """后台线程：官方模板缓存 -> 自定义模板缓存和目录状态 -> 未完成的批量任务"""
+        call = self.output_pipeline.call
+        with DIAGNOSTICS.span('startup.read_official_cache'):
+            cached = self.official_cache.load(official_templates_fingerprint(self.templates_dir))
+        call(self.load_template_list_from_cache, cached)
+        with DIAGNOSTICS.span('startup.read_custom_cache'):
+            custom = self.read_custom_cache()
+        call(self.load_custom_templates_from_cache, *custom)
+        call(self.on_startup_loaded, BatchJob.unfinished(self.engine.jobs_dir))
+    
+    def on_startup_loaded(self, jobs):
+        """启动数据全部就绪（主线程）：提示未完成的任务，继续运行任务队列，报告启动用时"""
+        self.report_unfinished_jobs(jobs)
+        self.resume_queue()
+        ready = self.startup.mark('ready')
+        self.insert_colored_text(f"启动完成: 窗口显示 {self.startup.marks['window'] / 1000:.2f}s，"
+                                 f"后台加载完成 {ready:.2f}s\n", 'gray')
+    
+    def load_template_list_from_cache(self, cached):
+        """启动时应用后台读取的模板缓存（模板目录指纹不变即有效），无效时从命令获取"""
+        if cached is not None:
+            header, self.templates = cached
+            self.update_template_listbox()
+            elapsed = self.startup.mark('catalog')
+            self.status_var.set(f"从缓存加载完成（{self.cache_age_hours(header)}小时前）")
+            self.insert_colored_text(f"从缓存加载了 {len(self.templates)} 个官方模板（启动后 {elapsed:.2f}s）\n", 'green')
+        else:
+            self.insert_colored_text("缓存无效或不存在，从命令获取模板列表...\n", 'red')
+            self.load_template_list()
+    
+    def read_custom_cache(self):
+        """读取自定义模板缓存和目录状态（可在后台线程调用），返回 (根目录, 缓存, 目录状态)"""
+        header = self.custom_cache.read_header()
+        roots = header.get('roots', []) if header else []
+        if not roots:
+            return [], None, None
+        
+        cached = self.custom_cache.load()
+        try:
+            with open(self.custom_state_file, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = None
+        return roots, cached, state
     
-    def load_template_list_from_cache(self):
-        """启动时尝试从缓存加载模板列表"""
-        if self.is_cache_valid():
-            if self.load_templates_from_cache():
+    def load_custom_templates_from_cache(self, roots, cached, state):
+        """从缓存恢复自定义模板和目录状态，随后只增量检查有变化的目录"""
+        if not roots:
+            return
+        
+        if cached is not None and state and state.get('roots') == roots:
+            header, templates = cached
+            self.custom_scanner.import_state(state, templates)
+            if self.custom_scanner.fingerprint() == header.get('fingerprint'):
+                self.custom_templates = templates
+                self.update_custom_template_listbox()
+                self.insert_colored_text(f"从缓存加载了 {len(self.custom_templates)} 个自定义模板\n", 'green')
+                self.rescan_custom_templates()
                 return
+            self.custom_scanner.clear()
         
-        self.insert_colored_text("缓存无效或不存在，从命令获取模板列表...\n", 'red')
-        self.load_template_list()
+        roots = [root for root in roots if os.path.isdir(root)]
+        if roots:
+            self.insert_colored_text("自定义POC缓存不完整，重新读取...\n", 'blue')
+            self.add_custom_roots(roots)
     
     def force_refresh_templates(self):
         """强制刷新模板列表（查看所有当前安装的官方POC模板列表）"""
@@ -641,12 +2561,22 @@ class NucleiGUI:
     def clear_cache(self):
         """清除缓存文件"""
         try:
-            if os.path.exists(self.cache_file):
-                os.remove(self.cache_file)
-                # 同时清空内存中的自定义POC列表
-                self.custom_templates = []
-                self.filtered_custom_templates = []
-                self.custom_template_listbox.delete(0, tk.END)
+            removed = self.official_cache.clear()
+            removed = self.custom_cache.clear() or removed
+            if os.path.exists(self.custom_state_file):
+                os.remove(self.custom_state_file)
+            if os.path.exists(self.legacy_cache_file):
+                os.remove(self.legacy_cache_file)
+                removed = True
+            
+            if removed:
+                # 同时清空内存中的自定义POC列表（正在读取时保留，读取完成后重新写入缓存）
+                if not self.custom_scan_busy:
+                    self.custom_scanner.clear()
+                    self.custom_templates = TemplateCatalog()
+                    self.filtered_custom_templates = []
+                    self.custom_template_listbox.clear_selection()
+                    self.update_custom_template_listbox()
                 self.insert_colored_text("缓存已清除\n", 'green')
                 self.status_var.set("缓存已清除")
             else:
@@ -662,103 +2592,211 @@ class NucleiGUI:
             self.proxy_entry.config(state='disabled')
     
     def update_templates(self):
-        """更新Nuclei模板"""
-        def run_update():
-            self.scan_btn.config(state='disabled')
-            self.batch_scan_btn.config(state='disabled')
-            self.status_var.set("正在更新模板...")
-            self.insert_colored_text("正在更新Nuclei模板...\n", 'blue')
-            
-            try:
-                result = subprocess.run(["nuclei", "-update-templates"], 
-                                      capture_output=True, text=True, check=True)
-                self.insert_colored_text("模板更新成功！\n", 'green')
-                self.insert_colored_text(result.stdout + "\n", 'green')
-                self.force_refresh_templates()
-                
-            except subprocess.CalledProcessError as e:
-                self.insert_colored_text(f"模板更新失败: {e}\n", 'red')
-                if e.stderr:
-                    self.insert_colored_text(f"错误信息: {e.stderr}\n", 'red')
-            except FileNotFoundError:
-                self.insert_colored_text("错误: 未找到nuclei命令，请确保已安装Nuclei\n", 'red')
-            
-            self.status_var.set("就绪")
-            self.scan_btn.config(state='normal')
-            self.batch_scan_btn.config(state='normal')
+        """更新Nuclei模板（在进程事件循环中运行，输出边运行边显示）
         
-        threading.Thread(target=run_update, daemon=True).start()
+        更新期间新的扫描加入任务队列，队列暂不启动新任务，更新结束后继续
+        """
+        if self.templates_updating:
+            return
+        self.templates_updating = True
+        if self.queue_runner:
+            self.queue_runner.hold()
+        self.status_var.set("正在更新模板...")
+        self.insert_colored_text("正在更新Nuclei模板...\n", 'blue')
+        
+        future = self.engine.supervisor.run_command(
+            ["nuclei", "-update-templates"], lambda line, stream: self.insert_colored_text(line))
+        future.add_done_callback(lambda future: self.output_pipeline.call(self.on_templates_updated, future))
+    
+    def on_templates_updated(self, future):
+        """模板更新结束（主线程）：成功后作废缓存并重新读取模板列表"""
+        self.status_var.set("就绪")
+        self.templates_updating = False
+        if self.queue_runner:
+            self.queue_runner.release()
+        try:
+            returncode = future.result()
+        except FileNotFoundError:
+            self.insert_colored_text("错误: 未找到nuclei命令，请确保已安装Nuclei\n", 'red')
+            return
+        except OSError as e:
+            self.insert_colored_text(f"模板更新失败: {e}\n", 'red')
+            return
+        
+        if returncode != 0:
+            self.insert_colored_text(f"模板更新失败: nuclei退出码 {returncode}\n", 'red')
+            return
+        self.insert_colored_text("模板更新成功！\n", 'green')
+        # 模板已变化，旧缓存作废
+        self.official_cache.clear()
+        self.force_refresh_templates()
     
     def load_template_list(self):
-        """从命令加载模板列表"""
-        def run_load():
-            self.status_var.set("正在加载模板列表...")
-            try:
-                result = subprocess.run(["nuclei", "-tl"], 
-                                      capture_output=True, text=True, check=True)
-                
-                lines = result.stdout.strip().split('\n')
-                new_templates = []
-                
-                for line in lines:
-                    if line.strip() and not line.startswith('[') and line.endswith('.yaml'):
-                        new_templates.append(line.strip())
-                
-                self.templates = new_templates
-                self.save_templates_to_cache()
-                self.root.after(0, self.update_template_listbox)
-                self.status_var.set(f"加载完成，共{len(self.templates)}个模板")
-                
-            except subprocess.CalledProcessError as e:
-                self.root.after(0, lambda: self.status_var.set("加载模板列表失败"))
-                self.insert_colored_text(f"加载模板列表失败: {e}\n", 'red')
-            except FileNotFoundError:
-                self.root.after(0, lambda: self.status_var.set("未找到nuclei命令"))
-                self.insert_colored_text("错误: 未找到nuclei命令，请确保已安装Nuclei\n", 'red')
+        """从命令加载模板列表（在进程事件循环中边读边解析，不阻塞界面；读取过程中逐步显示）"""
+        self.status_var.set("正在加载模板列表...")
+        templates = []
+        shown = time.monotonic()
+        
+        def on_line(line, stream):
+            nonlocal shown
+            path = parse_template_list_line(line) if stream == 'stdout' else None
+            if path:
+                templates.append(path)
+                now = time.monotonic()
+                if now - shown >= self.STREAM_INTERVAL:
+                    shown = now
+                    self.output_pipeline.call(self.show_loading_templates, templates, len(templates))
+        
+        future = self.engine.supervisor.run_command(["nuclei", "-tl"], on_line)
+        future.add_done_callback(
+            lambda future: self.output_pipeline.call(self.on_template_list_loaded, future, templates))
+    
+    def show_loading_templates(self, templates, count):
+        """nuclei -tl 读取中（主线程）：还没有模板列表时先显示已读到的部分，读完后再建立搜索索引"""
+        self.status_var.set(f"正在加载模板列表... {count}")
+        if not self.templates and not self.search_var.get().strip():
+            self.filtered_templates = templates[:count]
+            self.template_listbox.set_items(self.filtered_templates)
+    
+    def on_template_list_loaded(self, future, templates):
+        """nuclei -tl 结束（主线程）：替换模板列表并写入缓存"""
+        try:
+            returncode = future.result()
+        except FileNotFoundError:
+            self.status_var.set("未找到nuclei命令")
+            self.insert_colored_text("错误: 未找到nuclei命令，请确保已安装Nuclei\n", 'red')
+            return
+        except OSError as e:
+            returncode = e
+        if returncode != 0:
+            self.status_var.set("加载模板列表失败")
+            self.insert_colored_text(f"加载模板列表失败: {returncode}\n", 'red')
+            return
         
-        threading.Thread(target=run_load, daemon=True).start()
+        # 读取过程中显示用的路径列表转成模板目录后释放
+        self.templates = TemplateCatalog(templates)
+        self.save_official_cache()
+        self.update_template_listbox()
+        self.startup.mark('catalog')
+        self.status_var.set(f"加载完成，共{len(self.templates)}个模板")
     
+    @DIAGNOSTICS.timed('update_template_listbox')
     def update_template_listbox(self):
         """更新模板列表框显示"""
-        self.template_listbox.delete(0, tk.END)
-        for template in self.templates:
-            self.template_listbox.insert(tk.END, template)
-        self.filtered_templates = self.templates.copy()
+        # 丢弃已不在模板列表中的选择，重建搜索索引后按当前搜索条件刷新视图
+        self.template_listbox.retain(self.templates)
+        self.template_search.query = self.search_var.get()
+        self.template_search.rebuild(self.templates, self.metadata_lookup('official'))
+        self.index_template_metadata('official')
     
-    def search_templates(self, event=None):
-        """搜索过滤模板"""
-        search_term = self.search_var.get().lower()
+    def metadata_lookup(self, source):
+        """返回可用于字段搜索的元数据查询函数，索引尚未建立时返回None（退化为按路径匹配）"""
+        if self.metadata_index and self.metadata_ready[source]:
+            return self.metadata_index.lookup
+        return None
+    
+    def resolve_template_path(self, template):
+        """将模板列表中的路径转换为磁盘上的实际文件路径"""
+        if os.path.isabs(template):
+            return template
+        if self.templates_dir:
+            return os.path.join(self.templates_dir, template)
+        return None
+    
+    def index_template_metadata(self, source):
+        """在后台同步模板元数据索引，完成后让搜索改用索引查询"""
+        if not self.metadata_index:
+            return
         
-        if not search_term:
-            self.filtered_templates = self.templates
-        else:
-            self.filtered_templates = [tpl for tpl in self.templates 
-                                     if search_term in tpl.lower()]
+        templates = self.templates if source == 'official' else self.custom_templates
+        if source == 'official' and templates and not self.templates_dir:
+            self.insert_colored_text("未找到nuclei-templates目录，字段搜索将按路径匹配\n", 'gray')
+            return
         
-        self.template_listbox.delete(0, tk.END)
-        for template in self.filtered_templates:
-            self.template_listbox.insert(tk.END, template)
+        def run_index():
+            try:
+                start = time.perf_counter()
+                parsed, unchanged, removed = self.metadata_index.update(
+                    source, templates, self.resolve_template_path)
+                elapsed = time.perf_counter() - start
+            except Exception as e:
+                self.insert_colored_text(f"模板元数据索引失败: {e}\n", 'red')
+                return
+            
+            self.output_pipeline.call(self.on_metadata_indexed, source, templates)
+            if parsed or removed:
+                name = "官方" if source == 'official' else "自定义"
+                self.insert_colored_text(
+                    f"{name}模板元数据索引完成: 解析 {parsed} 个，未变化 {unchanged} 个，"
+                    f"移除 {removed} 个，用时 {elapsed:.1f}s\n", 'green')
+        
+        threading.Thread(target=run_index, daemon=True).start()
+    
+    def on_metadata_indexed(self, source, templates):
+        """元数据索引完成后重建搜索索引（模板列表已变化时忽略）"""
+        self.metadata_ready[source] = True
+        if source == 'official' and templates is self.templates:
+            self.template_search.rebuild(self.templates, self.metadata_index.lookup)
+        elif source == 'custom' and templates is self.custom_templates:
+            self.custom_template_search.rebuild(self.custom_templates, self.metadata_index.lookup)
+    
+    @DIAGNOSTICS.timed('search_templates')
+    def search_templates(self, event=None):
+        """搜索过滤模板（防抖后在后台执行，支持 tag:/severity:/protocol:/author:/id: 字段）"""
+        self.template_search.schedule(self.search_var.get())
+    
+    def apply_template_search(self, templates):
+        """应用搜索结果：只渲染可见行，选择状态由列表模型保存，不随过滤丢失"""
+        self.filtered_templates = templates
+        self.template_listbox.set_items(self.filtered_templates)
     
     def get_selected_templates(self):
         """获取所有选中的模板（标准+自定义）"""
         selected_templates = []
         
-        # 获取标准模板选择
-        selected_std_indices = self.template_listbox.curselection()
-        if selected_std_indices:
-            selected_templates.extend([self.filtered_templates[i] for i in selected_std_indices])
+        # 获取标准模板选择（包括被搜索过滤隐藏的已选模板）
+        selected_templates.extend(self.template_listbox.selected_keys())
         
         # 获取自定义模板选择
-        selected_custom_indices = self.custom_template_listbox.curselection()
-        if selected_custom_indices:
-            selected_templates.extend([self.filtered_custom_templates[i] for i in selected_custom_indices])
+        selected_templates.extend(self.custom_template_listbox.selected_keys())
         
         return selected_templates
     
+    def update_findings_stats(self):
+        """刷新状态栏中的结果数"""
+        if self.findings_store:
+            self.findings_var.set(f"结果: 新增 {self.findings_store.inserted} | 重复 {self.findings_store.duplicates}")
+    
+    def configure_engine(self):
+        """把界面上的模板列表和扫描选项交给扫描引擎（在主线程中、扫描开始前调用）"""
+        engine = self.engine
+        engine.templates = self.templates
+        engine.metadata_ready = self.metadata_ready['official']
+        try:
+            engine.workers = int(self.scan_workers_var.get())
+        except (tk.TclError, ValueError):
+            engine.workers = 4
+        engine.proxy = self.proxy_entry.get().strip() if self.proxy_var.get() else ''
+        engine.wall_timeout = self.read_timeout(self.wall_timeout_var)
+        engine.idle_timeout = self.read_timeout(self.idle_timeout_var)
+        engine.rate_limit = self.read_timeout(self.rate_limit_var)
+        engine.max_concurrency = self.read_timeout(self.max_concurrency_var)
+        engine.host_rate_limit = self.read_timeout(self.host_rate_limit_var)
+        self.configure_budget()
+    
+    def configure_budget(self):
+        """按界面设置更新共用的速率预算：并发进程数是界面扫描和队列任务合计的上限（主线程中调用）"""
+        try:
+            processes = int(self.scan_workers_var.get())
+        except (tk.TclError, ValueError):
+            processes = 4
+        self.rate_budget.configure(self.read_timeout(self.rate_limit_var), self.read_timeout(self.max_concurrency_var),
+                                   self.read_timeout(self.host_rate_limit_var), max(processes, 1))
+    
     def start_scan_selected(self):
         """扫描选中的目标"""
-        selected_indices = self.batch_listbox.curselection()
-        if not selected_indices:
+        selected_targets = self.batch_listbox.selected_keys()
+        if not selected_targets:
             messagebox.showwarning("警告", "请至少选择一个目标地址")
             return
         
@@ -767,210 +2805,273 @@ class NucleiGUI:
             messagebox.showwarning("警告", "请选择至少一个POC模板（标准或自定义）")
             return
         
-        selected_targets = [self.batch_targets[i] for i in selected_indices]
-        
-        if len(selected_targets) == 1:
-            self.start_single_scan(selected_targets[0], selected_templates)
-        else:
-            self.start_batch_scan_selected(selected_targets, selected_templates)
+        if self.scan_busy():
+            self.enqueue_scan(selected_targets, selected_templates, f"选中的 {len(selected_targets)} 个目标")
+            return
+        self.configure_engine()
+        if any(isinstance(target, TargetExpression) for target in selected_targets):
+            # 表达式展开后目标很多，作为批量任务分片扫描
+            self.engine.scan_batch(selected_targets, selected_templates)
+            return
+        # 每个目标一个nuclei进程，按并发数同时运行
+        self.engine.scan_targets(selected_targets, selected_templates)
     
     def start_batch_scan_all(self):
         """批量扫描所有目标"""
-        if not self.batch_targets:
+        if not self.target_store:
             messagebox.showwarning("警告", "目标列表为空，请先添加目标地址")
             return
+        if self.target_loading:
+            messagebox.showwarning("警告", "正在读取目标文件，请稍候")
+            return
         
         selected_templates = self.get_selected_templates()
         if not selected_templates:
             messagebox.showwarning("警告", "请选择至少一个POC模板（标准或自定义）")
             return
         
+        if self.scan_busy():
+            self.enqueue_scan(self.target_store, selected_templates, f"全部 {len(self.target_store)} 个目标")
+            return
+        
         result = messagebox.askyesno(
             "确认批量扫描",
-            f"即将开始批量扫描所有 {len(self.batch_targets)} 个目标。\n是否继续？"
+            f"即将开始批量扫描所有 {len(self.target_store)} 个目标。\n是否继续？"
         )
         
         if result:
-            self.start_batch_scan(self.batch_targets, selected_templates)
-    
-    def start_single_scan(self, target_url, selected_templates):
-        """单目标扫描"""
-        def run_scan():
-            self.scan_btn.config(state='disabled')
-            self.batch_scan_btn.config(state='disabled')
-            self.status_var.set("扫描进行中...")
-            
-            try:
-                output_dir = Path("./work")
-                output_dir.mkdir(exist_ok=True)
-                
-                # 单目标使用 -u 参数
-                cmd = ["nuclei", "-o", "./work/result.txt", "-u", target_url]
-                
-                for template in selected_templates:
-                    cmd.extend(["-t", template])
-                
-                if self.proxy_var.get():
-                    proxy_url = self.proxy_entry.get().strip()
-                    if proxy_url:
-                        cmd.extend(["-p", proxy_url])
-                
-                self.insert_colored_text(f"执行命令: {' '.join(cmd)}\n", 'blue')
-                self.insert_colored_text("-" * 50 + "\n", 'black')
-                
-                process = subprocess.Popen(cmd, stdout=subprocess.PIPE, 
-                                         stderr=subprocess.STDOUT, text=True)
-                
-                for line in process.stdout:
-                    self.insert_colored_text(line)
-                    self.root.update_idletasks()
-                
-                process.wait()
-                self.insert_colored_text(f"\n扫描完成！结果已保存到 ./work/result.txt\n", 'green')
-                self.status_var.set("扫描完成")
-                
-            except Exception as e:
-                self.insert_colored_text(f"扫描出错: {e}\n", 'red')
-                self.status_var.set("扫描出错")
-            finally:
-                self.scan_btn.config(state='normal')
-                self.batch_scan_btn.config(state='normal')
-            
-            self.output_text.see(tk.END)
+            self.configure_engine()
+            # 分片文件直接从目标列表写出，不复制列表
+            self.engine.scan_batch(self.target_store, selected_templates)
+    
+    def save_preset(self):
+        """把当前选中的模板和扫描选项保存为预设，供命令行 run --templates-from 使用"""
+        selected_templates = self.get_selected_templates()
+        if not selected_templates:
+            messagebox.showwarning("警告", "请选择至少一个POC模板（标准或自定义）")
+            return
+        existing = list_presets()
+        prompt = "预设名称" + (f"（已有: {', '.join(existing[:10])}）" if existing else "")
+        name = simpledialog.askstring("保存为预设", prompt, parent=self.root)
+        if not name or not name.strip():
+            return
+        name = name.strip()
+        if not re.fullmatch(r'[\w.-]+', name) or name.endswith('.json'):
+            messagebox.showwarning("警告", "预设名称只能包含字母、数字、下划线、点和短横线")
+            return
+        if name in existing and not messagebox.askyesno("确认", f"预设 {name} 已存在，是否覆盖？"):
+            return
         
-        threading.Thread(target=run_scan, daemon=True).start()
+        self.configure_engine()
+        try:
+            path = save_preset(name, selected_templates, options=self.engine.options())
+        except OSError as e:
+            self.insert_colored_text(f"保存预设失败: {e}\n", 'red')
+            return
+        self.insert_colored_text(f"已保存预设 {name}（{len(selected_templates)} 个模板）到 {path}\n", 'green')
+        self.insert_colored_text(f"命令行扫描: python Nuclei-GUI.py run --targets 目标文件 --templates-from {name}\n", 'gray')
     
-    def start_batch_scan_selected(self, targets, selected_templates):
-        """扫描选中的多个目标"""
-        def run_batch_scan():
-            self.scan_btn.config(state='disabled')
-            self.batch_scan_btn.config(state='disabled')
-            total_targets = len(targets)
-            self.status_var.set(f"扫描选中目标中... (0/{total_targets})")
-            
-            try:
-                output_dir = Path("./work")
-                output_dir.mkdir(exist_ok=True)
-                
-                successful_scans = 0
-                failed_scans = 0
-                
-                for i, target_url in enumerate(targets, 1):
-                    self.status_var.set(f"扫描选中目标中... ({i}/{total_targets})")
-                    
-                    self.insert_colored_text(f"\n[{i}/{total_targets}] 扫描目标: {target_url}\n", 'blue')
-                    self.insert_colored_text("-" * 50 + "\n", 'black')
-                    
-                    # 对每个目标使用 -u 参数
-                    cmd = ["nuclei", "-o", f"./work/result_selected_{i}.txt", "-u", target_url]
-                    
-                    for template in selected_templates:
-                        cmd.extend(["-t", template])
-                    
-                    if self.proxy_var.get():
-                        proxy_url = self.proxy_entry.get().strip()
-                        if proxy_url:
-                            cmd.extend(["-p", proxy_url])
-                    
-                    self.insert_colored_text(f"执行命令: {' '.join(cmd)}\n", 'blue')
-                    
-                    try:
-                        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, 
-                                                stderr=subprocess.STDOUT, text=True)
-                        
-                        for line in process.stdout:
-                            self.insert_colored_text(line)
-                            self.root.update_idletasks()
-                        
-                        process.wait()
-                        
-                        if process.returncode == 0:
-                            self.insert_colored_text(f"[{i}/{total_targets}] 扫描完成 ✓\n", 'green')
-                            successful_scans += 1
-                        else:
-                            self.insert_colored_text(f"[{i}/{total_targets}] 扫描失败 ✗\n", 'red')
-                            failed_scans += 1
-                            
-                    except Exception as e:
-                        self.insert_colored_text(f"[{i}/{total_targets}] 扫描异常: {e}\n", 'red')
-                        failed_scans += 1
-                
-                self.insert_colored_text(f"\n选中目标扫描完成！\n", 'green')
-                self.insert_colored_text(f"成功: {successful_scans}, 失败: {failed_scans}, 总计: {total_targets}\n", 'green')
-                self.status_var.set("选中目标扫描完成")
-                
-            except Exception as e:
-                self.insert_colored_text(f"扫描出错: {e}\n", 'red')
-                self.status_var.set("扫描出错")
-            finally:
-                self.scan_btn.config(state='normal')
-                self.batch_scan_btn.config(state='normal')
-            
-            self.output_text.see(tk.END)
+    def on_scan_started(self, scheduler):
+        """扫描开始（主线程）：切换按钮状态并定时刷新进度；扫描按钮保持可用，扫描进行中点击时加入任务队列"""
+        self.resume_btn.config(state='disabled')
+        self.stop_btn.config(state='normal')
+        self.status_var.set(f"{self.engine.title}中... (0/{len(scheduler.jobs)})")
+        self.root.after(500, self.update_scan_progress, scheduler)
+    
+    def update_scan_progress(self, scheduler):
+        """定时刷新状态栏中的扫描进度和预计剩余时间"""
+        if scheduler is not self.engine.scheduler or scheduler.finished is not None:
+            return
         
-        threading.Thread(target=run_batch_scan, daemon=True).start()
+        ended, total, eta = scheduler.progress()
+        counts = scheduler.counts()
+        status = (f"{self.engine.title}中... ({ended}/{total}) "
+                  f"运行 {counts[ScanJob.RUNNING]} | 排队 {counts[ScanJob.QUEUED]} | 失败 {counts[ScanJob.FAILED]}")
+        metrics = self.engine.metrics
+        if metrics and metrics.latest:
+            # 有 nuclei 统计时按模板×主机的完成比例估计，比按任务数更准确
+            aggregate = metrics.aggregate()
+            status += f" | {aggregate['rps']} 请求/秒 | 错误 {aggregate['errors']} | {aggregate['progress'] * 100:.1f}%"
+            eta = aggregate['eta'] if aggregate['eta'] is not None else eta
+        if eta is not None:
+            status += f" | 预计剩余 {format_duration(eta)}"
+        self.status_var.set(status)
+        self.root.after(500, self.update_scan_progress, scheduler)
     
-    def start_batch_scan(self, targets, selected_templates):
-        """批量扫描 - 使用 -l 参数"""
-        def run_batch_scan():
-            self.scan_btn.config(state='disabled')
-            self.batch_scan_btn.config(state='disabled')
-            self.status_var.set("批量扫描进行中...")
-            
-            try:
-                output_dir = Path("./work")
-                output_dir.mkdir(exist_ok=True)
-                
-                # 创建临时文件保存目标URL
-                with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False) as temp_file:
-                    for target in targets:
-                        temp_file.write(target + '\n')
-                    temp_file_path = temp_file.name
-                
-                # 构建命令 - 使用 -l 参数代替 -u
-                cmd = ["nuclei", "-o", "./work/result_batch.txt", "-l", temp_file_path]
-                
-                for template in selected_templates:
-                    cmd.extend(["-t", template])
-                
-                if self.proxy_var.get():
-                    proxy_url = self.proxy_entry.get().strip()
-                    if proxy_url:
-                        cmd.extend(["-p", proxy_url])
-                
-                self.insert_colored_text(f"执行批量扫描命令: {' '.join(cmd)}\n", 'blue')
-                self.insert_colored_text(f"扫描目标数量: {len(targets)}\n", 'blue')
-                self.insert_colored_text("-" * 50 + "\n", 'black')
-                
-                process = subprocess.Popen(cmd, stdout=subprocess.PIPE, 
-                                         stderr=subprocess.STDOUT, text=True)
-                
-                for line in process.stdout:
-                    self.insert_colored_text(line)
-                    self.root.update_idletasks()
-                
-                process.wait()
-                
-                # 删除临时文件
-                os.unlink(temp_file_path)
-                
-                self.insert_colored_text(f"\n批量扫描完成！结果已保存到 ./work/result_batch.txt\n", 'green')
-                self.status_var.set("批量扫描完成")
-                
-            except Exception as e:
-                self.insert_colored_text(f"批量扫描出错: {e}\n", 'red')
-                self.status_var.set("批量扫描出错")
-            finally:
-                self.scan_btn.config(state='normal')
-                self.batch_scan_btn.config(state='normal')
-            
-            self.output_text.see(tk.END)
+    def on_scan_finished(self, scheduler):
+        """全部任务结束（汇总已由扫描引擎输出）：恢复按钮"""
+        self.status_var.set(self.engine.finish_title(scheduler))
+        self.resume_btn.config(state='normal')
+        self.stop_btn.config(state='disabled')
+        # 界面扫描占用的队列名额空出来，启动排队的任务
+        if self.queue_runner:
+            threading.Thread(target=self.queue_runner.dispatch, daemon=True).start()
+    
+    @staticmethod
+    def read_timeout(var):
+        """读取超时或速率设置，0或无效值表示不限制"""
+        try:
+            value = int(var.get())
+        except (tk.TclError, ValueError):
+            return None
+        return value if value > 0 else None
+    
+    def stop_scan(self):
+        """停止当前扫描：排队的任务不再启动，运行中的nuclei进程组被终止"""
+        if self.engine.stop():
+            self.stop_btn.config(state='disabled')
+            self.insert_colored_text("正在停止扫描...\n", 'red')
+    
+    def retry_timed_out_targets(self):
+        """用当前选中的模板重新扫描上次超时的目标"""
+        targets = self.engine.load_timed_out()
+        if not targets:
+            messagebox.showinfo("提示", "没有超时的目标")
+            return
+        if self.engine.is_running():
+            messagebox.showwarning("警告", "扫描进行中，请稍后再试")
+            return
+        
+        selected_templates = self.get_selected_templates()
+        if not selected_templates:
+            messagebox.showwarning("警告", "请选择至少一个POC模板（标准或自定义）")
+            return
         
-        threading.Thread(target=run_batch_scan, daemon=True).start()
+        self.configure_engine()
+        self.engine.scan_targets(targets, selected_templates)
+    
+    def open_jobs_window(self):
+        """打开扫描任务状态窗口"""
+        if self.engine.scheduler is None:
+            messagebox.showinfo("提示", "还没有多目标扫描任务")
+            return
+        ScanJobsWindow(self.root, self.engine.scheduler, self.engine.metrics)
+    
+    def resume_batch_scan(self):
+        """选择一个未完成的批量任务继续扫描"""
+        jobs = BatchJob.unfinished(self.engine.jobs_dir)
+        if not jobs:
+            messagebox.showinfo("提示", "没有未完成的批量扫描任务")
+            return
+        ResumeJobsDialog(self.root, jobs, self.on_resume_job, self.delete_batch_job)
+    
+    def on_resume_job(self, job):
+        if self.engine.is_running():
+            messagebox.showwarning("警告", "扫描进行中，请稍后再试")
+            return
+        self.configure_engine()
+        self.engine.resume(job)
+    
+    def delete_batch_job(self, job):
+        shutil.rmtree(job.path, ignore_errors=True)
+        self.insert_colored_text(f"已删除批量扫描任务 {job.id}\n", 'green')
+    
+    def report_unfinished_jobs(self, jobs):
+        """启动时提示未完成的批量任务"""
+        if jobs:
+            self.insert_colored_text(
+                f"发现 {len(jobs)} 个未完成的批量扫描任务，可点击“恢复任务”继续\n", 'blue')
+    
+    def scan_busy(self):
+        """正在扫描、更新模板或队列已满时，新的扫描加入任务队列"""
+        if self.queue_runner and self.queue_runner.full():
+            return True
+        return self.engine.is_running() or self.templates_updating
+    
+    def make_queue_engine(self, work_dir):
+        """队列任务使用的扫描引擎：共享结果库和模板元数据，日志经输出管道显示"""
+        engine = ScanEngine(work_dir, self.findings_store, self.metadata_index)
+        engine.on_log = self.insert_colored_text
+        # 与界面扫描共用速率预算和进程数上限，任务自身保存的速率选项不再单独生效
+        engine.budget = self.rate_budget
+        return engine
+    
+    def enqueue_scan(self, targets, selected_templates, title):
+        """把扫描加入任务队列（目标和模板参数写入任务目录），返回队列任务id，出错时返回None"""
+        if self.queue_runner is None:
+            messagebox.showwarning("警告", "任务队列不可用，请等待当前扫描结束")
+            return None
+        self.configure_engine()
+        try:
+            priority = int(self.queue_priority_var.get())
+        except (tk.TclError, ValueError):
+            priority = 0
+        try:
+            job = self.engine.create_batch_job(targets, selected_templates, self.scan_queue.jobs_dir)
+            entry_id = self.scan_queue.add(title, job, self.engine.options(), priority)
+        except (OSError, sqlite3.Error) as e:
+            self.insert_colored_text(f"加入任务队列失败: {e}\n", 'red')
+            return None
+        self.insert_colored_text(f"已加入任务队列 #{entry_id}: {title}，优先级 {priority}\n", 'blue')
+        self.queue_runner.dispatch()
+        return entry_id
+    
+    def add_to_queue(self):
+        """把选中的目标（未选中时为全部目标）和选中的模板加入任务队列"""
+        if self.target_loading:
+            messagebox.showwarning("警告", "正在读取目标文件，请稍候")
+            return
+        selected_targets = self.batch_listbox.selected_keys()
+        if not selected_targets and not self.target_store:
+            messagebox.showwarning("警告", "目标列表为空，请先添加目标地址")
+            return
+        selected_templates = self.get_selected_templates()
+        if not selected_templates:
+            messagebox.showwarning("警告", "请选择至少一个POC模板（标准或自定义）")
+            return
+        if selected_targets:
+            self.enqueue_scan(selected_targets, selected_templates, f"选中的 {len(selected_targets)} 个目标")
+        else:
+            self.enqueue_scan(self.target_store, selected_templates, f"全部 {len(self.target_store)} 个目标")
+    
+    def change_queue_limit(self):
+        if self.queue_runner:
+            try:
+                self.queue_runner.set_limit(self.queue_limit_var.get())
+            except (tk.TclError, ValueError):
+                pass
+    
+    def open_queue_window(self):
+        if self.queue_runner is None:
+            messagebox.showwarning("警告", "任务队列不可用")
+            return
+        if self.queue_window and self.queue_window.window.winfo_exists():
+            self.queue_window.window.lift()
+            return
+        self.queue_window = QueueWindow(self.root, self.queue_runner, self.remove_queue_entries)
+    
+    def remove_queue_entries(self, entry_ids, parent=None):
+        """删除队列任务及其任务目录（已入库的扫描结果保留），运行中的任务需先暂停或取消"""
+        if not messagebox.askyesno("确认删除", f"删除 {len(entry_ids)} 个队列任务及其结果文件？\n"
+                                   f"（结果库中的扫描结果保留）", parent=parent):
+            return False
+        skipped = 0
+        for entry_id in entry_ids:
+            path = self.queue_runner.remove(entry_id)
+            if path is None:
+                skipped += 1
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+        if skipped:
+            messagebox.showinfo("提示", f"{skipped} 个任务正在运行，请先暂停或取消", parent=parent)
+        return True
+    
+    def resume_queue(self):
+        """启动时继续运行队列中排队的任务（包括上次退出时运行中的任务）"""
+        if self.queue_runner is None:
+            return
+        self.configure_budget()
+        queued = self.scan_queue.counts()[ScanQueue.QUEUED]
+        if queued:
+            self.insert_colored_text(f"任务队列中有 {queued} 个任务，继续运行\n", 'blue')
+            # 启动任务要写分片文件，不占用主线程
+            threading.Thread(target=self.queue_runner.dispatch, daemon=True).start()
+
 
 def main():
+    started = time.perf_counter()
     root = tk.Tk()
-    app = NucleiGUI(root)
+    app = NucleiGUI(root, started)
     root.mainloop()
 
 if __name__ == "__main__":
@@ -0,0 +1,62 @@
+"""基准测试公共工具"""
+import importlib
+import importlib.util
+import os
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_DIR not in sys.path:
+    sys.path.insert(0, REPO_DIR)
+
+
+def load_engine_module():
+    """加载不依赖Tk的扫描引擎 nuclei_engine.py"""
+    return importlib.import_module("nuclei_engine")
+
+
+def load_gui_module():
+    """按文件路径加载 Nuclei-GUI.py（文件名含连字符，无法直接import）"""
+    path = os.path.join(REPO_DIR, "Nuclei-GUI.py")
+    spec = importlib.util.spec_from_file_location("nuclei_gui", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def percentile(values, pct):
+    """返回已排序或未排序数据的百分位数"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    k = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[k]
+
+
+def make_template_paths(count, seed=7):
+    """生成与nuclei-templates目录结构相似的模板路径"""
+    import random
+    rng = random.Random(seed)
+    layouts = [
+        ('http/cves/{year}', 'CVE-{year}-{n:05d}.yaml'),
+        ('http/vulnerabilities/{vendor}', '{vendor}-{word}-{kind}.yaml'),
+        ('http/exposed-panels', '{vendor}-{word}-panel.yaml'),
+        ('http/misconfiguration', '{vendor}-{word}-{kind}.yaml'),
+        ('http/technologies/{vendor}', '{vendor}-detect.yaml'),
+        ('network/cves/{year}', 'CVE-{year}-{n:05d}.yaml'),
+        ('dns', '{word}-{kind}.yaml'),
+        ('ssl', '{word}-{kind}.yaml'),
+    ]
+    vendors = ['apache', 'nginx', 'wordpress', 'jenkins', 'gitlab', 'tomcat', 'weblogic', 'thinkphp',
+               'spring', 'confluence', 'jira', 'zabbix', 'grafana', 'kibana', 'oracle', 'cisco', 'vmware']
+    words = ['rce', 'sqli', 'lfi', 'xss', 'ssrf', 'auth-bypass', 'default-login', 'upload', 'unauth',
+             'info-disclosure', 'traversal', 'xxe', 'deserialization', 'takeover', 'config']
+    kinds = ['detect', 'exposure', 'misconfig', 'vuln', 'check']
+    paths = []
+    for n in range(count):
+        directory, name = rng.choice(layouts)
+        fields = {
+            'year': rng.randint(2000, 2025), 'n': n, 'vendor': rng.choice(vendors),
+            'word': rng.choice(words), 'kind': rng.choice(kinds),
+        }
+        paths.append(directory.format(**fields) + '/' + name.format(**fields))
+    return paths
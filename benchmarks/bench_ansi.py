@@ -0,0 +1,55 @@
+"""ANSI渲染器微基准：统计在nuclei风格输出上每秒处理的片段数
+
+用法: python benchmarks/bench_ansi.py [行数]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _common import load_gui_module
+
+
+def make_lines(count):
+    """生成与nuclei扫描输出相似的彩色行"""
+    rng = random.Random(42)
+    severities = [('info', 34), ('low', 32), ('medium', 33), ('high', 31), ('critical', 35)]
+    protocols = ['http', 'dns', 'tcp', 'ssl']
+    lines = []
+    for i in range(count):
+        sev, code = rng.choice(severities)
+        if i % 10 == 0:
+            lines.append(f"[\x1b[34mINF\x1b[0m] Current nuclei version: \x1b[1;38;5;208mv3.3.{i % 9}\x1b[0m\n")
+        else:
+            lines.append(
+                f"[\x1b[92mCVE-2024-{i:05d}\x1b[0m] [\x1b[94m{rng.choice(protocols)}\x1b[0m] "
+                f"[\x1b[{code}m{sev}\x1b[0m] https://target-{i % 500}.example.com/path?id={i} "
+                f"[\x1b[38;2;255;128;0m\"version\"\x1b[0m]\n"
+            )
+    return lines
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    module = load_gui_module()
+    lines = make_lines(count)
+    # 原始片段数：转义序列切分出的非空文本段
+    fragments = sum(sum(1 for part in module.ANSI_ESCAPE_RE.split(line)[::3] if part) for line in lines)
+    
+    renderer = module.AnsiRenderer()
+    start = time.perf_counter()
+    runs = 0
+    for line in lines:
+        runs += len(renderer.feed(line))
+    elapsed = time.perf_counter() - start
+    
+    print(f"行数: {count}")
+    print(f"输入片段: {fragments}, 合并后片段: {runs}")
+    print(f"耗时: {elapsed:.3f}s")
+    print(f"片段/秒: {fragments / elapsed:,.0f}")
+    print(f"行/秒: {count / elapsed:,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""扫描结果库基准：批量写入吞吐和50万条结果下的查询延迟
+
+用法: python benchmarks/bench_findings.py [结果数]
+"""
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _common import load_engine_module, make_template_paths, percentile
+
+
+SEVERITIES = ['info', 'info', 'info', 'low', 'medium', 'high', 'critical']
+
+
+def make_finding_lines(count, seed=11):
+    """生成nuclei -jsonl 格式的结果行（约5%重复）"""
+    rng = random.Random(seed)
+    templates = [os.path.splitext(os.path.basename(p))[0].lower() for p in make_template_paths(3000)]
+    hosts = [f"https://host{n}.example.com" for n in range(20000)]
+    lines = []
+    for n in range(count):
+        if lines and rng.random() < 0.05:
+            lines.append(rng.choice(lines))
+            continue
+        host = rng.choice(hosts)
+        finding = {
+            'template-id': rng.choice(templates),
+            'info': {'name': 'bench', 'severity': rng.choice(SEVERITIES), 'tags': ['bench']},
+            'matcher-name': rng.choice(['', 'version', 'panel']),
+            'type': 'http',
+            'host': host,
+            'matched-at': f"{host}/path/{n}",
+            'timestamp': f"2024-01-01T00:{n // 60 % 60:02d}:{n % 60:02d}Z",
+            'request': 'GET / HTTP/1.1\r\n' * 4,
+            'response': 'HTTP/1.1 200 OK\r\n' * 8,
+        }
+        lines.append(json.dumps(finding))
+    return lines
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    module = load_engine_module()
+    lines = make_finding_lines(count)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        store = module.FindingsStore(os.path.join(tmp, "findings.db"))
+        start = time.perf_counter()
+        for line in lines:
+            store.add(module.parse_finding_line(line, 'bench'))
+        store.close()
+        ingest_s = time.perf_counter() - start
+        
+        store = module.FindingsStore(os.path.join(tmp, "findings.db"))
+        queries = [
+            {'severity': 'critical'}, {'host': 'https://host42.example.com'},
+            {'template_id': 'apache-rce-detect'}, {'severity': 'high', 'host': 'https://host7.example.com'},
+            {},
+        ]
+        latencies = []
+        for _ in range(20):
+            for filters in queries:
+                t = time.perf_counter()
+                store.count(filters)
+                store.query(filters, order_by='timestamp', limit=100)
+                latencies.append((time.perf_counter() - t) * 1000)
+        
+        report = {
+            'findings': count,
+            'stored': store.count(),
+            'ingest_rows_per_sec': round(count / ingest_s),
+            'query_ms': {'p50': round(percentile(latencies, 50), 3), 'p99': round(percentile(latencies, 99), 3)},
+        }
+        store.close()
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
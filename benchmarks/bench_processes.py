@@ -0,0 +1,64 @@
+"""子进程引擎基准：多个并发进程同时大量输出时的读取吞吐和线程数
+
+用法: python benchmarks/bench_processes.py [进程数] [每个进程的行数]
+"""
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _common import load_engine_module
+
+# 模拟nuclei：stdout 输出JSONL结果，stderr 输出日志
+CHILD = r"""
+import json, sys
+count = int(sys.argv[1])
+line = json.dumps({'template-id': 'bench', 'info': {'severity': 'info'}, 'host': 'https://example.com',
+                   'matched-at': 'https://example.com/x', 'type': 'http'})
+out = sys.stdout
+for n in range(count):
+    out.write(line + '\n')
+    if n % 100 == 0:
+        sys.stderr.write('[INF] progress\n')
+"""
+
+
+def main():
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else 48
+    lines = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    module = load_engine_module()
+    
+    cmd = [sys.executable, "-c", CHILD, str(lines)]
+    jobs = [module.ScanJob(i, f"bench-{i}", cmd, None) for i in range(1, processes + 1)]
+    scheduler = module.ScanScheduler(jobs, processes)
+    received = {'stdout': 0, 'stderr': 0}
+    
+    def on_output(job, line, stream):
+        received[stream] += 1
+    scheduler.on_output = on_output
+    
+    peak_threads = threading.active_count()
+    start = time.perf_counter()
+    future = scheduler.start()
+    while not future.done():
+        peak_threads = max(peak_threads, threading.active_count())
+        time.sleep(0.05)
+    future.result()
+    elapsed = time.perf_counter() - start
+    
+    report = {
+        'processes': processes,
+        'stdout_lines': received['stdout'],
+        'stderr_lines': received['stderr'],
+        'lines_per_sec': round((received['stdout'] + received['stderr']) / elapsed),
+        'elapsed_s': round(elapsed, 2),
+        'peak_threads': peak_threads,
+        'failed': scheduler.counts()[module.ScanJob.FAILED],
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""模板搜索基准：在10k+模板上统计查询延迟的p50/p99
+
+模拟逐字输入的查询序列，分别测量全量查询和增量缩小查询的延迟，并报告模板目录和索引的内存占用。
+用法: python benchmarks/bench_search.py [模板数]
+"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _common import load_engine_module, make_template_paths, percentile
+
+
+QUERIES = [
+    'cve-2024', 'apache', 'wordpress rce', 'tag:rce', 'protocol:http cve-2021',
+    'jenkins', 'default-login', 'exposed-panels grafana', 'ssl', 'thinkphp',
+    'traversal', 'type:network', 'spring deserialization', 'panel', 'xss',
+]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 12000
+    module = load_engine_module()
+    paths = make_template_paths(count)
+    
+    start = time.perf_counter()
+    index = module.TemplateSearchIndex(paths)
+    build_ms = (time.perf_counter() - start) * 1000
+    
+    # 基线：原先的逐条小写子串扫描
+    baseline = []
+    for query in QUERIES:
+        start = time.perf_counter()
+        [tpl for tpl in paths if query.lower() in tpl.lower()]
+        baseline.append((time.perf_counter() - start) * 1000)
+    
+    full = []
+    for query in QUERIES:
+        start = time.perf_counter()
+        index.search(query)
+        full.append((time.perf_counter() - start) * 1000)
+    
+    # 逐字输入：每个按键都在上一次结果上增量缩小
+    typed = []
+    for query in QUERIES * 3:
+        previous, ids = None, None
+        for k in range(1, len(query) + 1):
+            prefix = query[:k]
+            candidates = ids if module.query_narrows(previous, prefix) else None
+            start = time.perf_counter()
+            ids = index.search(prefix, candidates)
+            typed.append((time.perf_counter() - start) * 1000)
+            previous = prefix
+    
+    report = {
+        'templates': count,
+        'index_build_ms': round(build_ms, 2),
+        'baseline_scan_ms': {'p50': round(percentile(baseline, 50), 3), 'p99': round(percentile(baseline, 99), 3)},
+        'indexed_query_ms': {'p50': round(percentile(full, 50), 3), 'p99': round(percentile(full, 99), 3)},
+        'incremental_keystroke_ms': {'p50': round(percentile(typed, 50), 3), 'p99': round(percentile(typed, 99), 3)},
+        'catalog_memory': index.templates.memory(),
+        'index_memory': index.memory(),
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
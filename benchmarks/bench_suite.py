@@ -0,0 +1,313 @@
+"""整体基准：用模拟的nuclei（fake_nuclei.py）驱动界面和扫描引擎，输出可在提交之间对比的JSON
+
+测量启动到可交互的时间、模板列表加载、搜索延迟、目标文件导入、输出吞吐、扫描调度开销和挂起目标的回收时间。
+界面部分需要显示器；无显示器的Linux上可以用 xvfb-run 运行，无法创建窗口时界面指标记为 skipped
+
+用法: python benchmarks/bench_suite.py [--templates N] [--targets N] [--lines N] [--jobs N]
+                                    [--output report.json] [--compare old.json]
+"""
+import argparse
+import json
+import os
+import platform
+import stat
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _common import REPO_DIR, load_engine_module, load_gui_module, percentile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+QUERIES = ['apache', 'cve-2021', 'tag:cve', 'severity:high', 'wordpress rce', 'panel', 'detect', 'x']
+
+
+def install_fake_nuclei(directory, **config):
+    """在 directory/bin 下写入调用 fake_nuclei.py 的 nuclei 命令并放到 PATH 最前面，config 写入 FAKE_NUCLEI_* 环境变量"""
+    bin_dir = os.path.join(directory, "bin")
+    os.makedirs(bin_dir, exist_ok=True)
+    path = os.path.join(bin_dir, "nuclei")
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f'#!/bin/sh\nexec "{sys.executable}" "{os.path.join(BENCH_DIR, "fake_nuclei.py")}" "$@"\n')
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    os.environ['PATH'] = bin_dir + os.pathsep + os.environ.get('PATH', '')
+    # 不读取本机的nuclei配置和模板目录，结果与环境无关
+    os.environ['HOME'] = directory
+    os.environ.pop('APPDATA', None)
+    configure_fake_nuclei(**config)
+    return path
+
+
+def configure_fake_nuclei(**config):
+    for key, value in config.items():
+        os.environ[f"FAKE_NUCLEI_{key.upper()}"] = str(value)
+
+
+def pump(root, predicate, timeout):
+    """运行Tk事件循环直到 predicate() 为真，返回耗时（秒），超时返回None"""
+    start = time.perf_counter()
+    while not predicate():
+        if time.perf_counter() - start > timeout:
+            return None
+        root.update()
+        time.sleep(0.001)
+    return time.perf_counter() - start
+
+
+def rounded(value, digits=3):
+    return round(value, digits) if value is not None else None
+
+
+def start_gui(gui, templates, timeout):
+    """创建隐藏的主窗口和界面，返回 (root, app, 启动耗时, 模板列表就绪耗时)"""
+    start = time.perf_counter()
+    root = gui.tk.Tk()
+    root.withdraw()
+    app = gui.NucleiGUI(root, start)
+    root.update()
+    startup_s = time.perf_counter() - start
+    waited = pump(root, lambda: len(app.templates) >= templates and 'ready' in app.startup.marks, timeout)
+    catalog_s = startup_s + waited if waited is not None else None
+    return root, app, startup_s, catalog_s
+
+
+def measure_search(app, root, timeout):
+    """去掉防抖延迟后，从提交查询到结果显示的延迟（毫秒）"""
+    controller = app.template_search
+    controller.delay_ms = 0
+    applied = []
+    on_result = controller.on_result
+    
+    def record(paths):
+        applied.append(time.perf_counter())
+        on_result(paths)
+    controller.on_result = record
+    
+    latencies = []
+    for _ in range(5):
+        for query in QUERIES + ['']:
+            count = len(applied)
+            app.search_var.set(query)
+            start = time.perf_counter()
+            app.search_templates()
+            if pump(root, lambda: len(applied) > count, timeout) is None:
+                break
+            latencies.append((applied[-1] - start) * 1000)
+    controller.on_result = on_result
+    return latencies
+
+
+def measure_target_import(app, root, path, timeout):
+    start = time.perf_counter()
+    app.load_batch_targets(path)
+    waited = pump(root, lambda: not app.target_loading, timeout)
+    return (time.perf_counter() - start) if waited is not None else None
+
+
+def measure_output(app, root, lines, timeout):
+    """一个目标输出 lines 行彩色日志，统计从开始扫描到全部显示的吞吐"""
+    configure_fake_nuclei(log_lines=lines, rate=0)
+    pipeline = app.output_pipeline
+    app.configure_engine()
+    before = pipeline.total_lines
+    start = time.perf_counter()
+    app.engine.scan_targets(["https://output.example.com"], app.templates[:1])
+    waited = pump(root, lambda: app.engine.wait(0) and not pipeline.depth()
+                  and pipeline.total_lines - before >= lines, timeout)
+    configure_fake_nuclei(log_lines=0)
+    if waited is None:
+        return None
+    elapsed = time.perf_counter() - start
+    return {'lines': pipeline.total_lines - before, 'elapsed_s': rounded(elapsed),
+            'lines_per_sec': round((pipeline.total_lines - before) / elapsed)}
+
+
+def bench_gui(args, workdir):
+    """界面指标：冷启动（无缓存）和热启动（有缓存）各一次"""
+    try:
+        gui = load_gui_module()
+        probe = gui.tk.Tk()
+        probe.destroy()
+    except Exception as e:
+        return {'skipped': f"无法创建窗口（{e}），可以用 xvfb-run python benchmarks/bench_suite.py 运行"}
+    
+    report = {}
+    root, app, startup_s, catalog_s = start_gui(gui, args.templates, args.timeout)
+    report['cold'] = {'startup_s': rounded(startup_s), 'catalog_s': rounded(catalog_s),
+                      'timeline_ms': dict(app.startup.marks)}
+    app.on_close()
+    
+    root, app, startup_s, catalog_s = start_gui(gui, args.templates, args.timeout)
+    report['warm'] = {'startup_s': rounded(startup_s), 'catalog_s': rounded(catalog_s),
+                      'timeline_ms': dict(app.startup.marks)}
+    
+    latencies = measure_search(app, root, args.timeout)
+    report['search_ms'] = {'queries': len(latencies), 'p50': rounded(percentile(latencies, 50)),
+                           'p95': rounded(percentile(latencies, 95))}
+    
+    target_file = os.path.join(workdir, "targets.txt")
+    with open(target_file, 'w', encoding='utf-8') as f:
+        f.write(''.join(f"https://host{n}.example.com:{8000 + n % 100}/\n" for n in range(args.targets)))
+    import_s = measure_target_import(app, root, target_file, args.timeout)
+    report['target_import'] = {'targets': len(app.target_store), 'elapsed_s': rounded(import_s),
+                               'targets_per_sec': round(args.targets / import_s) if import_s else None}
+    
+    report['output'] = measure_output(app, root, args.lines, args.timeout)
+    lag = gui.DIAGNOSTICS.summary().get('mainloop.lag', {})
+    report['mainloop_lag_ms'] = {'p95': lag.get('p95_ms'), 'max': lag.get('max_ms'),
+                                 'stalls': app.lag_probe.stalls}
+    app.on_close()
+    return report
+
+
+def bench_engine(args, workdir):
+    """引擎指标：调度开销（与直接用线程池运行同样的命令对比）和挂起目标的回收时间"""
+    module = load_engine_module()
+    templates = ["http/bench/bench-detect.yaml"]
+    engine = module.ScanEngine(os.path.join(workdir, "engine"))
+    engine.workers = args.workers
+    targets = [f"https://job{n}.example.com" for n in range(args.jobs)]
+    
+    start = time.perf_counter()
+    scheduler = engine.scan_targets(targets, templates)
+    engine.wait()
+    engine_s = time.perf_counter() - start
+    commands = [job.command() for job in scheduler.jobs]
+    
+    # 与进程监管者相同的启动方式（新会话），否则两边的进程启动开销不同
+    def run(cmd):
+        subprocess.run(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                       start_new_session=True)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.workers) as pool:
+        list(pool.map(run, commands))
+    baseline_s = time.perf_counter() - start
+    
+    report = {
+        'orchestration': {
+            'jobs': args.jobs, 'workers': args.workers,
+            'engine_s': rounded(engine_s), 'baseline_s': rounded(baseline_s),
+            'overhead_ms_per_job': rounded((engine_s - baseline_s) * 1000 / args.jobs, 2),
+            'done': scheduler.counts()[module.ScanJob.DONE],
+        },
+    }
+    
+    # 挂起的目标仍会定时输出统计行，无输出超时要大于统计间隔才能说明统计行不会让超时失效
+    engine.stats_interval = 1
+    engine.idle_timeout = 3
+    start = time.perf_counter()
+    scheduler = engine.scan_targets(["https://hang.example.com"], templates)
+    finished = engine.wait(args.timeout)
+    report['hung_target'] = {
+        'stats_interval_s': engine.stats_interval, 'idle_timeout_s': engine.idle_timeout,
+        'reaped_s': rounded(time.perf_counter() - start) if finished else None,
+        'status': scheduler.jobs[0].status,
+    }
+    engine.shutdown()
+    report['shared_budget'] = measure_shared_budget(module, workdir, args.timeout)
+    return report
+
+
+def measure_shared_budget(module, workdir, timeout):
+    """两个引擎共用一个速率预算（界面扫描 + 队列任务）：先启动单任务扫描，再启动多任务扫描，
+    采样合计分出的速率和并发，峰值不能超过预算"""
+    budget = module.RateBudget(rate=100, concurrency=50, processes=4)
+    engines = []
+    for name in ("interactive", "queued"):
+        engine = module.ScanEngine(os.path.join(workdir, name))
+        engine.budget = budget
+        engine.workers = 4
+        engines.append(engine)
+    
+    configure_fake_nuclei(slow_s=1)
+    peak = [0, 0, 0]
+    done = threading.Event()
+    
+    def sample():
+        while not done.is_set():
+            peak[:] = map(max, peak, budget.usage())
+            time.sleep(0.01)
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    engines[0].scan_targets(["https://slow0.example.com"], ["http/bench/bench-detect.yaml"])
+    time.sleep(0.3)
+    engines[1].scan_targets([f"https://slow{n}.example.com" for n in range(1, 5)], ["http/bench/bench-detect.yaml"])
+    finished = all(engine.wait(timeout) for engine in engines)
+    done.set()
+    sampler.join()
+    for engine in engines:
+        engine.shutdown()
+    os.environ.pop('FAKE_NUCLEI_SLOW_S', None)
+    return {
+        'finished': finished,
+        'peak_rate': peak[0], 'rate': budget.rate,
+        'peak_concurrency': peak[1], 'concurrency': budget.concurrency,
+        'peak_processes': peak[2], 'processes': budget.processes,
+        'within_budget': peak[0] <= budget.rate and peak[1] <= budget.concurrency and peak[2] <= budget.processes,
+    }
+
+
+def flatten(report, prefix=''):
+    items = {}
+    for key, value in report.items():
+        if isinstance(value, dict):
+            items.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            items[prefix + key] = value
+    return items
+
+
+def compare(old, new):
+    """两次报告中都有的数值指标：新值/旧值"""
+    old_values = flatten(old)
+    return {key: round(value / old_values[key], 3)
+            for key, value in flatten(new).items() if old_values.get(key)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Nuclei GUI 整体基准")
+    parser.add_argument("--templates", type=int, default=12000, help="模拟的官方模板数")
+    parser.add_argument("--targets", type=int, default=200000, help="目标文件的行数")
+    parser.add_argument("--lines", type=int, default=100000, help="输出吞吐测试的日志行数")
+    parser.add_argument("--jobs", type=int, default=48, help="调度开销测试的任务数")
+    parser.add_argument("--workers", type=int, default=8, help="调度开销测试的并发数")
+    parser.add_argument("--timeout", type=float, default=120, help="单项测试的超时秒数")
+    parser.add_argument("--output", help="报告同时写入此文件")
+    parser.add_argument("--compare", help="与之前的报告对比（输出 新值/旧值）")
+    args = parser.parse_args()
+    if os.name == 'nt':
+        sys.exit("模拟的nuclei命令是shell脚本，请在Linux/macOS（或WSL）下运行")
+    
+    module = load_engine_module()
+    report = {
+        'commit': module.read_git_head(REPO_DIR),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'templates': args.templates,
+    }
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        # 界面使用相对路径（./work、缓存文件），在临时目录中运行
+        os.chdir(workdir)
+        try:
+            install_fake_nuclei(workdir, templates=args.templates, log_lines=0, findings=1)
+            report['gui'] = bench_gui(args, workdir)
+            report['engine'] = bench_engine(args, workdir)
+        finally:
+            os.chdir(cwd)
+    
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            report['compare'] = compare(json.load(f), report)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
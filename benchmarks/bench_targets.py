@@ -0,0 +1,97 @@
+"""目标列表基准：百万行目标文件的流式读取去重吞吐、内存和删除耗时，以及 /16 × 5 个端口的表达式分片展开
+
+用法: python benchmarks/bench_targets.py [行数]
+"""
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _common import load_engine_module
+
+
+def write_targets(path, count, seed=5):
+    """生成目标文件：主机名、带协议和默认端口的URL混合，约15%重复"""
+    rng = random.Random(seed)
+    hosts = int(count * 0.85)
+    with open(path, 'w', encoding='utf-8') as f:
+        for n in range(count):
+            k = rng.randrange(hosts)
+            if n % 3 == 0:
+                f.write(f"https://host{k}.example.com:443/\n")
+            elif n % 3 == 1:
+                f.write(f"host{k}.example.com\n")
+            else:
+                f.write(f"http://HOST{k}.example.com:80\n")
+
+
+def bench_expression(module, tmp, text="10.20.0.0/16:80,443,8080,8443,9000"):
+    """表达式作为批量任务写出全部分片：耗时和峰值内存（与展开后的目标数无关）"""
+    store = module.TargetStore()
+    store.add(text)
+    start = time.perf_counter()
+    job = module.BatchJob.create(os.path.join(tmp, "jobs"), store)
+    written = sum(job.write_shards(job.pending()).values())
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    job = module.BatchJob.create(os.path.join(tmp, "jobs"), store)
+    job.write_shards(job.pending())
+    memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        'expression': text,
+        'targets': len(store),
+        'list_entries': len(store.targets),
+        'shards': job.shard_count(),
+        'written': written,
+        'targets_per_sec': round(written / elapsed),
+        'peak_memory_mb': round(memory / 1024 / 1024, 2),
+    }
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    module = load_engine_module()
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "targets.txt")
+        write_targets(path, count)
+        
+        store = module.TargetStore()
+        chunks = []
+        start = start_load = time.perf_counter()
+        added, duplicates = store.load_file(path, lambda added, lines: chunks.append(time.perf_counter()))
+        load_s = time.perf_counter() - start
+        # 内存单独测量（tracemalloc 会显著拖慢读取）
+        tracemalloc.start()
+        module.TargetStore().load_file(path)
+        memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        
+        selected = store.targets[::1000]
+        start = time.perf_counter()
+        removed = store.remove(selected)
+        remove_ms = (time.perf_counter() - start) * 1000
+        
+        expression = bench_expression(module, tmp)
+    
+    report = {
+        'lines': count,
+        'targets': added,
+        'duplicates': duplicates,
+        'lines_per_sec': round(count / load_s),
+        # 第一块目标出现在列表中的延迟
+        'first_chunk_ms': round((chunks[0] - start_load) * 1000, 1) if chunks else None,
+        'peak_memory_mb': round(memory / 1024 / 1024, 1),
+        'remove_ms': {'removed': removed, 'ms': round(remove_ms, 1)},
+        'expression': expression,
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
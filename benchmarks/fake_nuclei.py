@@ -0,0 +1,140 @@
+"""模拟的nuclei命令：基准测试时由 install_fake_nuclei() 放到 PATH 最前面，不需要真实的nuclei和模板
+
+行为由环境变量控制：
+    FAKE_NUCLEI_TEMPLATES      -tl 列出的模板数（默认 12000）
+    FAKE_NUCLEI_LOG_LINES      每个目标输出到 stderr 的彩色日志行数（默认 0）
+    FAKE_NUCLEI_RATE           日志输出速率（行/秒，0 为不限速，默认 0）
+    FAKE_NUCLEI_FINDINGS       每个目标的 JSONL 结果数（默认 1）
+    FAKE_NUCLEI_SLOW_S         目标中含 slow 时先等待的秒数（默认 30）
+    FAKE_NUCLEI_STATS_INTERVAL 有 -stats 时统计行的间隔秒数（默认取 -si，否则 5）
+目标中含 hang 时一直挂起，直到被终止（模拟无响应的目标；有 -stats 时仍定时输出统计行）
+"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def env_number(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def option(args, name, default=None):
+    return args[args.index(name) + 1] if name in args and args.index(name) + 1 < len(args) else default
+
+
+def list_templates():
+    from _common import make_template_paths
+    out = sys.stdout
+    sys.stderr.write("[\x1b[34mINF\x1b[0m] Listing available v10.0.0 nuclei templates for /root/nuclei-templates\n")
+    paths = make_template_paths(int(env_number('FAKE_NUCLEI_TEMPLATES', 12000)))
+    out.write('\n'.join(paths) + '\n')
+    out.flush()
+
+
+class Emitter:
+    """按速率输出日志行，同时按间隔输出 -sj 统计行"""
+    
+    SEVERITIES = [('info', 34), ('low', 32), ('medium', 33), ('high', 31), ('critical', 35)]
+    
+    def __init__(self, args, targets):
+        self.rate = env_number('FAKE_NUCLEI_RATE', 0)
+        self.stats = '-stats' in args
+        self.stats_interval = env_number('FAKE_NUCLEI_STATS_INTERVAL', float(option(args, '-si', 5)))
+        self.total = max(len(targets), 1) * 100
+        self.requests = 0
+        self.matched = 0
+        self.started = time.monotonic()
+        self.next_stats = self.started + self.stats_interval
+    
+    def log_lines(self, target, count):
+        err = sys.stderr
+        batch = max(int(self.rate / 100), 1) if self.rate else 500
+        for start in range(0, count, batch):
+            lines = []
+            for n in range(start, min(start + batch, count)):
+                severity, code = self.SEVERITIES[n % len(self.SEVERITIES)]
+                lines.append(f"[\x1b[92mbench-{n % 300:03d}\x1b[0m] [\x1b[94mhttp\x1b[0m] "
+                             f"[\x1b[{code}m{severity}\x1b[0m] {target}/path?id={n}\n")
+            err.write(''.join(lines))
+            err.flush()
+            if self.rate:
+                time.sleep(len(lines) / self.rate)
+            self.maybe_stats()
+    
+    def maybe_stats(self, force=False):
+        now = time.monotonic()
+        if not self.stats or (not force and now < self.next_stats):
+            return
+        self.next_stats = now + self.stats_interval
+        elapsed = int(now - self.started)
+        record = {
+            'duration': f"{elapsed // 3600}:{elapsed // 60 % 60:02d}:{elapsed % 60:02d}",
+            'errors': '0', 'hosts': '1', 'matched': str(self.matched),
+            'percent': str(min(self.requests * 100 // self.total, 100)),
+            'requests': str(self.requests), 'rps': str(int(self.requests / max(now - self.started, 0.001))),
+            'startedAt': '', 'templates': '1', 'total': str(self.total),
+        }
+        sys.stderr.write(json.dumps(record) + '\n')
+        sys.stderr.flush()
+
+
+def scan(args):
+    targets = []
+    if '-u' in args:
+        targets.append(option(args, '-u'))
+    if '-l' in args:
+        with open(option(args, '-l'), 'r', encoding='utf-8') as f:
+            targets.extend(line.strip() for line in f if line.strip())
+    output = option(args, '-o')
+    out_file = open(output, 'a', encoding='utf-8') if output else None
+    emitter = Emitter(args, targets)
+    log_lines = int(env_number('FAKE_NUCLEI_LOG_LINES', 0))
+    findings = int(env_number('FAKE_NUCLEI_FINDINGS', 1))
+    
+    sys.stderr.write("[\x1b[34mINF\x1b[0m] Current nuclei version: v3.3.0 (\x1b[92mlatest\x1b[0m)\n")
+    for target in targets:
+        if 'hang' in target:
+            # 与真实的nuclei一样，目标无响应时仍按间隔输出统计行（请求数不再增加）
+            while True:
+                emitter.maybe_stats()
+                time.sleep(0.1 if emitter.stats else 3600)
+        if 'slow' in target:
+            time.sleep(env_number('FAKE_NUCLEI_SLOW_S', 30))
+        emitter.log_lines(target, log_lines)
+        for n in range(findings):
+            line = json.dumps({
+                'template-id': f"bench-{n % 300:03d}", 'info': {'name': 'bench', 'severity': 'info', 'tags': ['bench']},
+                'type': 'http', 'host': target, 'matched-at': f"{target}/found/{n}",
+                'timestamp': '2024-01-01T00:00:00Z',
+            })
+            sys.stdout.write(line + '\n')
+            if out_file:
+                out_file.write(line + '\n')
+        sys.stdout.flush()
+        emitter.requests += 100
+        emitter.matched += findings
+        emitter.maybe_stats()
+    emitter.maybe_stats(force=True)
+    if out_file:
+        out_file.close()
+
+
+def main():
+    args = sys.argv[1:]
+    if '-tl' in args:
+        list_templates()
+    elif '-update-templates' in args or '-ut' in args:
+        sys.stderr.write("[\x1b[34mINF\x1b[0m] No new updates found for nuclei templates\n")
+    else:
+        scan(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
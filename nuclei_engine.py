@@ -0,0 +1,4188 @@
+"""Nuclei扫描引擎：模板列表与缓存、模板参数构建、进程调度、结果入库和可恢复的批量任务
+
+不依赖Tk，界面（Nuclei-GUI.py）和命令行共用；无界面的服务器上可直接运行：
+    
+    python nuclei_engine.py run --targets targets.txt --templates-from 预设名
+    python nuclei_engine.py daemon
+    python nuclei_engine.py submit --targets targets.txt --templates-from 预设名
+"""
+import argparse
+import asyncio
+import codecs
+import contextlib
+import cProfile
+import csv
+import functools
+import ipaddress
+import itertools
+import json
+import math
+import os
+import platform
+import pstats
+import queue
+import re
+import signal
+import socket
+import socketserver
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import warnings
+import hashlib
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+
+# 搜索语法中支持的字段及其别名
+SEARCH_FIELDS = {
+    'tag': 'tags', 'tags': 'tags',
+    'severity': 'severity', 'sev': 'severity',
+    'protocol': 'protocol', 'type': 'protocol',
+    'author': 'author',
+    'id': 'id',
+}
+
+
+def parse_search_query(query):
+    """解析搜索语句，返回 (普通关键字列表, [(字段, 值), ...])
+    
+    例如 "tag:rce severity:critical cve-2024" -> (['cve-2024'], [('tags', 'rce'), ('severity', 'critical')])
+    """
+    terms = []
+    fields = []
+    for token in query.lower().split():
+        name, sep, value = token.partition(':')
+        if sep and name in SEARCH_FIELDS:
+            if value:
+                fields.append((SEARCH_FIELDS[name], value))
+        else:
+            terms.append(token)
+    return terms, fields
+
+
+def query_narrows(previous, query):
+    """判断新查询是否只是在上一次查询基础上追加条件（结果必然是上次结果的子集）"""
+    if not previous or not query.startswith(previous):
+        return False
+    if previous[-1].isspace():
+        return True
+    
+    prev_tokens = previous.split()
+    new_token = query.split()[len(prev_tokens) - 1]
+    old_token = prev_tokens[-1]
+    if new_token == old_token:
+        return True
+    
+    # 被追加字符的最后一个词不能从普通关键字变成字段条件
+    old_name, old_sep, _ = old_token.partition(':')
+    new_name, new_sep, _ = new_token.partition(':')
+    old_is_field = bool(old_sep) and old_name in SEARCH_FIELDS
+    new_is_field = bool(new_sep) and new_name in SEARCH_FIELDS
+    return old_is_field == new_is_field
+
+
+class TemplateCatalog:
+    """紧凑的模板目录：目录字符串只保存一份，文件名拼接成一个字符串，模板用整数id（下标）表示
+    
+    支持 len()、下标（含切片）、迭代和 in，可以直接替代原来的路径列表；路径在访问时才拼出来。
+    路径 -> id 的查找表是按哈希排序的数组，首次调用 find() 时构建
+    """
+    
+    def __init__(self, paths=()):
+        self.dirs = []
+        self._dir_ids = {}
+        # 第 i 个模板的目录编号，以及文件名在 names 中的区间 offsets[i]:offsets[i + 1]
+        self.dir_ids = array('I')
+        self.names = ''
+        self.offsets = array('I', [0])
+        self._lookup = None
+        self.extend(paths)
+    
+    def extend(self, paths):
+        """在末尾加入模板（新模板的id依次递增）；已被视图或索引引用的目录应改用 extended()"""
+        start = len(self)
+        dir_ids, dir_map, offsets = self.dir_ids, self._dir_ids, self.offsets
+        # 查找表已建立时记下新路径，随后插入查找表
+        added = [] if self._lookup is not None else None
+        names = []
+        end = offsets[-1]
+        for path in paths:
+            cut = max(path.rfind('/'), path.rfind('\\')) + 1
+            directory = path[:cut]
+            d = dir_map.get(directory)
+            if d is None:
+                d = dir_map[directory] = len(self.dirs)
+                self.dirs.append(directory)
+            dir_ids.append(d)
+            names.append(path[cut:])
+            end += len(path) - cut
+            offsets.append(end)
+            if added is not None:
+                added.append(path)
+        self.names += ''.join(names)
+        
+        if added:
+            keys, ids = self._lookup
+            for i, path in enumerate(added, start):
+                h = hash(path)
+                k = bisect_right(keys, h)
+                keys.insert(k, h)
+                ids.insert(k, i)
+    
+    def extended(self, paths):
+        """返回加入 paths 后的新目录，不修改当前对象（正在显示的视图不受影响）"""
+        catalog = TemplateCatalog()
+        catalog.dirs = list(self.dirs)
+        catalog._dir_ids = dict(self._dir_ids)
+        catalog.dir_ids = array('I', self.dir_ids)
+        catalog.names = self.names
+        catalog.offsets = array('I', self.offsets)
+        if self._lookup is not None:
+            catalog._lookup = (array('q', self._lookup[0]), array('I', self._lookup[1]))
+        catalog.extend(paths)
+        return catalog
+    
+    def __len__(self):
+        return len(self.dir_ids)
+    
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[k] for k in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        return self.dirs[self.dir_ids[i]] + self.names[self.offsets[i]:self.offsets[i + 1]]
+    
+    def __iter__(self):
+        dirs, names, offsets = self.dirs, self.names, self.offsets
+        for i, d in enumerate(self.dir_ids):
+            yield dirs[d] + names[offsets[i]:offsets[i + 1]]
+    
+    def __contains__(self, path):
+        return self.find(path) is not None
+    
+    def find_all(self, path):
+        """路径对应的所有模板id（升序，同一路径可能出现多次）"""
+        if self._lookup is None:
+            hashes = [hash(tpl) for tpl in self]
+            order = sorted(range(len(hashes)), key=hashes.__getitem__)
+            self._lookup = (array('q', [hashes[i] for i in order]), array('I', order))
+        keys, ids = self._lookup
+        h = hash(path)
+        k = bisect_left(keys, h)
+        found = []
+        while k < len(keys) and keys[k] == h:
+            if self[ids[k]] == path:
+                found.append(ids[k])
+            k += 1
+        return found
+    
+    def find(self, path):
+        """路径对应的模板id，不存在时返回None"""
+        found = self.find_all(path)
+        return found[0] if found else None
+    
+    def memory(self):
+        """内存占用估算（字节）；as_list_bytes 为同样的路径保存成字符串列表时的大小，用于对比"""
+        dirs = (sys.getsizeof(self.dirs) + sys.getsizeof(self._dir_ids)
+                + sum(sys.getsizeof(directory) for directory in self.dirs))
+        names = sys.getsizeof(self.names)
+        ids = sys.getsizeof(self.dir_ids) + sys.getsizeof(self.offsets)
+        lookup = sum(sys.getsizeof(part) for part in self._lookup) if self._lookup else 0
+        return {
+            'templates': len(self), 'dirs': len(self.dirs),
+            'dirs_bytes': dirs, 'names_bytes': names, 'ids_bytes': ids, 'lookup_bytes': lookup,
+            'total_bytes': dirs + names + ids + lookup,
+            'as_list_bytes': sys.getsizeof([None] * len(self)) + sum(sys.getsizeof(path) for path in self),
+        }
+
+
+# 字节值 -> 其中为1的位
+_BYTE_BITS = tuple(tuple(bit for bit in range(8) if n >> bit & 1) for n in range(256))
+
+
+def ids_to_bits(ids):
+    """模板id序列 -> 位集（int，第 i 位为1表示包含id i）"""
+    ids = ids if isinstance(ids, (array, list)) else list(ids)
+    if not ids:
+        return 0
+    buf = bytearray(max(ids) // 8 + 1)
+    for i in ids:
+        buf[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(buf, 'little')
+
+
+def bits_to_ids(bits):
+    """位集 -> 模板id数组（升序）"""
+    ids = array('I')
+    data = bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+    for index, byte in enumerate(data):
+        if byte:
+            base = index << 3
+            ids.extend([base + bit for bit in _BYTE_BITS[byte]])
+    return ids
+
+
+class CatalogView:
+    """模板目录的只读子集视图（过滤/搜索结果）：只保存id数组，按需拼出路径，不复制路径列表"""
+    
+    def __init__(self, catalog, ids):
+        self.catalog = catalog
+        self.ids = ids
+    
+    def __len__(self):
+        return len(self.ids)
+    
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.catalog[k] for k in self.ids[i]]
+        return self.catalog[self.ids[i]]
+    
+    def __iter__(self):
+        catalog = self.catalog
+        return (catalog[i] for i in self.ids)
+    
+    def bits(self):
+        return ids_to_bits(self.ids)
+
+
+class CatalogSelection:
+    """模板目录上的选择：选中的模板id保存在位集（int）中，全选、取消和求交都是整数位运算
+    
+    对外仍以模板路径为键，与过滤后的视图无关；不在目录中的路径（如目录还在加载时选中的）另存在 extra 中。
+    同一路径在目录中可能有多个id（删除后又加入），任一id被选中即视为选中，取消时清除全部id。
+    目录被替换时调用 retain(新目录)，按路径迁移到新目录上
+    """
+    
+    def __init__(self, catalog=None):
+        self.catalog = catalog if catalog is not None else TemplateCatalog()
+        self.bits = 0
+        self.extra = {}
+    
+    def __len__(self):
+        return bin(self.bits).count('1') + len(self.extra)
+    
+    def __bool__(self):
+        return bool(self.bits or self.extra)
+    
+    def __iter__(self):
+        catalog = self.catalog
+        yield from (catalog[i] for i in bits_to_ids(self.bits))
+        yield from self.extra
+    
+    def __contains__(self, path):
+        found = self.catalog.find_all(path)
+        if not found:
+            return path in self.extra
+        bits = self.bits
+        return any(bits >> i & 1 for i in found)
+    
+    def add(self, path):
+        i = self.catalog.find(path)
+        if i is None:
+            self.extra[path] = None
+        elif path not in self:
+            self.bits |= 1 << i
+    
+    def discard(self, path):
+        found = self.catalog.find_all(path)
+        if not found:
+            self.extra.pop(path, None)
+        for i in found:
+            self.bits &= ~(1 << i)
+    
+    def add_all(self, paths):
+        """选中 paths 中的全部模板：paths 是本目录或其视图时直接合并位集"""
+        if paths is self.catalog:
+            self.bits = (1 << len(paths)) - 1
+        elif isinstance(paths, CatalogView) and paths.catalog is self.catalog:
+            self.bits |= paths.bits()
+        else:
+            for path in paths:
+                self.add(path)
+    
+    def clear(self):
+        self.bits = 0
+        self.extra.clear()
+    
+    def retain(self, keys):
+        """只保留仍在 keys 中的选择；keys 是新的模板目录时改为在新目录上保存"""
+        if keys is self.catalog:
+            return
+        if isinstance(keys, TemplateCatalog):
+            paths = list(self)
+            self.catalog = keys
+            self.clear()
+            found = [keys.find(path) for path in paths]
+            self.bits = ids_to_bits([i for i in found if i is not None])
+            return
+        catalog = self.catalog
+        self.bits = ids_to_bits([i for i in bits_to_ids(self.bits) if catalog[i] in keys])
+        self.extra = {path: None for path in self.extra if path in keys}
+    
+    def ids(self):
+        return bits_to_ids(self.bits)
+
+
+class TemplateSearchIndex:
+    """模板搜索索引：加载模板列表时预计算小写形式和三元组倒排表
+    
+    模板保存在 TemplateCatalog 中，用整数id表示；倒排表和查询结果都是id数组。
+    小写形式与目录的存储方式相同：目录逐个保存一份，文件名拼接成一个字符串、共用目录的 offsets，
+    不再逐条保存完整的小写路径。匹配时目录和文件名分开判断（目录包含查询词时整个目录的模板都命中），
+    跨越目录和文件名边界的查询词按目录结尾和文件名开头拼接判断
+    """
+    
+    def __init__(self, templates, field_lookup=None):
+        self.templates = templates if isinstance(templates, TemplateCatalog) else TemplateCatalog(templates)
+        # field_lookup(字段, 值前缀) -> 匹配的模板路径集合；元数据不可用时返回None
+        self.field_lookup = field_lookup
+        # 增量删除的模板id（墓碑），查询结果中过滤掉
+        self.removed = set()
+        self.trigrams = {}
+        # 小写的目录（与 templates.dirs 对应，统一使用 / 作为分隔符，便于按路径段匹配）和拼接的小写文件名
+        self.lowered_dirs = []
+        self.lowered_names = ''
+        self._indexed = 0
+        self._index_catalog()
+    
+    def _index_catalog(self):
+        """为目录中尚未索引的模板（新加入的）生成小写形式和三元组"""
+        catalog = self.templates
+        start = len(self.lowered_names)
+        self.lowered_dirs.extend(d.lower().replace('\\', '/') for d in catalog.dirs[len(self.lowered_dirs):])
+        names = catalog.names[start:]
+        lowered = names.lower()
+        if len(lowered) != len(names):
+            # 个别字符小写后长度改变时保留原字符，保证与 offsets 对齐
+            lowered = ''.join(c if len(c.lower()) != 1 else c.lower() for c in names)
+        self.lowered_names += lowered
+        
+        for i in range(self._indexed, len(catalog)):
+            self._index_text(i, self.lowered_path(i))
+        self._indexed = len(catalog)
+    
+    def lowered_path(self, i):
+        """模板的小写路径（按需拼出）"""
+        offsets = self.templates.offsets
+        return self.lowered_dirs[self.templates.dir_ids[i]] + self.lowered_names[offsets[i]:offsets[i + 1]]
+    
+    def _matcher(self, term):
+        """返回判断模板id的小写路径是否包含 term 的函数，不拼出完整路径"""
+        full = set()
+        tails = {}
+        for d, text in enumerate(self.lowered_dirs):
+            if term in text:
+                full.add(d)
+                continue
+            # 目录以 term 的前半段结尾时，文件名以后半段开头也算包含
+            rests = [term[k:] for k in range(1, len(term)) if text.endswith(term[:k])]
+            if rests:
+                tails[d] = rests
+        dir_ids, offsets, names = self.templates.dir_ids, self.templates.offsets, self.lowered_names
+        
+        def match(i):
+            d = dir_ids[i]
+            if d in full:
+                return True
+            start, end = offsets[i], offsets[i + 1]
+            if names.find(term, start, end) >= 0:
+                return True
+            return any(names.startswith(rest, start, end) for rest in tails.get(d, ()))
+        return match
+    
+    def _index_text(self, i, text):
+        for gram in {text[j:j + 3] for j in range(len(text) - 2)}:
+            postings = self.trigrams.get(gram)
+            if postings is None:
+                self.trigrams[gram] = array('I', [i])
+            else:
+                postings.append(i)
+    
+    def position(self, path):
+        """模板路径 -> 未被删除的模板id，不存在时返回None"""
+        for i in self.templates.find_all(path):
+            if i not in self.removed:
+                return i
+        return None
+    
+    def add(self, paths):
+        """增量加入模板（生成新的目录对象，不修改正在显示的旧目录）"""
+        self.templates = self.templates.extended(list(paths))
+        self._index_catalog()
+    
+    def remove(self, paths):
+        """增量删除模板，删除过多时整体重建"""
+        for tpl in paths:
+            i = self.position(tpl)
+            if i is not None:
+                self.removed.add(i)
+        if len(self.removed) > len(self.templates) // 2:
+            self.__init__(list(self.live_templates()), self.field_lookup)
+    
+    def live_templates(self):
+        """未被删除的全部模板"""
+        if not self.removed:
+            return self.templates
+        return CatalogView(self.templates, self.search(''))
+    
+    def search(self, query, candidates=None):
+        """执行搜索，返回匹配的模板id数组（升序）
+        
+        candidates 为上一次结果时只在其中继续缩小范围
+        """
+        result = self._search(query, candidates)
+        if self.removed:
+            removed = self.removed
+            result = array('I', [i for i in result if i not in removed])
+        return result
+    
+    def _search(self, query, candidates):
+        terms, fields = parse_search_query(query)
+        if not terms and not fields:
+            return array('I', range(len(self.templates))) if candidates is None else candidates
+        
+        # 字段条件优先走元数据索引查询
+        field_ids = self._lookup_fields(fields)
+        if field_ids is not None:
+            fields = []
+            if candidates is not None:
+                field_ids.intersection_update(candidates)
+            ids = sorted(field_ids)
+        else:
+            ids = candidates
+            if ids is None:
+                # 没有元数据时字段值也必须出现在路径中，可一并用于三元组预筛选
+                ids = self._trigram_candidates(terms + [value for _, value in fields])
+            if ids is None:
+                ids = range(len(self.templates))
+        
+        if not fields and len(terms) == 1 and '/' not in terms[0]:
+            # 最常见的单个查询词：目录都以 / 结尾，不含 / 的词不会跨越目录和文件名，直接内联判断
+            term = terms[0]
+            full = {d for d, text in enumerate(self.lowered_dirs) if term in text}
+            dir_ids, offsets, find = self.templates.dir_ids, self.templates.offsets, self.lowered_names.find
+            return array('I', [i for i in ids if dir_ids[i] in full or find(term, offsets[i], offsets[i + 1]) >= 0])
+        matchers = [self._matcher(term) for term in terms]
+        if not fields:
+            if len(matchers) == 1:
+                match = matchers[0]
+                return array('I', [i for i in ids if match(i)])
+            return array('I', [i for i in ids if all(match(i) for match in matchers)])
+        return array('I', [i for i in ids
+                           if all(match(i) for match in matchers) and self._match_fields(i, fields)])
+    
+    def _trigram_candidates(self, terms):
+        """取最短的三元组倒排表作为候选（升序），没有可用的三元组时返回None
+        
+        候选随后还会逐条校验子串，因此无需对多个倒排表求交集
+        """
+        best = None
+        for term in terms:
+            for j in range(len(term) - 2):
+                posting = self.trigrams.get(term[j:j + 3])
+                if posting is None:
+                    return []
+                if best is None or len(posting) < len(best):
+                    best = posting
+        return best
+    
+    def _lookup_fields(self, fields):
+        """通过元数据索引求字段条件的交集，返回模板id集合；元数据不可用时返回None"""
+        if not fields or not self.field_lookup:
+            return None
+        
+        result = None
+        for field, value in fields:
+            paths = self.field_lookup(field, value)
+            if paths is None:
+                return None
+            ids = {self.position(path) for path in paths}
+            ids.discard(None)
+            result = ids if result is None else result & ids
+            if not result:
+                break
+        return result
+    
+    def _match_fields(self, i, fields):
+        """没有元数据时按路径判断字段条件：协议取第一级目录，标签/ID匹配任意路径段的前缀
+        
+        字段值均按前缀/子串匹配，保证查询追加字符时结果只会缩小
+        """
+        text = self.lowered_path(i)
+        for field, value in fields:
+            if field == 'protocol':
+                if not text.startswith(value):
+                    return False
+            elif field in ('tags', 'id'):
+                if not text.startswith(value) and ('/' + value) not in text:
+                    return False
+            elif value not in text:
+                return False
+        return True
+    
+    def memory(self):
+        """内存占用估算（字节）：模板目录、小写的目录和文件名、三元组倒排表"""
+        trigrams = sys.getsizeof(self.trigrams) + sum(sys.getsizeof(gram) + sys.getsizeof(postings)
+                                                      for gram, postings in self.trigrams.items())
+        lowered = (sys.getsizeof(self.lowered_dirs) + sum(sys.getsizeof(text) for text in self.lowered_dirs)
+                   + sys.getsizeof(self.lowered_names))
+        catalog = self.templates.memory()
+        return {'catalog_bytes': catalog['total_bytes'], 'lowered_bytes': lowered, 'trigram_bytes': trigrams,
+                'trigrams': len(self.trigrams), 'total_bytes': catalog['total_bytes'] + lowered + trigrams}
+
+
+def read_nuclei_templates_config():
+    """读取nuclei的 .templates-config.json（包含模板目录和版本），不存在时返回空字典"""
+    home = os.path.expanduser('~')
+    config_dirs = [os.path.join(home, '.config', 'nuclei')]
+    if os.environ.get('APPDATA'):
+        config_dirs.append(os.path.join(os.environ['APPDATA'], 'nuclei'))
+    
+    for config_dir in config_dirs:
+        config_file = os.path.join(config_dir, '.templates-config.json')
+        try:
+            with open(config_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            continue
+    return {}
+
+
+def find_templates_dir():
+    """定位nuclei-templates目录：优先读取nuclei配置，默认 ~/nuclei-templates"""
+    directory = read_nuclei_templates_config().get('nuclei-templates-directory')
+    if directory and os.path.isdir(directory):
+        return directory
+    
+    default_dir = os.path.join(os.path.expanduser('~'), 'nuclei-templates')
+    return default_dir if os.path.isdir(default_dir) else None
+
+
+def atomic_write_text(path, text):
+    """先写入同目录下的临时文件再原子替换，避免中途崩溃留下半个文件"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix='.tmp_', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='\n') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def read_git_head(repo_dir):
+    """读取git仓库当前提交（不调用git命令），不是git仓库时返回空字符串"""
+    git_dir = os.path.join(repo_dir, '.git')
+    try:
+        with open(os.path.join(git_dir, 'HEAD'), 'r', encoding='utf-8') as f:
+            head = f.read().strip()
+        if not head.startswith('ref:'):
+            return head
+        ref = head[4:].strip()
+        ref_file = os.path.join(git_dir, *ref.split('/'))
+        if os.path.exists(ref_file):
+            with open(ref_file, 'r', encoding='utf-8') as f:
+                return f.read().strip()
+        with open(os.path.join(git_dir, 'packed-refs'), 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.rstrip().endswith(' ' + ref):
+                    return line.split(' ', 1)[0]
+    except OSError:
+        pass
+    return ''
+
+
+def _dir_mtimes(directory, depth):
+    """收集目录及其前 depth 层子目录的 (相对路径, mtime)"""
+    result = []
+    pending = [(directory, 0)]
+    while pending:
+        current, level = pending.pop()
+        try:
+            result.append((os.path.relpath(current, directory), os.stat(current).st_mtime_ns))
+            if level < depth:
+                with os.scandir(current) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False) and not entry.name.startswith('.'):
+                            pending.append((entry.path, level + 1))
+        except OSError:
+            continue
+    result.sort()
+    return result
+
+
+def official_templates_fingerprint(templates_dir):
+    """官方模板目录指纹：模板版本 + git HEAD + 前两层目录的mtime"""
+    config = read_nuclei_templates_config()
+    parts = [config.get('nuclei-templates-version', ''), templates_dir or '']
+    if templates_dir:
+        parts.append(read_git_head(templates_dir))
+        parts.extend(f"{path}:{mtime}" for path, mtime in _dir_mtimes(templates_dir, 2))
+    return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+class TemplateCache:
+    """模板列表缓存：按目录指纹判断有效性
+    
+    文件第一行是JSON头部（指纹、数量、时间），可以不解析正文单独读取；
+    正文每行为 "与上一行共享的前缀长度\t剩余部分"（前缀压缩）；写入时先写临时文件再原子替换
+    """
+    
+    MAGIC = 'NGTC1 '
+    
+    def __init__(self, path):
+        self.path = path
+    
+    def read_header(self):
+        """只读取头部，缓存不存在或格式不对时返回None"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                line = f.readline()
+        except OSError:
+            return None
+        if not line.startswith(self.MAGIC):
+            return None
+        try:
+            return json.loads(line[len(self.MAGIC):])
+        except ValueError:
+            return None
+    
+    def load(self, fingerprint=None):
+        """读取缓存，返回 (头部, 模板目录 TemplateCatalog)；指纹不匹配或缓存损坏时返回None"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                line = f.readline()
+                if not line.startswith(self.MAGIC):
+                    return None
+                header = json.loads(line[len(self.MAGIC):])
+                if fingerprint is not None and header.get('fingerprint') != fingerprint:
+                    return None
+                body = f.read()
+        except (OSError, ValueError):
+            return None
+        
+        def decode():
+            previous = ''
+            for entry in body.split('\n'):
+                if not entry:
+                    continue
+                shared, _, suffix = entry.partition('\t')
+                previous = previous[:int(shared)] + suffix
+                yield previous
+        
+        # 边解码边加入目录，不生成中间的路径列表
+        paths = TemplateCatalog(decode())
+        if len(paths) != header.get('count'):
+            return None
+        return header, paths
+    
+    def save(self, paths, fingerprint, **extra):
+        """原子写入缓存"""
+        header = dict(extra, fingerprint=fingerprint, count=len(paths),
+                      timestamp=datetime.now().isoformat())
+        lines = [self.MAGIC + json.dumps(header, ensure_ascii=False)]
+        previous = ''
+        for path in paths:
+            shared = 0
+            limit = min(len(path), len(previous), 9999)
+            while shared < limit and path[shared] == previous[shared]:
+                shared += 1
+            lines.append(f"{shared}\t{path[shared:]}")
+            previous = path
+        
+        lines.append('')
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        atomic_write_text(self.path, '\n'.join(lines))
+    
+    def clear(self):
+        """删除缓存文件，返回是否确实删除了文件"""
+        try:
+            os.remove(self.path)
+            return True
+        except FileNotFoundError:
+            return False
+
+
+# 模板顶层键 -> 协议类型
+TEMPLATE_PROTOCOL_KEYS = {
+    'http': 'http', 'requests': 'http', 'dns': 'dns', 'network': 'network', 'tcp': 'network',
+    'file': 'file', 'headless': 'headless', 'ssl': 'ssl', 'websocket': 'websocket',
+    'whois': 'whois', 'code': 'code', 'javascript': 'javascript', 'workflows': 'workflow',
+}
+
+
+def _yaml_scalar(value):
+    """去掉YAML标量两侧的引号和行尾注释"""
+    value = value.strip()
+    if value[:1] in ('"', "'"):
+        quote = value[0]
+        end = value.find(quote, 1)
+        return value[1:end] if end != -1 else value[1:]
+    return value.split(' #', 1)[0].strip()
+
+
+def _yaml_list(value):
+    """解析 "a,b,c" 或 "[a, b]" 形式的列表"""
+    value = _yaml_scalar(value).strip('[]')
+    return [item.strip().strip('"\'') for item in value.split(',') if item.strip()]
+
+
+def parse_template_metadata(text):
+    """从模板YAML中提取 id、info(name/author/severity/tags) 和协议类型
+    
+    只逐行读取这几个字段，不依赖完整的YAML解析器
+    """
+    meta = {'id': '', 'name': '', 'author': '', 'severity': '', 'tags': [], 'protocol': ''}
+    authors = []
+    in_info = False
+    info_indent = None
+    list_key = None
+    
+    for raw in text.splitlines():
+        stripped = raw.strip()
+        if not stripped or stripped.startswith('#'):
+            continue
+        indent = len(raw) - len(raw.lstrip())
+        
+        if indent == 0:
+            in_info = False
+            list_key = None
+            key, sep, value = stripped.partition(':')
+            if not sep:
+                continue
+            key = key.strip()
+            if key == 'id':
+                meta['id'] = _yaml_scalar(value)
+            elif key == 'info':
+                in_info = True
+                info_indent = None
+            elif key in TEMPLATE_PROTOCOL_KEYS and not meta['protocol']:
+                meta['protocol'] = TEMPLATE_PROTOCOL_KEYS[key]
+            continue
+        
+        if not in_info:
+            continue
+        if info_indent is None:
+            info_indent = indent
+        
+        if indent == info_indent and not stripped.startswith('- '):
+            list_key = None
+            key, sep, value = stripped.partition(':')
+            key = key.strip()
+            value = value.strip()
+            if key in ('name', 'severity'):
+                meta[key] = _yaml_scalar(value)
+            elif key in ('tags', 'author'):
+                if value and value not in ('|', '>'):
+                    items = _yaml_list(value)
+                    if key == 'tags':
+                        meta['tags'].extend(items)
+                    else:
+                        authors.extend(items)
+                else:
+                    list_key = key
+        elif list_key and stripped.startswith('- '):
+            item = _yaml_scalar(stripped[2:])
+            if list_key == 'tags':
+                meta['tags'].append(item)
+            else:
+                authors.append(item)
+    
+    meta['author'] = ','.join(authors)
+    meta['severity'] = meta['severity'].lower()
+    meta['tags'] = sorted({tag.lower() for tag in meta['tags'] if tag})
+    return meta
+
+
+def index_template_files(batch):
+    """进程池任务：读取一批模板文件并解析元数据
+    
+    batch 为 [(键, 文件路径, 旧哈希), ...]，返回 [(键, 新哈希, 元数据或None), ...]；
+    内容哈希未变化时不解析，元数据为None
+    """
+    results = []
+    for key, path, old_hash in batch:
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            results.append((key, None, None))
+            continue
+        digest = hashlib.sha1(data).hexdigest()
+        if digest == old_hash:
+            results.append((key, digest, None))
+        else:
+            results.append((key, digest, parse_template_metadata(data.decode('utf-8', 'replace'))))
+    return results
+
+
+TEMPLATE_SUFFIXES = ('.yaml', '.yml')
+
+
+def scan_template_dir(path):
+    """扫描单个目录（不递归），返回 (mtime_ns, 模板文件名集合, 子目录名集合)；目录不可读时返回None"""
+    try:
+        mtime = os.stat(path).st_mtime_ns
+        files = set()
+        subdirs = set()
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.add(entry.name)
+                    elif entry.name.endswith(TEMPLATE_SUFFIXES) and entry.is_file():
+                        files.add(entry.name)
+                except OSError:
+                    continue
+        return mtime, files, subdirs
+    except OSError:
+        return None
+
+
+def _stat_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class CustomTemplateScanner:
+    """自定义模板增量扫描器
+    
+    用线程池并行 scandir 遍历多个根目录，记录每个目录的mtime；
+    之后的 rescan 只重新列出mtime变化的目录，返回新增/删除的模板增量
+    """
+    
+    def __init__(self, workers=8):
+        self.workers = workers
+        self.roots = []
+        # 目录 -> [mtime_ns, 所属根目录, 模板文件名集合, 子目录名集合]
+        self.dirs = {}
+        self._lock = threading.Lock()
+    
+    def templates(self):
+        """当前所有模板的完整路径（按路径排序）"""
+        return sorted(os.path.join(directory, name)
+                      for directory, info in self.dirs.items() for name in info[2])
+    
+    def add_root(self, root):
+        """加入一个根目录并完整扫描，返回 (新增, 删除)；已被现有根目录包含时返回None"""
+        root = os.path.normpath(root)
+        with self._lock:
+            if any(root == r or root.startswith(r.rstrip(os.sep) + os.sep) for r in self.roots):
+                return None
+            
+            # 新根目录包含已有根目录时，先移除旧的再整体扫描
+            removed = []
+            for nested in [r for r in self.roots if r.startswith(root.rstrip(os.sep) + os.sep)]:
+                self.roots.remove(nested)
+                removed.extend(self._drop_tree(nested))
+            
+            self.roots.append(root)
+            added = self._walk([root], root)
+            added_set = set(added)
+            removed_set = set(removed)
+            return ([path for path in added if path not in removed_set],
+                    [path for path in removed if path not in added_set])
+    
+    def remove_root(self, root):
+        """移除一个根目录，返回被移除的模板"""
+        root = os.path.normpath(root)
+        with self._lock:
+            if root not in self.roots:
+                return []
+            self.roots.remove(root)
+            return self._drop_tree(root)
+    
+    def clear(self):
+        with self._lock:
+            self.roots = []
+            self.dirs = {}
+    
+    def rescan(self):
+        """并行检查所有已知目录的mtime，只重新列出有变化的目录，返回 (新增, 删除)"""
+        with self._lock:
+            directories = list(self.dirs)
+            if not directories:
+                return [], []
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                mtimes = list(pool.map(_stat_mtime, directories))
+            
+            added = []
+            removed = []
+            changed = []
+            for directory, mtime in zip(directories, mtimes):
+                info = self.dirs.get(directory)
+                if info is None:
+                    continue
+                if mtime is None:
+                    removed.extend(self._drop_tree(directory))
+                elif mtime != info[0]:
+                    changed.append(directory)
+            
+            for directory in changed:
+                info = self.dirs.get(directory)
+                if info is None:
+                    continue
+                result = scan_template_dir(directory)
+                if result is None:
+                    removed.extend(self._drop_tree(directory))
+                    continue
+                
+                mtime, files, subdirs = result
+                old_files, old_subdirs = info[2], info[3]
+                added.extend(os.path.join(directory, name) for name in sorted(files - old_files))
+                removed.extend(os.path.join(directory, name) for name in old_files - files)
+                for name in old_subdirs - subdirs:
+                    removed.extend(self._drop_tree(os.path.join(directory, name)))
+                self.dirs[directory] = [mtime, info[1], files, subdirs]
+                
+                new_dirs = [os.path.join(directory, name) for name in subdirs - old_subdirs]
+                added.extend(self._walk(new_dirs, info[1]))
+            
+            return added, removed
+    
+    def _walk(self, start_dirs, root):
+        """并行遍历目录树，边完成边提交子目录，返回发现的模板"""
+        added = []
+        if not start_dirs:
+            return added
+        
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(scan_template_dir, directory): directory for directory in start_dirs}
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    directory = futures.pop(future)
+                    result = future.result()
+                    if result is None:
+                        continue
+                    mtime, files, subdirs = result
+                    self.dirs[directory] = [mtime, root, files, subdirs]
+                    added.extend(os.path.join(directory, name) for name in sorted(files))
+                    for name in subdirs:
+                        child = os.path.join(directory, name)
+                        futures[pool.submit(scan_template_dir, child)] = child
+        return added
+    
+    def _drop_tree(self, directory):
+        """移除目录及其所有子目录的记录，返回其中的模板"""
+        prefix = directory.rstrip(os.sep) + os.sep
+        removed = []
+        for path in [d for d in self.dirs if d == directory or d.startswith(prefix)]:
+            info = self.dirs.pop(path)
+            removed.extend(os.path.join(path, name) for name in info[2])
+        return removed
+    
+    def fingerprint(self):
+        """所有已知目录mtime的摘要"""
+        with self._lock:
+            parts = sorted(f"{directory}:{info[0]}" for directory, info in self.dirs.items())
+        return hashlib.sha1('\n'.join(self.roots + parts).encode('utf-8')).hexdigest()
+    
+    def export_state(self):
+        """导出目录状态（文件列表由模板缓存保存）"""
+        with self._lock:
+            return {'roots': list(self.roots),
+                    'dirs': {directory: [info[0], info[1]] for directory, info in self.dirs.items()}}
+    
+    def import_state(self, state, templates):
+        """从导出的目录状态和缓存的模板列表恢复扫描器，之后 rescan 只处理变化的目录"""
+        with self._lock:
+            self.roots = list(state.get('roots', []))
+            self.dirs = {directory: [mtime, root, set(), set()]
+                         for directory, (mtime, root) in state.get('dirs', {}).items()}
+            for path in templates:
+                info = self.dirs.get(os.path.dirname(path))
+                if info is not None:
+                    info[2].add(os.path.basename(path))
+            for directory in self.dirs:
+                parent = os.path.dirname(directory)
+                if parent != directory and parent in self.dirs:
+                    self.dirs[parent][3].add(os.path.basename(directory))
+
+
+class TemplateMetadataIndex:
+    """模板元数据索引：进程池解析模板YAML，结果保存在本地SQLite中
+    
+    按 mtime/size 判断文件是否变化，变化的文件再比较内容哈希，只重新解析内容真正改变的模板
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS templates (
+            path TEXT PRIMARY KEY,
+            source TEXT NOT NULL,
+            mtime REAL,
+            size INTEGER,
+            hash TEXT,
+            template_id TEXT COLLATE NOCASE,
+            name TEXT,
+            severity TEXT COLLATE NOCASE,
+            protocol TEXT COLLATE NOCASE,
+            author TEXT COLLATE NOCASE
+        );
+        CREATE TABLE IF NOT EXISTS template_tags (
+            tag TEXT COLLATE NOCASE NOT NULL,
+            path TEXT NOT NULL,
+            PRIMARY KEY (tag, path)
+        );
+        CREATE INDEX IF NOT EXISTS idx_templates_source ON templates(source);
+        CREATE INDEX IF NOT EXISTS idx_templates_id ON templates(template_id);
+        CREATE INDEX IF NOT EXISTS idx_templates_severity ON templates(severity);
+        CREATE INDEX IF NOT EXISTS idx_templates_protocol ON templates(protocol);
+        CREATE INDEX IF NOT EXISTS idx_templates_author ON templates(author);
+        CREATE INDEX IF NOT EXISTS idx_template_tags_path ON template_tags(path);
+    """
+    
+    # 搜索字段 -> (SQL, 匹配方式)
+    FIELD_QUERIES = {
+        'severity': ("SELECT path FROM templates WHERE severity LIKE ? ESCAPE '\\'", 'prefix'),
+        'protocol': ("SELECT path FROM templates WHERE protocol LIKE ? ESCAPE '\\'", 'prefix'),
+        'id': ("SELECT path FROM templates WHERE template_id LIKE ? ESCAPE '\\'", 'prefix'),
+        'author': ("SELECT path FROM templates WHERE author LIKE ? ESCAPE '\\'", 'contains'),
+        'tags': ("SELECT DISTINCT path FROM template_tags WHERE tag LIKE ? ESCAPE '\\'", 'prefix'),
+    }
+    
+    def __init__(self, db_path="./work/templates_meta.db", workers=None):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.db_path = db_path
+        self.workers = workers or os.cpu_count() or 2
+        self._lock = threading.Lock()
+        self._update_lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock:
+            self._conn.executescript(self.SCHEMA)
+    
+    def update(self, source, keys, resolve, batch_size=200):
+        """同步一个来源（official/custom）的模板元数据，返回 (解析数, 未变化数, 删除数)
+        
+        resolve(键) 返回模板文件的实际路径，无法定位时返回None
+        """
+        with self._update_lock:
+            existing = self._existing(source)
+            key_set = set(keys)
+            todo, stats = self._collect(keys, resolve, existing)
+            removed = [path for path in existing if path not in key_set]
+            parsed = self._store(source, self._parse(todo, batch_size), stats, removed)
+            return parsed, len(keys) - parsed, len(removed)
+    
+    def apply_delta(self, source, added, removed, resolve, batch_size=200):
+        """只处理新增和删除的模板（目录监视产生的增量），返回 (解析数, 未变化数, 删除数)"""
+        with self._update_lock:
+            existing = self._existing(source)
+            todo, stats = self._collect(added, resolve, existing)
+            removed = [path for path in removed if path in existing]
+            parsed = self._store(source, self._parse(todo, batch_size), stats, removed)
+            return parsed, len(added) - parsed, len(removed)
+    
+    def _existing(self, source):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path, mtime, size, hash FROM templates WHERE source = ?", (source,)).fetchall()
+        return {row[0]: row[1:] for row in rows}
+    
+    @staticmethod
+    def _collect(keys, resolve, existing):
+        """找出 mtime/size 有变化的模板，返回 (待解析列表, 文件状态)"""
+        todo = []
+        stats = {}
+        for key in keys:
+            path = resolve(key)
+            if not path:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            old = existing.get(key)
+            if old and old[0] == st.st_mtime and old[1] == st.st_size:
+                continue
+            stats[key] = (st.st_mtime, st.st_size)
+            todo.append((key, path, old[2] if old else None))
+        return todo, stats
+    
+    def _store(self, source, results, stats, removed):
+        """在一个事务中写入解析结果并删除已移除的模板，返回实际解析的数量"""
+        parsed = 0
+        with self._lock, self._conn:
+            for i in range(0, len(removed), 500):
+                chunk = removed[i:i + 500]
+                marks = ','.join('?' * len(chunk))
+                self._conn.execute(f"DELETE FROM templates WHERE path IN ({marks})", chunk)
+                self._conn.execute(f"DELETE FROM template_tags WHERE path IN ({marks})", chunk)
+            
+            for key, digest, meta in results:
+                if digest is None:
+                    continue
+                mtime, size = stats[key]
+                if meta is None:
+                    # 内容未变，只更新文件状态
+                    self._conn.execute("UPDATE templates SET mtime = ?, size = ? WHERE path = ?",
+                                       (mtime, size, key))
+                    continue
+                parsed += 1
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO templates (path, source, mtime, size, hash, template_id, "
+                    "name, severity, protocol, author) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key, source, mtime, size, digest, meta['id'], meta['name'],
+                     meta['severity'], meta['protocol'], meta['author']))
+                self._conn.execute("DELETE FROM template_tags WHERE path = ?", (key,))
+                self._conn.executemany("INSERT OR IGNORE INTO template_tags (tag, path) VALUES (?, ?)",
+                                       [(tag, key) for tag in meta['tags']])
+        return parsed
+    
+    def _parse(self, todo, batch_size):
+        """文件较多时用进程池并行解析，否则在当前线程解析"""
+        batches = [todo[i:i + batch_size] for i in range(0, len(todo), batch_size)]
+        if len(batches) <= 1:
+            return index_template_files(todo)
+        
+        results = []
+        try:
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(batches))) as pool:
+                for batch_result in pool.map(index_template_files, batches):
+                    results.extend(batch_result)
+        except Exception:
+            # 进程池不可用（如受限环境）时退化为单线程解析
+            results = index_template_files(todo)
+        return results
+    
+    def lookup(self, field, value):
+        """查询字段条件匹配的模板路径集合；字段不支持或查询失败时返回None"""
+        query = self.FIELD_QUERIES.get(field)
+        if not query:
+            return None
+        sql, mode = query
+        escaped = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        pattern = escaped + '%' if mode == 'prefix' else '%' + escaped + '%'
+        try:
+            with self._lock:
+                return {row[0] for row in self._conn.execute(sql, (pattern,))}
+        except sqlite3.Error:
+            return None
+    
+    def paths_where(self, source, field, value):
+        """字段值完全相等（不区分大小写）的模板路径集合，只支持 severity 和 tags"""
+        if field == 'severity':
+            sql = "SELECT path FROM templates WHERE source = ? AND severity = ?"
+        elif field == 'tags':
+            sql = ("SELECT t.path FROM template_tags t JOIN templates m ON m.path = t.path "
+                   "WHERE m.source = ? AND t.tag = ?")
+        else:
+            return None
+        try:
+            with self._lock:
+                return {row[0] for row in self._conn.execute(sql, (source, value))}
+        except sqlite3.Error:
+            return None
+    
+    def tags_of(self, path):
+        """一个模板的全部标签"""
+        try:
+            with self._lock:
+                return [row[0] for row in self._conn.execute(
+                    "SELECT tag FROM template_tags WHERE path = ?", (path,))]
+        except sqlite3.Error:
+            return []
+    
+    def count(self, source=None):
+        with self._lock:
+            if source:
+                return self._conn.execute("SELECT COUNT(*) FROM templates WHERE source = ?", (source,)).fetchone()[0]
+            return self._conn.execute("SELECT COUNT(*) FROM templates").fetchone()[0]
+
+
+# 不写入结果库的大字段（完整内容保留在 -o 的JSONL文件中）
+FINDING_OMIT_KEYS = ('request', 'response', 'curl-command')
+
+
+def parse_finding_line(line, scan_id=''):
+    """解析nuclei -jsonl 输出的一行，返回结果库中的一行；不是结果时返回None"""
+    line = line.strip()
+    if not line.startswith('{'):
+        return None
+    try:
+        data = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(data, dict) or 'template-id' not in data:
+        return None
+    
+    info = data.get('info') or {}
+    host = data.get('host') or ''
+    extracted = data.get('extracted-results')
+    for key in FINDING_OMIT_KEYS:
+        data.pop(key, None)
+    return (
+        str(data.get('template-id') or ''),
+        str(info.get('name') or ''),
+        str(data.get('matcher-name') or ''),
+        str(host),
+        str(data.get('matched-at') or host),
+        str(info.get('severity') or 'unknown').lower(),
+        str(data.get('type') or ''),
+        str(data.get('timestamp') or datetime.now().isoformat()),
+        scan_id,
+        json.dumps(extracted, ensure_ascii=False) if extracted else '',
+        json.dumps(data, ensure_ascii=False),
+    )
+
+
+class FindingsStore:
+    """扫描结果库：解析后的结果保存在本地SQLite中
+    
+    扫描线程调用 add() 只入队，由单独的写线程按批在事务中写入；
+    (模板, matcher, 主机, matched-at) 相同的结果只保留一条。
+    写入失败的批次不丢弃，留到下一批一起重试
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS findings (
+            id INTEGER PRIMARY KEY,
+            template_id TEXT NOT NULL,
+            template_name TEXT,
+            matcher TEXT NOT NULL DEFAULT '',
+            host TEXT NOT NULL,
+            matched_at TEXT NOT NULL DEFAULT '',
+            severity TEXT COLLATE NOCASE,
+            type TEXT,
+            timestamp TEXT,
+            scan_id TEXT,
+            extracted TEXT,
+            data TEXT,
+            UNIQUE (template_id, matcher, host, matched_at)
+        );
+        CREATE INDEX IF NOT EXISTS idx_findings_host ON findings(host, severity, timestamp);
+        CREATE INDEX IF NOT EXISTS idx_findings_template ON findings(template_id);
+        CREATE INDEX IF NOT EXISTS idx_findings_severity ON findings(severity, timestamp);
+        CREATE INDEX IF NOT EXISTS idx_findings_timestamp ON findings(timestamp);
+        CREATE INDEX IF NOT EXISTS idx_findings_group ON findings(severity, template_id, host);
+    """
+    
+    COLUMNS = ('template_id', 'template_name', 'matcher', 'host', 'matched_at', 'severity',
+               'type', 'timestamp', 'scan_id', 'extracted', 'data')
+    # 有未写入的结果时，没有新结果也每隔这么多秒重试一次
+    RETRY_S = 2.0
+    # 关闭时仍写入失败，最多再重试的次数
+    CLOSE_RETRIES = 3
+    
+    def __init__(self, db_path="./work/findings.db", batch_size=2000, flush_ms=200):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_ms = flush_ms
+        # on_insert(新增条数)，每写完一批在写线程中调用
+        self.on_insert = None
+        # on_error(提示文字)，写入失败和恢复时在写线程中调用
+        self.on_error = None
+        self._failing = False
+        self.inserted = 0
+        self.duplicates = 0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(self.SCHEMA)
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+    
+    def add(self, row):
+        """加入一条 parse_finding_line 返回的结果（线程安全，不等待写入）"""
+        self._queue.put(row)
+    
+    def insert_many(self, rows):
+        """在一个事务中写入一批结果，返回新增条数（重复的忽略）"""
+        sql = (f"INSERT OR IGNORE INTO findings ({', '.join(self.COLUMNS)}) "
+               f"VALUES ({', '.join('?' * len(self.COLUMNS))})")
+        with self._lock:
+            before = self._conn.total_changes
+            with self._conn:
+                self._conn.executemany(sql, rows)
+            added = self._conn.total_changes - before
+        self.inserted += added
+        self.duplicates += len(rows) - added
+        return added
+    
+    def _write_loop(self):
+        pending = []
+        stop = False
+        while not stop:
+            batch, pending = pending, []
+            try:
+                row = self._queue.get(timeout=self.RETRY_S if batch else None)
+            except queue.Empty:
+                row = False
+            if row is None:
+                stop = True
+            elif row:
+                batch.append(row)
+                deadline = time.monotonic() + self.flush_ms / 1000.0
+                while len(batch) < self.batch_size:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        row = self._queue.get(timeout=timeout)
+                    except queue.Empty:
+                        break
+                    if row is None:
+                        stop = True
+                        break
+                    batch.append(row)
+            if not batch:
+                continue
+            
+            retries = self.CLOSE_RETRIES if stop else 0
+            while True:
+                try:
+                    added = self.insert_many(batch)
+                    break
+                except sqlite3.Error as e:
+                    error = e
+                if retries <= 0:
+                    added = None
+                    break
+                retries -= 1
+                time.sleep(self.RETRY_S / 4)
+            
+            if added is None:
+                if stop:
+                    self._report(f"写入扫描结果失败，{len(batch)} 条结果未能保存: {error}")
+                    return
+                # 连续失败时只提示一次，恢复后再提示
+                if not self._failing:
+                    self._report(f"写入扫描结果失败，{len(batch)} 条结果稍后重试: {error}")
+                self._failing = True
+                pending = batch
+                continue
+            if self._failing:
+                self._failing = False
+                self._report(f"扫描结果已恢复写入（{len(batch)} 条）")
+            if self.on_insert:
+                self.on_insert(added)
+    
+    def _report(self, text):
+        if self.on_error:
+            self.on_error(text)
+    
+    def _where(self, filters):
+        """filters: {'severity'/'host'/'template_id'/'scan_id': 值, 'text': 模糊匹配,
+        'min_id'/'max_id': id范围（不含min_id，含max_id）}"""
+        clauses, params = [], []
+        for column in ('severity', 'host', 'template_id', 'scan_id'):
+            value = (filters or {}).get(column)
+            if value:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if (filters or {}).get('min_id') is not None:
+            clauses.append("id > ?")
+            params.append(filters['min_id'])
+        if (filters or {}).get('max_id') is not None:
+            clauses.append("id <= ?")
+            params.append(filters['max_id'])
+        text = (filters or {}).get('text')
+        if text:
+            escaped = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            clauses.append("(template_id LIKE ? ESCAPE '\\' OR host LIKE ? ESCAPE '\\' "
+                           "OR matched_at LIKE ? ESCAPE '\\')")
+            params.extend(['%' + escaped + '%'] * 3)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+    
+    def count(self, filters=None):
+        where, params = self._where(filters)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM findings{where}", params).fetchone()[0]
+    
+    def query(self, filters=None, order_by='timestamp', limit=100, offset=0):
+        """按条件分页查询，返回 (id, 模板, 严重级别, 主机, matched-at, 时间) 列表"""
+        if order_by not in ('id', 'timestamp', 'host', 'template_id', 'severity', 'matched_at'):
+            order_by = 'id'
+        where, params = self._where(filters)
+        sql = (f"SELECT id, template_id, severity, host, matched_at, timestamp FROM findings{where} "
+               f"ORDER BY {order_by} LIMIT ? OFFSET ?")
+        with self._lock:
+            return self._conn.execute(sql, params + [limit, offset]).fetchall()
+    
+    def group_counts(self, filters, column, order='count', limit=100, offset=0):
+        """按模板或主机分组计数，返回 [(值, 条数)]；order 为 count（多的在前）或 name"""
+        if column not in ('template_id', 'host'):
+            raise ValueError(column)
+        order_sql = "COUNT(*) DESC, 1" if order == 'count' else "1"
+        where, params = self._where(filters)
+        sql = (f"SELECT {column}, COUNT(*) FROM findings{where} GROUP BY {column} "
+               f"ORDER BY {order_sql} LIMIT ? OFFSET ?")
+        with self._lock:
+            return self._conn.execute(sql, params + [limit, offset]).fetchall()
+    
+    def max_id(self):
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM findings").fetchone()[0]
+    
+    def get(self, finding_id):
+        """一条结果的完整JSON（不含请求/响应）"""
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM findings WHERE id = ?", (finding_id,)).fetchone()
+        return row[0] if row else None
+    
+    def severity_counts(self, filters=None):
+        where, params = self._where(filters)
+        with self._lock:
+            return dict(self._conn.execute(
+                f"SELECT severity, COUNT(*) FROM findings{where} GROUP BY severity", params).fetchall())
+    
+    def close(self):
+        """写完队列中剩余的结果后关闭"""
+        self._queue.put(None)
+        self._writer.join()
+        with self._lock:
+            self._conn.close()
+
+
+class NucleiCommandBuilder:
+    """nuclei命令构建器
+    
+    选中的模板不再逐个展开成 -t 参数：整个目录都被选中时折叠成目录，选择恰好等于某些严重级别
+    或某个标签的全部模板时改用 -severity/-tags 交给nuclei过滤，其余的写入临时列表文件
+    """
+    
+    # 模板参数不超过这个数量时直接放在命令行上
+    MAX_INLINE = 20
+    SEVERITIES = ('info', 'low', 'medium', 'high', 'critical', 'unknown')
+    
+    def __init__(self, selected, official_templates=(), metadata_index=None, list_dir=None):
+        self.selected = list(selected)
+        self.official_templates = official_templates
+        # 元数据索引（官方模板已建立索引时才传入），用于折叠成严重级别/标签过滤
+        self.metadata_index = metadata_index
+        self.list_dir = list_dir
+        self.list_files = []
+        self._template_args = None
+        # 折叠方式的说明，用于输出日志
+        self.summary = ''
+    
+    def build(self, target_args, output_file, proxy_url=None):
+        """返回完整命令，target_args 为 ["-u", url] 或 ["-l", 文件]；结果以JSONL格式输出"""
+        cmd = ["nuclei", "-jsonl", "-o", output_file] + list(target_args)
+        cmd.extend(self.template_args())
+        if proxy_url:
+            cmd.extend(["-p", proxy_url])
+        return cmd
+    
+    def template_args(self):
+        """模板相关参数（同一次扫描的多个进程共用，列表文件只写一次）"""
+        if self._template_args is None:
+            self._template_args = self._collapse()
+        return self._template_args
+    
+    def _collapse(self):
+        official_set = set(self.official_templates)
+        official = [tpl for tpl in self.selected if tpl in official_set]
+        custom = [tpl for tpl in self.selected if tpl not in official_set]
+        
+        # 严重级别/标签是全局过滤条件，只在没有自定义模板时使用
+        if official and not custom and self.metadata_index:
+            args = self._filter_args(set(official), official_set)
+            if args:
+                return args
+        
+        entries = []
+        if official:
+            entries.extend(self._collapse_dirs(official, self.official_templates))
+        entries.extend(custom)
+        self.summary = f"{len(self.selected)} 个模板 -> {len(entries)} 个模板/目录"
+        
+        if len(entries) <= self.MAX_INLINE:
+            args = []
+            for entry in entries:
+                args.extend(["-t", entry])
+            return args
+        
+        with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', prefix='nuclei_templates_',
+                                         dir=self.list_dir, delete=False, encoding='utf-8') as f:
+            f.write('\n'.join(entries) + '\n')
+            self.list_files.append(f.name)
+        self.summary += f"，已写入列表文件 {f.name}"
+        return ["-t", f.name]
+    
+    def _filter_args(self, selected, universe):
+        """选择恰好等于若干严重级别或某个标签的全部模板时，返回对应的过滤参数"""
+        covered = set()
+        severities = []
+        for severity in self.SEVERITIES:
+            paths = self.metadata_index.paths_where('official', 'severity', severity)
+            if paths is None:
+                return None
+            paths &= universe
+            if paths and paths <= selected:
+                covered |= paths
+                severities.append(severity)
+        if severities and covered == selected:
+            self.summary = f"{len(selected)} 个模板 -> -severity {','.join(severities)}"
+            return ["-severity", ",".join(severities)]
+        
+        # 标签：候选只需来自任意一个选中的模板
+        for tag in self.metadata_index.tags_of(next(iter(selected))):
+            paths = self.metadata_index.paths_where('official', 'tags', tag)
+            if paths is not None and (paths & universe) == selected:
+                self.summary = f"{len(selected)} 个模板 -> -tags {tag}"
+                return ["-tags", tag]
+        return None
+    
+    @staticmethod
+    def _collapse_dirs(selected, universe):
+        """把所有模板都被选中的目录折叠成目录本身（取最上层的目录）"""
+        def parents(path):
+            parts = path.replace('\\', '/').split('/')[:-1]
+            return ['/'.join(parts[:i]) for i in range(1, len(parts) + 1)]
+        
+        totals = {}
+        for tpl in universe:
+            for directory in parents(tpl):
+                totals[directory] = totals.get(directory, 0) + 1
+        chosen = {}
+        for tpl in selected:
+            for directory in parents(tpl):
+                chosen[directory] = chosen.get(directory, 0) + 1
+        
+        entries = []
+        emitted = set()
+        for tpl in selected:
+            for directory in parents(tpl):
+                if chosen[directory] == totals.get(directory):
+                    if directory not in emitted:
+                        emitted.add(directory)
+                        entries.append(directory)
+                    break
+            else:
+                entries.append(tpl)
+        return entries
+    
+    @staticmethod
+    def describe(cmd, max_arg=80):
+        """日志中显示的命令：过长的参数截断"""
+        parts = []
+        for arg in cmd:
+            if len(arg) > max_arg:
+                arg = arg[:max_arg // 2] + "..." + arg[-(max_arg // 2):]
+            parts.append(arg)
+        return ' '.join(parts)
+    
+    def cleanup(self):
+        """删除临时列表文件"""
+        for path in self.list_files:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        self.list_files = []
+
+
+def format_duration(seconds):
+    """秒数格式化为 m:ss 或 h:mm:ss"""
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{secs:02d}"
+    return f"{minutes}:{secs:02d}"
+
+
+class ScanJob:
+    """一个扫描任务：一个目标对应一个nuclei进程和一个结果文件"""
+    
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+    TIMEOUT = 'timeout'
+    
+    STATUS_NAMES = {QUEUED: "排队", RUNNING: "运行中", DONE: "完成", FAILED: "失败",
+                    CANCELLED: "已取消", TIMEOUT: "超时"}
+    ENDED = (DONE, FAILED, CANCELLED, TIMEOUT)
+    
+    def __init__(self, index, target, cmd, output_file):
+        self.index = index
+        self.target = target
+        self.cmd = cmd
+        self.output_file = output_file
+        # 批量任务中的分片序号
+        self.shard = None
+        # 任务包含的目标数，整体超时按目标数放大
+        self.target_count = 1
+        # 启动时按速率预算分配的 -rl/-c/-bs 参数
+        self.limit_args = []
+        self.status = ScanJob.QUEUED
+        self.process = None
+        self.cancelled = False
+        self.returncode = None
+        self.error = None
+        self.started = None
+        self.finished = None
+    
+    def duration(self):
+        if self.started is None:
+            return None
+        return (self.finished or time.monotonic()) - self.started
+    
+    def command(self):
+        """实际执行的命令：构建的命令加上速率参数"""
+        return self.cmd + self.limit_args
+
+
+class ProcessLoop:
+    """后台线程中的asyncio事件循环，统一管理所有nuclei子进程
+    
+    进程不再各占一个阻塞读取的线程：stdout/stderr 都是非阻塞管道，由同一个事件循环大块读取；
+    其他线程通过 submit() 提交协程，得到 concurrent.futures.Future
+    """
+    
+    _default = None
+    _default_lock = threading.Lock()
+    
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._use_pidfd_watcher(self.loop)
+        self._thread = threading.Thread(target=self._run, name="nuclei-process-loop", daemon=True)
+        self._thread.start()
+    
+    @classmethod
+    def default(cls):
+        """进程内共用的事件循环（首次使用时启动）"""
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls()
+            return cls._default
+    
+    @staticmethod
+    def _use_pidfd_watcher(loop):
+        """Python 3.12之前默认每个子进程用一个线程等待退出；Linux上改用pidfd，由事件循环统一等待"""
+        if sys.version_info >= (3, 12) or not hasattr(asyncio, 'PidfdChildWatcher'):
+            return
+        try:
+            os.close(os.pidfd_open(os.getpid()))
+        except (AttributeError, OSError):
+            return
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', DeprecationWarning)
+            watcher = asyncio.PidfdChildWatcher()
+            watcher.attach_loop(loop)
+            asyncio.set_child_watcher(watcher)
+    
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+    
+    def in_loop(self):
+        return threading.current_thread() is self._thread
+    
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+
+async def read_lines(stream, on_lines, read_size=256 * 1024):
+    """从非阻塞管道大块读取，增量切分成行，每块读到的整行一次回调 on_lines([以\\n结尾的行, ...])
+    
+    跨块的半行和被切开的多字节字符留到下一块再处理
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')('replace')
+    pending = ''
+    while True:
+        chunk = await stream.read(read_size)
+        text = pending + decoder.decode(chunk, final=not chunk)
+        if not chunk:
+            break
+        # 结尾的 \r 可能是被切开的 \r\n，留到下一块
+        hold = text.endswith('\r')
+        if hold:
+            text = text[:-1]
+        # \r\n 和单独的 \r 都视为行尾（与文本模式的通用换行一致）
+        if '\r' in text:
+            text = text.replace('\r\n', '\n').replace('\r', '\n')
+        lines = text.split('\n')
+        pending = lines.pop() + ('\r' if hold else '')
+        if lines:
+            on_lines([line + '\n' for line in lines])
+    text = text.rstrip('\r')
+    if text:
+        on_lines([text + '\n'])
+
+
+class SupervisedProcess:
+    """受监管的子进程：记录启动时间、最后输出时间和终止原因"""
+    
+    def __init__(self, process, wall_timeout=None, idle_timeout=None):
+        # asyncio.subprocess.Process
+        self.process = process
+        self.wall_timeout = wall_timeout
+        self.idle_timeout = idle_timeout
+        self.started = time.monotonic()
+        self.last_output = self.started
+        # 最近一条 -stats 统计行中的请求数
+        self.stats_requests = 0
+        # 终止原因：None / 'cancelled' / 'timeout' / 'idle'
+        self.reason = None
+        self.term_sent = None
+    
+    def touch(self):
+        """读到输出时调用，用于无输出超时判断"""
+        self.last_output = time.monotonic()
+    
+    def is_activity(self, line):
+        """一行输出是否说明扫描有进展：nuclei -stats 即使目标无响应也会定时输出统计行，
+        统计行只有请求数增加时才算，否则无输出超时永远不会触发"""
+        stats = parse_stats_line(line)
+        if stats is None:
+            return True
+        if stats['requests'] > self.stats_requests:
+            self.stats_requests = stats['requests']
+            return True
+        return False
+
+
+class ProcessSupervisor:
+    """nuclei子进程监管
+    
+    所有进程都在 ProcessLoop 的事件循环中启动和读取；每个进程在独立的进程组中启动，
+    取消或超时时向整个进程组发送SIGTERM，宽限期后仍未退出则SIGKILL；关闭程序时回收所有子进程
+    """
+    
+    # 每个管道在事件循环中的缓冲上限，输出很多时减少暂停/恢复读取的次数
+    PIPE_BUFFER = 1024 * 1024
+    
+    def __init__(self, term_grace=5.0, interval=0.5, loop=None):
+        self.term_grace = term_grace
+        self.interval = interval
+        self.loop = loop or ProcessLoop.default()
+        self._procs = set()
+        self._lock = threading.Lock()
+        self._monitor = None
+    
+    async def spawn(self, cmd, wall_timeout=None, idle_timeout=None, **popen_args):
+        """启动进程（stdout/stderr为两个独立的管道），超时为秒数，None或0表示不限制；在事件循环中调用"""
+        if os.name == 'nt':
+            popen_args.setdefault('creationflags', subprocess.CREATE_NEW_PROCESS_GROUP)
+        else:
+            popen_args.setdefault('start_new_session', True)
+        process = await asyncio.create_subprocess_exec(
+            *cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            limit=self.PIPE_BUFFER, **popen_args)
+        proc = SupervisedProcess(process, wall_timeout or None, idle_timeout or None)
+        with self._lock:
+            self._procs.add(proc)
+        if self._monitor is None or self._monitor.done():
+            self._monitor = asyncio.ensure_future(self._monitor_loop())
+        return proc
+    
+    async def wait(self, proc):
+        """等待进程结束并移出监管，返回退出码"""
+        returncode = await proc.process.wait()
+        with self._lock:
+            self._procs.discard(proc)
+        return returncode
+    
+    async def pump(self, proc, on_line):
+        """同时读取 stdout/stderr 直到关闭，逐行交给 on_line(line, stream)，返回退出码"""
+        def reader(stream):
+            def on_lines(lines):
+                active = False
+                for line in lines:
+                    active = proc.is_activity(line) or active
+                    on_line(line, stream)
+                if active:
+                    proc.touch()
+            return on_lines
+        
+        try:
+            await asyncio.gather(read_lines(proc.process.stdout, reader('stdout')),
+                                 read_lines(proc.process.stderr, reader('stderr')))
+        except BaseException:
+            # 回调出错时不留下无人读取的进程
+            self.terminate(proc, 'cancelled')
+            await self.wait(proc)
+            raise
+        return await self.wait(proc)
+    
+    def run_command(self, cmd, on_line):
+        """在事件循环中运行一条命令（可在任意线程调用），返回结果为退出码的 Future
+        
+        输出逐行回调 on_line(line, stream)，在事件循环线程中调用；命令不存在时 Future 抛出 FileNotFoundError
+        """
+        async def run():
+            return await self.pump(await self.spawn(cmd), on_line)
+        return self.loop.submit(run())
+    
+    def terminate(self, proc, reason='cancelled'):
+        """向进程组发送SIGTERM（Windows发送CTRL_BREAK），宽限期后由监视任务强制结束（线程安全）"""
+        if proc.process.returncode is not None or proc.term_sent is not None:
+            return
+        proc.reason = proc.reason or reason
+        proc.term_sent = time.monotonic()
+        try:
+            if os.name == 'nt':
+                proc.process.send_signal(signal.CTRL_BREAK_EVENT)
+            else:
+                os.killpg(proc.process.pid, signal.SIGTERM)
+        except (OSError, ValueError):
+            pass
+    
+    def kill(self, proc):
+        try:
+            if os.name == 'nt':
+                proc.process.kill()
+            else:
+                os.killpg(proc.process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+    
+    def cancel_all(self):
+        with self._lock:
+            procs = list(self._procs)
+        for proc in procs:
+            self.terminate(proc, 'cancelled')
+    
+    def running(self):
+        with self._lock:
+            return len(self._procs)
+    
+    async def _monitor_loop(self):
+        while self.running():
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            with self._lock:
+                procs = list(self._procs)
+            for proc in procs:
+                if proc.process.returncode is not None:
+                    continue
+                if proc.term_sent is not None:
+                    if now - proc.term_sent >= self.term_grace:
+                        self.kill(proc)
+                elif proc.wall_timeout and now - proc.started > proc.wall_timeout:
+                    self.terminate(proc, 'timeout')
+                elif proc.idle_timeout and now - proc.last_output > proc.idle_timeout:
+                    self.terminate(proc, 'idle')
+    
+    async def _reap(self, timeout):
+        with self._lock:
+            procs = list(self._procs)
+        if not procs:
+            return
+        waiting = [asyncio.ensure_future(proc.process.wait()) for proc in procs]
+        _, pending = await asyncio.wait(waiting, timeout=timeout)
+        if pending:
+            for proc in procs:
+                if proc.process.returncode is None:
+                    self.kill(proc)
+            await asyncio.wait(pending, timeout=1.0)
+        with self._lock:
+            self._procs.difference_update(procs)
+    
+    def shutdown(self, timeout=None):
+        """终止并回收所有子进程（关闭程序时调用，不能在事件循环线程中调用）"""
+        timeout = self.term_grace if timeout is None else timeout
+        self.cancel_all()
+        try:
+            self.loop.submit(self._reap(timeout)).result(timeout + 2.0)
+        except (FutureTimeoutError, RuntimeError):
+            pass
+
+
+class RateBudget:
+    """全局速率预算：所有nuclei进程合计的请求速率（每秒）和并发数，可选单主机速率，None表示不限制
+    
+    进程启动时把剩余预算平均分给尚未启动的槽位，换算成该进程的 -rl/-c/-bs，进程结束时归还；
+    设置了合计进程数时按它为尚未启动的进程预留份额，否则按调用方的槽位数（任务少于并发数时每个进程分到更多）。
+    剩余预算不够每个进程 1 请求/秒和 1 并发时等待其他进程归还，合计始终不超过预算。
+    nuclei运行中不能调整速率，已运行的进程保持启动时的份额，归还的预算由之后启动的进程使用。
+    单主机速率：单目标进程的 -rl 不超过它；多目标进程使用 host-spray 策略（请求轮流发往 -bs 个主机），
+    -rl 不超过 单主机速率 × -bs。
+    多个扫描引擎（界面扫描和队列任务）可以共用同一个预算，processes 限制它们合计同时运行的进程数
+    """
+    
+    # 多目标进程不限并发时使用的 -bs（nuclei默认值）
+    DEFAULT_BULK = 25
+    # 等待进程槽位时的检查间隔（秒）；共用预算的引擎各有自己的事件循环，只能轮询
+    SLOT_POLL = 0.1
+    
+    def __init__(self, rate=None, concurrency=None, per_host=None, processes=None):
+        self.configure(rate, concurrency, per_host, processes)
+        self._used_rate = 0
+        self._used_concurrency = 0
+        self._active = 0
+        self._slots = 0
+        self._lock = threading.Lock()
+    
+    def configure(self, rate=None, concurrency=None, per_host=None, processes=None):
+        """修改预算（运行中的进程保持原份额，之后启动的进程按新预算分配）"""
+        self.rate = rate or None
+        self.concurrency = concurrency or None
+        self.per_host = per_host or None
+        self.processes = processes or None
+    
+    def __bool__(self):
+        return bool(self.rate or self.concurrency or self.per_host or self.processes)
+    
+    def describe(self):
+        parts = []
+        if self.processes:
+            parts.append(f"合计进程 {self.processes}")
+        if self.rate:
+            parts.append(f"总速率 {self.rate} 请求/秒")
+        if self.concurrency:
+            parts.append(f"总并发 {self.concurrency}")
+        if self.per_host:
+            parts.append(f"单主机 {self.per_host} 请求/秒")
+        return "，".join(parts)
+    
+    def max_processes(self, workers):
+        """预算下最多同时运行的进程数（每个进程至少分到 1 请求/秒和 1 并发）"""
+        for limit in (self.rate, self.concurrency, self.processes):
+            if limit:
+                workers = min(workers, limit)
+        return max(1, workers)
+    
+    async def acquire_slot(self, cancelled):
+        """等待一个全局进程槽位，返回是否拿到；cancelled() 为真时放弃等待"""
+        while True:
+            with self._lock:
+                if not self.processes or self._slots < self.processes:
+                    self._slots += 1
+                    return True
+            if cancelled():
+                return False
+            await asyncio.sleep(self.SLOT_POLL)
+    
+    def release_slot(self):
+        with self._lock:
+            self._slots -= 1
+    
+    async def reserve(self, slots, hosts, cancelled):
+        """等到剩余预算足够时分配份额（见 allocate），cancelled() 为真时放弃等待，返回None"""
+        while True:
+            allocation = self.allocate(slots, hosts)
+            if allocation is not None or cancelled():
+                return allocation
+            await asyncio.sleep(self.SLOT_POLL)
+    
+    def allocate(self, slots, hosts=1):
+        """为即将启动的进程分配份额，返回 {'rate', 'concurrency', 'bulk', 'spray'}；剩余预算不够 1 请求/秒或 1 并发时返回None
+        
+        slots 是此时应同时运行的进程数（含已在运行的），hosts 是进程的目标数
+        """
+        with self._lock:
+            # 预计同时运行的进程数：共用预算的引擎各自只知道自己的槽位，按合计进程上限预留
+            expected = self.max_processes(self.processes or slots)
+            free = max(1, expected - self._active)
+            rate = concurrency = bulk = None
+            if self.rate:
+                rate = (self.rate - self._used_rate) // free
+                if rate < 1:
+                    return None
+            if self.concurrency:
+                concurrency = (self.concurrency - self._used_concurrency) // free
+                if concurrency < 1:
+                    return None
+            if hosts > 1:
+                # 进程并发 = 模板并发(-c) × 并行主机数(-bs)，两者大致均分；有单主机速率时，并行主机数要足以把速率分摊开
+                bulk = math.isqrt(concurrency) if concurrency else self.DEFAULT_BULK
+                if self.per_host and rate:
+                    bulk = max(bulk, -(-rate // self.per_host))
+                bulk = max(1, min(bulk, hosts, concurrency or bulk))
+            if self.per_host:
+                cap = self.per_host * (bulk or 1)
+                rate = min(rate, cap) if rate else cap
+            allocation = {
+                'rate': rate,
+                'concurrency': max(1, concurrency // (bulk or 1)) if concurrency else None,
+                'bulk': bulk,
+                'spray': bool(bulk and self.per_host),
+                'used_rate': rate if self.rate else 0,
+                'used_concurrency': concurrency or 0,
+            }
+            self._used_rate += allocation['used_rate']
+            self._used_concurrency += allocation['used_concurrency']
+            self._active += 1
+        return allocation
+    
+    def usage(self):
+        """当前已分出的 (合计速率, 合计并发, 运行中的进程数)"""
+        with self._lock:
+            return self._used_rate, self._used_concurrency, self._active
+    
+    def release(self, allocation):
+        with self._lock:
+            self._used_rate -= allocation['used_rate']
+            self._used_concurrency -= allocation['used_concurrency']
+            self._active -= 1
+    
+    @staticmethod
+    def args(allocation):
+        """份额 -> nuclei参数"""
+        args = []
+        if allocation['rate']:
+            args.extend(["-rl", str(allocation['rate'])])
+        if allocation['concurrency']:
+            args.extend(["-c", str(allocation['concurrency'])])
+        if allocation['bulk']:
+            args.extend(["-bs", str(allocation['bulk'])])
+        if allocation['spray']:
+            args.extend(["-ss", "host-spray"])
+        return args
+
+
+class ScanScheduler:
+    """扫描调度器：按并发数同时运行多个nuclei进程
+    
+    所有进程都在 ProcessLoop 的事件循环中运行，并发数由信号量控制，不再每个进程一个线程；
+    stdout/stderr 分别按整行交给回调，显示时加上 tag() 前缀，多个进程的输出交错时不会混在同一行；
+    进程由 ProcessSupervisor 启动，可以取消单个或全部任务，并按每个目标的整体/无输出超时终止；
+    设置了速率预算（RateBudget）时，每个进程启动前分到自己的 -rl/-c/-bs；
+    回调都在事件循环线程中调用，不能阻塞，界面更新需由调用方转到主线程
+    """
+    
+    def __init__(self, jobs, workers=4, supervisor=None, wall_timeout=None, idle_timeout=None, budget=None):
+        self.jobs = jobs
+        self.workers = max(1, int(workers))
+        self.budget = budget or None
+        if self.budget:
+            self.workers = self.budget.max_processes(self.workers)
+        self.supervisor = supervisor or ProcessSupervisor()
+        # 每个目标的整体超时和无输出超时（秒），None表示不限制
+        self.wall_timeout = wall_timeout
+        self.idle_timeout = idle_timeout
+        self.cancelled = False
+        # on_output(job, line, stream)：进程输出的一行，stream 为 'stdout'（-jsonl结果）或 'stderr'（nuclei日志）
+        self.on_output = None
+        # on_job(job)：任务状态变化
+        self.on_job = None
+        # on_finish(scheduler)：全部任务结束
+        self.on_finish = None
+        self.started = None
+        self.finished = None
+        # 尚未结束的任务数，用于计算速率预算的槽位
+        self._unfinished = len(jobs)
+    
+    def counts(self):
+        """各状态的任务数"""
+        counts = dict.fromkeys(ScanJob.STATUS_NAMES, 0)
+        for job in self.jobs:
+            counts[job.status] += 1
+        return counts
+    
+    def progress(self):
+        """返回 (已结束数, 总数, 预计剩余秒数)；还没有任务结束时无法估计，返回None"""
+        counts = self.counts()
+        ended = sum(counts[status] for status in ScanJob.ENDED)
+        eta = None
+        if ended and self.started is not None:
+            elapsed = time.monotonic() - self.started
+            eta = elapsed / ended * (len(self.jobs) - ended)
+        return ended, len(self.jobs), eta
+    
+    def tag(self, job):
+        """输出行前缀（只有一个任务时不加）"""
+        if len(self.jobs) == 1:
+            return ''
+        return f"[{job.index}/{len(self.jobs)}] "
+    
+    def is_running(self):
+        return self.started is not None and self.finished is None
+    
+    def cancel(self, job):
+        """取消一个任务：排队中的不再启动，运行中的终止进程组"""
+        job.cancelled = True
+        if job.process is not None:
+            self.supervisor.terminate(job.process, 'cancelled')
+    
+    def cancel_all(self):
+        self.cancelled = True
+        for job in self.jobs:
+            if job.status in (ScanJob.QUEUED, ScanJob.RUNNING):
+                self.cancel(job)
+    
+    def start(self):
+        """在事件循环中开始执行全部任务（可在任意线程调用），返回 concurrent.futures.Future"""
+        return self.supervisor.loop.submit(self._run())
+    
+    def run(self):
+        """执行全部任务，阻塞到结束（不能在事件循环线程中调用）"""
+        self.start().result()
+    
+    async def _run(self):
+        self.started = time.monotonic()
+        slots = asyncio.Semaphore(self.workers)
+        await asyncio.gather(*(self._run_job(job, slots) for job in self.jobs))
+        self.finished = time.monotonic()
+        if self.on_finish:
+            self.on_finish(self)
+    
+    def _output(self, job, line, stream):
+        if self.on_output:
+            self.on_output(job, line, stream)
+    
+    def _notify(self, job):
+        if self.on_job:
+            self.on_job(job)
+    
+    async def _run_job(self, job, slots):
+        async with slots:
+            acquired = False
+            try:
+                # 共用的预算还限制所有引擎合计的进程数
+                if self.budget:
+                    acquired = await self.budget.acquire_slot(lambda: job.cancelled)
+                await self._execute(job)
+            finally:
+                if acquired:
+                    self.budget.release_slot()
+                self._unfinished -= 1
+        self._notify(job)
+    
+    async def _execute(self, job):
+        if job.cancelled:
+            job.status = ScanJob.CANCELLED
+            return
+        
+        allocation = None
+        if self.budget:
+            allocation = await self.budget.reserve(min(self.workers, self._unfinished), job.target_count,
+                                                   lambda: job.cancelled)
+            if allocation is None:
+                job.status = ScanJob.CANCELLED
+                return
+            job.limit_args = RateBudget.args(allocation)
+        job.status = ScanJob.RUNNING
+        job.started = time.monotonic()
+        self._notify(job)
+        
+        try:
+            wall_timeout = self.wall_timeout * job.target_count if self.wall_timeout else None
+            proc = await self.supervisor.spawn(job.command(), wall_timeout, self.idle_timeout)
+            job.process = proc
+            # 启动前已被取消
+            if job.cancelled:
+                self.supervisor.terminate(proc, 'cancelled')
+            job.returncode = await self.supervisor.pump(proc, functools.partial(self._output, job))
+            if proc.reason == 'cancelled':
+                job.status = ScanJob.CANCELLED
+            elif proc.reason in ('timeout', 'idle'):
+                job.status = ScanJob.TIMEOUT
+            else:
+                job.status = ScanJob.DONE if job.returncode == 0 else ScanJob.FAILED
+        except Exception as e:
+            job.error = e
+            job.status = ScanJob.FAILED
+        finally:
+            if allocation is not None:
+                self.budget.release(allocation)
+        
+        job.finished = time.monotonic()
+
+
+# 扫描时 nuclei 输出统计的间隔（秒）
+STATS_INTERVAL = 5
+# nuclei -stats -sj 统计行中的数值字段（不同版本中有的是字符串）
+STATS_FIELDS = ('requests', 'total', 'rps', 'errors', 'matched', 'percent', 'hosts', 'templates')
+
+
+def parse_stats_line(line):
+    """nuclei -stats -sj 输出的一行统计 -> {字段: 数值}（duration 换算成秒），不是统计行时返回None"""
+    if not line.startswith('{') or '"requests"' not in line or '"percent"' not in line:
+        return None
+    try:
+        data = json.loads(line)
+        stats = {key: int(float(data.get(key) or 0)) for key in STATS_FIELDS}
+    except (ValueError, TypeError):
+        return None
+    seconds = 0
+    for part in str(data.get('duration', '')).split(':'):
+        try:
+            seconds = seconds * 60 + int(float(part))
+        except ValueError:
+            break
+    stats['duration'] = seconds
+    return stats
+
+
+class ScanMetrics:
+    """扫描遥测：各任务最近一次的 nuclei 统计（-stats -sj）、整体的速率/错误/匹配/进度时间序列
+    
+    update() 在进程事件循环线程中调用，同时把每条统计追加到 JSONL 文件（扫描结束后可导出CSV）；
+    界面线程通过 aggregate()/job_stats()/history() 读取
+    """
+    
+    HISTORY = 300
+    # 整体时间序列的最短采样间隔（秒）
+    SAMPLE_INTERVAL = 1.0
+    EXPORT_FIELDS = ('time', 'job', 'target') + STATS_FIELDS + ('duration',)
+    
+    def __init__(self, jobs, path=None):
+        self.jobs = jobs
+        self.path = path
+        self.started = time.monotonic()
+        # 任务序号 -> 最近一次统计
+        self.latest = {}
+        # (距开始秒数, 请求/秒, 错误数, 匹配数, 完成比例)
+        self._history = deque(maxlen=self.HISTORY)
+        self._last_sample = 0.0
+        self._file = None
+        self._lock = threading.Lock()
+    
+    def update(self, job, stats):
+        with self._lock:
+            self.latest[job.index] = stats
+        self._write(dict(time=datetime.now().isoformat(timespec='seconds'), job=job.index, target=job.target, **stats))
+        now = time.monotonic()
+        if now - self._last_sample >= self.SAMPLE_INTERVAL:
+            self._last_sample = now
+            total = self.aggregate()
+            with self._lock:
+                self._history.append((now - self.started, total['rps'], total['errors'],
+                                      total['matched'], total['progress']))
+    
+    def _write(self, record):
+        if not self.path:
+            return
+        try:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        except OSError:
+            # 写不了监控文件不影响扫描
+            self.path = None
+    
+    def flush(self):
+        """把已收集的统计写入文件（导出前调用，可在任意线程）"""
+        f = self._file
+        if f:
+            try:
+                f.flush()
+            except (OSError, ValueError):
+                pass
+    
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+    
+    def job_stats(self, job):
+        """一个任务的 (统计, 完成比例, 预计剩余秒数)；还没有统计时统计为None"""
+        with self._lock:
+            stats = self.latest.get(job.index)
+        if job.status in ScanJob.ENDED:
+            return stats, 1.0, 0.0
+        if job.status != ScanJob.RUNNING or not stats:
+            return stats, 0.0, None
+        fraction = min(stats['percent'], 100) / 100
+        eta = stats['duration'] * (1 - fraction) / fraction if fraction else None
+        return stats, fraction, eta
+    
+    def aggregate(self):
+        """整体指标：运行中任务的请求速率之和，全部任务的请求/错误/匹配数，完成比例（按任务平均）和预计剩余秒数"""
+        total = dict(rps=0, requests=0, errors=0, matched=0)
+        progress = 0.0
+        for job in self.jobs:
+            stats, fraction, _ = self.job_stats(job)
+            progress += fraction
+            if stats:
+                total['requests'] += stats['requests']
+                total['errors'] += stats['errors']
+                total['matched'] += stats['matched']
+                if job.status == ScanJob.RUNNING:
+                    total['rps'] += stats['rps']
+        progress = progress / len(self.jobs) if self.jobs else 0.0
+        elapsed = time.monotonic() - self.started
+        total['progress'] = progress
+        total['eta'] = elapsed * (1 - progress) / progress if progress else None
+        return total
+    
+    def history(self):
+        with self._lock:
+            return list(self._history)
+    
+    @classmethod
+    def export_csv(cls, jsonl_path, csv_path):
+        """把监控 JSONL 文件转换为 CSV，返回行数"""
+        rows = 0
+        with open(jsonl_path, 'r', encoding='utf-8') as src, \
+                open(csv_path, 'w', encoding='utf-8-sig', newline='') as dst:
+            writer = csv.DictWriter(dst, fieldnames=cls.EXPORT_FIELDS, extrasaction='ignore')
+            writer.writeheader()
+            for line in src:
+                try:
+                    writer.writerow(json.loads(line))
+                except ValueError:
+                    continue
+                rows += 1
+        return rows
+
+
+class BatchJob:
+    """可恢复的批量扫描任务，保存在 ./work/jobs/<任务id>/ 下
+    
+    manifest.json 记录模板参数和选项，targets.txt 保存全部目标（表达式只保存一行，以 @ 开头，
+    写分片文件时才展开）；目标按分片交给nuclei（-l），
+    完成的分片定期写入 checkpoint.json，恢复时只运行剩余的分片，结果继续写入同一任务
+    """
+    
+    SHARD_SIZE = 500
+    # 检查点最短写入间隔（秒），任务结束时强制写入
+    FLUSH_INTERVAL = 2.0
+    
+    def __init__(self, path):
+        self.path = path
+        self.id = os.path.basename(path)
+        with open(os.path.join(path, "manifest.json"), 'r', encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        self.completed = set()
+        self.finished = False
+        try:
+            with open(os.path.join(path, "checkpoint.json"), 'r', encoding='utf-8') as f:
+                checkpoint = json.load(f)
+            self.completed = set(checkpoint.get('completed', []))
+            self.finished = bool(checkpoint.get('finished'))
+        except (OSError, ValueError):
+            pass
+        self._lock = threading.Lock()
+        self._last_flush = 0.0
+    
+    @classmethod
+    def create(cls, jobs_root, targets, shard_size=None):
+        """新建任务目录，写入目标列表和初始清单；targets 是 TargetStore 或URL/表达式条目序列"""
+        job_id = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        path = os.path.join(jobs_root, job_id)
+        os.makedirs(os.path.join(path, "results"))
+        count = 0
+        entries = targets.targets if isinstance(targets, TargetStore) else targets
+        with open(os.path.join(path, "targets.txt"), 'w', encoding='utf-8') as f:
+            for entry in entries:
+                if isinstance(entry, str):
+                    f.write(entry + '\n')
+                    count += 1
+                else:
+                    f.write(entry.key + '\n')
+                    count += entry.count
+        manifest = {
+            'id': job_id,
+            'created': datetime.now().isoformat(),
+            'targets': count,
+            'shard_size': shard_size or cls.SHARD_SIZE,
+            'template_args': [],
+            'templates_summary': '',
+            'proxy': '',
+        }
+        atomic_write_text(os.path.join(path, "manifest.json"), json.dumps(manifest, ensure_ascii=False, indent=2))
+        return cls(path)
+    
+    @classmethod
+    def unfinished(cls, jobs_root="./work/jobs"):
+        """所有未完成的任务（新的在前），损坏的任务目录跳过"""
+        jobs = []
+        try:
+            names = sorted(os.listdir(jobs_root), reverse=True)
+        except OSError:
+            return jobs
+        for name in names:
+            try:
+                job = cls(os.path.join(jobs_root, name))
+            except (OSError, ValueError):
+                continue
+            if not job.finished:
+                jobs.append(job)
+        return jobs
+    
+    def configure(self, template_args, proxy_url='', summary=''):
+        """保存扫描参数，恢复时使用完全相同的参数"""
+        self.manifest.update(template_args=list(template_args), proxy=proxy_url, templates_summary=summary)
+        atomic_write_text(os.path.join(self.path, "manifest.json"),
+                          json.dumps(self.manifest, ensure_ascii=False, indent=2))
+    
+    def shard_count(self):
+        size = self.manifest['shard_size']
+        return (self.manifest['targets'] + size - 1) // size
+    
+    def pending(self):
+        return [i for i in range(self.shard_count()) if i not in self.completed]
+    
+    def shard_file(self, shard):
+        return os.path.join(self.path, f"shard_{shard:05d}.txt")
+    
+    def output_file(self, shard, run=1):
+        name = f"shard_{shard:05d}.jsonl" if run == 1 else f"shard_{shard:05d}.{run}.jsonl"
+        return os.path.join(self.path, "results", name)
+    
+    def next_output_file(self, shard):
+        """本次运行分片的输出文件：nuclei 的 -o 会截断已有文件，已有输出的分片（恢复时）写到新编号的文件"""
+        run = 1
+        path = self.output_file(shard)
+        while os.path.isfile(path) and os.path.getsize(path):
+            run += 1
+            path = self.output_file(shard, run)
+        return path
+    
+    def _numbered_targets(self, wanted):
+        """按顺序生成 (序号, 目标行)；表达式在这里惰性展开，不含待写分片的表达式整体跳过"""
+        size = self.manifest['shard_size']
+        n = 0
+        with open(os.path.join(self.path, "targets.txt"), 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.startswith('@'):
+                    yield n, line
+                    n += 1
+                    continue
+                expression = parse_target_expression(line[1:])
+                if expression is None:
+                    continue
+                start = n
+                first, last = start // size, (start + expression.count - 1) // size
+                if any(first <= shard <= last for shard in wanted):
+                    for n, url in enumerate(expression.expand(), start):
+                        yield n, url + '\n'
+                n = start + expression.count
+    
+    def write_shards(self, shards):
+        """按需写出分片目标文件，返回 {分片: 目标数}"""
+        wanted = set(shards)
+        size = self.manifest['shard_size']
+        counts = {}
+        out = None
+        current = None
+        for n, line in self._numbered_targets(wanted):
+            shard = n // size
+            if shard != current:
+                current = shard
+                if out:
+                    out.close()
+                    out = None
+                if shard in wanted:
+                    out = open(self.shard_file(shard), 'w', encoding='utf-8')
+                    counts[shard] = 0
+            if out:
+                out.write(line)
+                counts[shard] += 1
+        if out:
+            out.close()
+        return counts
+    
+    def command(self, shard, output_file=None):
+        cmd = ["nuclei", "-jsonl", "-o", output_file or self.output_file(shard), "-l", self.shard_file(shard)]
+        cmd.extend(self.manifest['template_args'])
+        if self.manifest.get('proxy'):
+            cmd.extend(["-p", self.manifest['proxy']])
+        return cmd
+    
+    def mark_done(self, shard):
+        """记录完成的分片（线程安全，检查点按间隔写入）"""
+        with self._lock:
+            self.completed.add(shard)
+        self.flush()
+    
+    def flush(self, force=False):
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._last_flush < self.FLUSH_INTERVAL:
+                return
+            self._last_flush = now
+            checkpoint = {'completed': sorted(self.completed), 'finished': self.finished,
+                          'updated': datetime.now().isoformat()}
+            atomic_write_text(os.path.join(self.path, "checkpoint.json"), json.dumps(checkpoint))
+    
+    def finish(self):
+        """一次运行结束：写入检查点并清理分片文件；全部分片完成时标记任务结束"""
+        self.finished = not self.pending()
+        self.flush(force=True)
+        self.cleanup()
+    
+    def cleanup(self):
+        """删除分片目标文件；任务已结束时一并删除模板列表文件"""
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return
+        for name in names:
+            if (name.startswith("shard_") and name.endswith(".txt")) or \
+                    (self.finished and name.startswith("nuclei_templates_")):
+                try:
+                    os.unlink(os.path.join(self.path, name))
+                except OSError:
+                    pass
+    
+    def describe(self):
+        return (f"{self.id} | {self.manifest['targets']} 个目标 | "
+                f"已完成 {len(self.completed)}/{self.shard_count()} 个分片 | {self.manifest.get('templates_summary', '')}")
+
+
+# 严重级别 -> 输出颜色（界面中为文本标签名，命令行中换成ANSI颜色）
+SEVERITY_COLORS = {
+    'critical': 'red', 'high': 'lightcoral', 'medium': 'magenta',
+    'low': 'green', 'info': 'blue', 'unknown': 'gray',
+}
+
+
+def parse_template_list_line(line):
+    """nuclei -tl 输出中的一行 -> 模板路径，日志行和空行返回None"""
+    line = line.strip()
+    if line and not line.startswith('[') and line.endswith('.yaml'):
+        return line
+    return None
+
+
+def list_official_templates(supervisor=None):
+    """执行 nuclei -tl 获取已安装的官方模板列表（失败时抛出 CalledProcessError / FileNotFoundError）"""
+    templates = []
+    
+    def on_line(line, stream):
+        path = parse_template_list_line(line) if stream == 'stdout' else None
+        if path:
+            templates.append(path)
+    
+    cmd = ["nuclei", "-tl"]
+    returncode = (supervisor or ProcessSupervisor()).run_command(cmd, on_line).result()
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, cmd)
+    return templates
+
+
+def load_official_templates(cache_path="./work/templates_official.cache", supervisor=None):
+    """读取官方模板列表：模板目录指纹不变时使用缓存，否则执行 nuclei -tl 并写回缓存"""
+    cache = TemplateCache(cache_path)
+    fingerprint = official_templates_fingerprint(find_templates_dir())
+    cached = cache.load(fingerprint)
+    if cached is not None:
+        return cached[1]
+    templates = list_official_templates(supervisor)
+    try:
+        cache.save(templates, fingerprint)
+    except OSError:
+        pass
+    return templates
+
+
+# 没有写端口时的默认端口，去重时 http://a.com:80 与 http://a.com 视为同一目标
+DEFAULT_PORTS = {'http': ':80', 'https': ':443'}
+
+
+# 目标行：[协议://]主机[:端口][路径/查询][#片段]
+TARGET_RE = re.compile(r'(?:([A-Za-z][A-Za-z0-9+.-]*)://)?([^/?#]*)([^#]*)')
+
+
+def normalize_target(text):
+    """目标行 -> (URL, 去重键)，空行和 # 注释返回None
+    
+    没有协议的补上 http://；去重键中协议和主机不区分大小写，去掉默认端口、片段和路径结尾的 /
+    """
+    url = text.strip()
+    if not url or url[0] == '#':
+        return None
+    scheme, host, path = TARGET_RE.match(url).groups()
+    if scheme is None:
+        url = 'http://' + url
+        scheme = 'http'
+    else:
+        scheme = scheme.lower()
+    host = host.lower()
+    port = DEFAULT_PORTS.get(scheme)
+    if port and host.endswith(port):
+        host = host[:-len(port)]
+    if path and '?' not in path:
+        path = path.rstrip('/')
+    key = scheme + '://' + host + path
+    # 大多数目标的键与URL相同，共用同一个字符串对象以节省内存
+    return url, (url if key == url else key)
+
+
+# 目标表达式：[协议[,协议]://]主机[,主机][:端口[,端口]][路径]
+# 主机可以是 CIDR（10.20.0.0/16）、IP范围（10.0.0.1-10.0.0.50 或 10.0.0.1-50）或普通主机名，端口可以是范围（8000-8010）。
+# 网段前缀后面必须是主机结尾（:、,、? 或行尾），http://10.0.0.1/16/api 这类以数字开头的路径仍是普通URL
+_EXPRESSION_HOST = r'\d{1,3}(?:\.\d{1,3}){3}(?:/\d{1,2}(?=[:,?]|\Z)|-\d{1,3}(?:(?:\.\d{1,3}){3})?)?|[^/?#:,\s]+'
+TARGET_EXPRESSION_RE = re.compile(
+    r'(?:([a-z][a-z0-9+.-]*(?:,[a-z][a-z0-9+.-]*)*)://)?'
+    r'((?:' + _EXPRESSION_HOST + r')(?:,(?:' + _EXPRESSION_HOST + r'))*)'
+    r'(?::(\d+(?:-\d+)?(?:,\d+(?:-\d+)?)*))?'
+    r'([/?][^#\s]*)?', re.IGNORECASE)
+EXPRESSION_HOST_RE = re.compile(r'(\d{1,3}(?:\.\d{1,3}){3})(?:/(\d{1,2})|-(\d{1,3}(?:(?:\.\d{1,3}){3})?))?')
+# 快速预检：含逗号，或主机部分是带 / 或 - 的IP，才需要按表达式解析
+TARGET_EXPRESSION_HINT_RE = re.compile(r'\s*(?:[A-Za-z][A-Za-z0-9+.-]*://)?\d{1,3}(?:\.\d{1,3}){3}[/-]')
+# 整块目标的粗略预检（以字面量 . 开头，搜索很快），命中时再逐行预检
+TARGET_EXPRESSION_CHUNK_RE = re.compile(r'\.\d{1,3}[/-]')
+# 单个表达式展开后的目标数上限（避免误输入 0.0.0.0/0 这类表达式）
+MAX_EXPRESSION_TARGETS = 1 << 24
+
+
+def _ipv4(number):
+    return f"{number >> 24}.{number >> 16 & 255}.{number >> 8 & 255}.{number & 255}"
+
+
+class TargetExpression:
+    """紧凑的目标表达式：只保存协议、主机段和端口段，count 是展开后的目标数
+    
+    expand() 按 主机 -> 端口 -> 协议 的顺序惰性生成URL，内存占用与展开后的数量无关；
+    主机段是主机名字符串或 (起始IP, 结束IP, 原文) 三元组，端口段是 (起始, 结束) 对
+    """
+    
+    __slots__ = ('text', 'key', 'schemes', 'hosts', 'ports', 'path', 'count')
+    
+    def __init__(self, schemes, hosts, ports, path=''):
+        self.schemes = tuple(schemes)
+        self.hosts = tuple(hosts)
+        self.ports = tuple(ports)
+        self.path = path
+        host_count = sum(1 if isinstance(host, str) else host[1] - host[0] + 1 for host in self.hosts)
+        port_count = sum(hi - lo + 1 for lo, hi in self.ports) if self.ports else 1
+        self.count = host_count * port_count * len(self.schemes)
+        if self.count > MAX_EXPRESSION_TARGETS:
+            raise ValueError(f"表达式展开后有 {self.count} 个目标，超过上限 {MAX_EXPRESSION_TARGETS}")
+        hosts_text = ','.join(host if isinstance(host, str) else host[2] for host in self.hosts)
+        ports_text = ','.join(str(lo) if lo == hi else f"{lo}-{hi}" for lo, hi in self.ports)
+        self.text = ','.join(self.schemes) + '://' + hosts_text + (':' + ports_text if ports_text else '') + path
+        # 去重键与普通目标的键不会相同（普通目标不以 @ 开头）
+        self.key = '@' + self.text
+    
+    def __str__(self):
+        return f"{self.text}  ({self.count} 个目标)"
+    
+    def __repr__(self):
+        return f"TargetExpression({self.text!r})"
+    
+    def __eq__(self, other):
+        return isinstance(other, TargetExpression) and other.key == self.key
+    
+    def __hash__(self):
+        return hash(self.key)
+    
+    def expand(self):
+        """逐个生成展开后的目标URL"""
+        ports = [''] if not self.ports else None
+        path = self.path
+        for host in self.hosts:
+            names = (host,) if isinstance(host, str) else map(_ipv4, range(host[0], host[1] + 1))
+            for name in names:
+                for port in ports or (f":{n}" for lo, hi in self.ports for n in range(lo, hi + 1)):
+                    for scheme in self.schemes:
+                        yield f"{scheme}://{name}{port}{path}"
+
+
+def _parse_expression_host(text):
+    """表达式中的一个主机 -> 主机名字符串或 (起始IP, 结束IP, 原文)，IP格式错误时抛出 ValueError"""
+    match = EXPRESSION_HOST_RE.fullmatch(text)
+    if not match:
+        return text
+    ip, prefix, end = match.groups()
+    if prefix is None and end is None:
+        return text
+    try:
+        if prefix is not None:
+            network = ipaddress.IPv4Network(text, strict=False)
+            first, last = int(network.network_address), int(network.broadcast_address)
+            # 与 IPv4Network.hosts() 一致：/31 和 /32 以外去掉网络地址和广播地址
+            if network.prefixlen < 31:
+                first, last = first + 1, last - 1
+            return first, last, str(network)
+        first = int(ipaddress.IPv4Address(ip))
+        last = int(ipaddress.IPv4Address(end)) if '.' in end else first & ~255 | int(end)
+    except ValueError:
+        raise ValueError(f"IP或网段无效: {text}") from None
+    if int(end.rpartition('.')[2]) > 255 or last < first:
+        raise ValueError(f"IP范围无效: {text}")
+    return first, last, text
+
+
+def parse_target_expression(text):
+    """目标行 -> TargetExpression；只是普通的单个目标（或不是表达式语法）时返回None
+    
+    IP、网段、端口超出范围时抛出 ValueError
+    """
+    text = text.strip()
+    if not text or text[0] == '#':
+        return None
+    match = TARGET_EXPRESSION_RE.fullmatch(text)
+    if not match:
+        return None
+    schemes, hosts, ports, path = match.groups()
+    schemes = list(dict.fromkeys(schemes.lower().split(','))) if schemes else ['http']
+    hosts = [_parse_expression_host(host.lower()) for host in hosts.split(',')]
+    port_ranges = []
+    for part in ports.split(',') if ports else ():
+        lo, _, hi = part.partition('-')
+        lo, hi = int(lo), int(hi or lo)
+        if not 0 < lo <= hi <= 65535:
+            raise ValueError(f"端口无效: {part}")
+        port_ranges.append((lo, hi))
+    if len(schemes) == 1 and len(port_ranges) <= 1 and len(hosts) == 1 and isinstance(hosts[0], str) and \
+            (not port_ranges or port_ranges[0][0] == port_ranges[0][1]):
+        return None
+    return TargetExpression(schemes, hosts, port_ranges, path or '')
+
+
+def parse_target(text):
+    """目标行 -> (条目, 去重键)：普通目标的条目是URL，表达式的条目是 TargetExpression；空行和注释返回None
+    
+    表达式格式错误时抛出 ValueError
+    """
+    if ',' in text or TARGET_EXPRESSION_HINT_RE.match(text):
+        expression = parse_target_expression(text)
+        if expression is not None:
+            return expression, expression.key
+    return normalize_target(text)
+
+
+def _parse_target_line(text, skipped=None):
+    try:
+        return parse_target(text)
+    except ValueError as e:
+        if skipped is not None:
+            skipped.append((text.strip(), str(e)))
+        return None
+
+
+def format_skipped_targets(skipped, limit=5):
+    """跳过的目标行 [(行, 原因)] -> 提示文字，最多列出 limit 行"""
+    lines = [f"跳过 {len(skipped)} 行格式错误的目标:"]
+    lines.extend(f"  {line}  ({reason})" for line, reason in skipped[:limit])
+    if len(skipped) > limit:
+        lines.append(f"  ... 另有 {len(skipped) - limit} 行")
+    return '\n'.join(lines) + '\n'
+
+
+def target_count(entry):
+    """目标列表条目展开后的目标数"""
+    return 1 if isinstance(entry, str) else entry.count
+
+
+def expand_targets(entries):
+    """按顺序生成条目展开后的全部目标URL"""
+    for entry in entries:
+        if isinstance(entry, str):
+            yield entry
+        else:
+            yield from entry.expand()
+
+
+class TargetStore:
+    """扫描目标列表：按规范化URL去重（哈希集合），大文件分块流式读取
+    
+    targets 是按添加顺序的条目列表，列表视图和分片写入直接引用它，不复制；条目是URL字符串，
+    或者 CIDR、IP范围、主机×端口这类 TargetExpression（只占一项，写分片时才展开）。
+    len() 和迭代都按展开后的目标计算；增删都在锁内进行，读取文件可以在后台线程中执行
+    """
+    
+    CHUNK_LINES = 20000
+    
+    def __init__(self):
+        self.targets = []
+        # 展开后的目标总数
+        self.count = 0
+        self._keys = set()
+        self._lock = threading.Lock()
+        # clear() 时递增，正在后台读取的文件随之停止
+        self._generation = 0
+    
+    def __len__(self):
+        return self.count
+    
+    def __iter__(self):
+        return expand_targets(self.targets)
+    
+    def add(self, text):
+        """添加一个目标或表达式，返回添加的条目；空行、注释或重复时返回None，表达式格式错误时抛出 ValueError"""
+        entry = parse_target(text)
+        if entry is None:
+            return None
+        with self._lock:
+            if entry[1] in self._keys:
+                return None
+            self._keys.add(entry[1])
+            self.targets.append(entry[0])
+            self.count += target_count(entry[0])
+        return entry[0]
+    
+    def add_lines(self, lines, generation=None, skipped=None):
+        """批量添加目标行，返回 (新增数, 重复数)；generation 与当前不符（已被清空）时不添加
+        
+        格式错误的表达式跳过，skipped 是列表时把 (行, 原因) 追加进去
+        """
+        lines = list(lines)
+        text = ''.join(lines)
+        # 整块都没有表达式时（最常见）直接规范化，不逐行预检
+        if ',' in text or TARGET_EXPRESSION_CHUNK_RE.search(text):
+            parse = functools.partial(_parse_target_line, skipped=skipped)
+        else:
+            parse = normalize_target
+        entries = [entry for entry in map(parse, lines) if entry is not None]
+        added = count = 0
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return 0, 0
+            keys = self._keys
+            targets = self.targets
+            for url, key in entries:
+                if key not in keys:
+                    keys.add(key)
+                    targets.append(url)
+                    added += 1
+                    count += 1 if url.__class__ is str else url.count
+            self.count += count
+        return added, len(entries) - added
+    
+    def load_file(self, path, on_progress=None, skipped=None):
+        """分块流式读取目标文件（不一次读入内存），每块去重后追加
+        
+        每块处理后回调 on_progress(新增数, 已读行数)；返回 (新增数, 重复数)，读取中途被清空时提前结束。
+        skipped 同 add_lines
+        """
+        generation = self._generation
+        added = duplicates = lines = 0
+        with open(path, 'r', encoding='utf-8-sig', errors='replace') as f:
+            while generation == self._generation:
+                chunk = list(itertools.islice(f, self.CHUNK_LINES))
+                if not chunk:
+                    break
+                chunk_added, chunk_duplicates = self.add_lines(chunk, generation, skipped)
+                added += chunk_added
+                duplicates += chunk_duplicates
+                lines += len(chunk)
+                if on_progress:
+                    on_progress(added, lines)
+        return added, duplicates
+    
+    def remove(self, entries):
+        """删除指定条目，返回删除的目标数（表达式按展开后的数量计算）"""
+        entries = set(entries)
+        if not entries:
+            return 0
+        with self._lock:
+            before = self.count
+            self.targets = [entry for entry in self.targets if entry not in entries]
+            self.count = sum(map(target_count, self.targets))
+            for entry in entries:
+                if isinstance(entry, TargetExpression):
+                    self._keys.discard(entry.key)
+                    continue
+                entry = normalize_target(entry)
+                if entry is not None:
+                    self._keys.discard(entry[1])
+            return before - self.count
+    
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self.targets = []
+            self.count = 0
+            self._keys = set()
+
+
+def load_targets(path, skipped=None):
+    """读取目标文件到新的 TargetStore（skipped 同 TargetStore.add_lines）"""
+    store = TargetStore()
+    store.load_file(path, skipped=skipped)
+    return store
+
+
+PRESETS_DIR = "./presets"
+
+
+def preset_path(name, presets_dir=PRESETS_DIR):
+    """预设名 -> 文件路径；已经是 .json 文件路径时原样返回"""
+    if name.endswith('.json') or os.sep in name or '/' in name:
+        return name
+    return os.path.join(presets_dir, f"{name}.json")
+
+
+def save_preset(name, templates, query='', options=None, presets_dir=PRESETS_DIR):
+    """保存扫描预设：模板列表、搜索条件（按元数据展开）和扫描选项"""
+    os.makedirs(presets_dir, exist_ok=True)
+    preset = {
+        'name': name,
+        'templates': list(templates),
+        'query': query,
+        'options': options or {},
+        'created': datetime.now().isoformat(timespec='seconds'),
+    }
+    path = preset_path(name, presets_dir)
+    atomic_write_text(path, json.dumps(preset, ensure_ascii=False, indent=2) + '\n')
+    return path
+
+
+def load_preset(name, presets_dir=PRESETS_DIR):
+    """读取扫描预设（不存在或格式不对时抛出 OSError / ValueError）"""
+    with open(preset_path(name, presets_dir), 'r', encoding='utf-8') as f:
+        preset = json.load(f)
+    if not isinstance(preset, dict) or not (preset.get('templates') or preset.get('query')):
+        raise ValueError(f"预设 {name} 中没有模板")
+    return preset
+
+
+def list_presets(presets_dir=PRESETS_DIR):
+    try:
+        return sorted(name[:-5] for name in os.listdir(presets_dir) if name.endswith('.json'))
+    except OSError:
+        return []
+
+
+class ScanEngine:
+    """扫描编排：构建命令、按并发数调度nuclei进程、结果入库、超时记录和批量任务
+    
+    不访问任何界面控件，选项通过属性设置；日志经 on_log(text, color) 输出，color 为颜色名（None为默认），
+    on_start(scheduler) / on_finish(scheduler) 在扫描开始和全部结束时调用。
+    除 on_start 外的回调都在进程事件循环线程中调用，不能阻塞，界面需自行转到主线程
+    """
+    
+    DEFAULT_OPTIONS = {'workers': 4, 'proxy': '', 'wall_timeout': None, 'idle_timeout': None,
+                       'rate_limit': None, 'max_concurrency': None, 'host_rate_limit': None}
+    
+    def __init__(self, work_dir="./work", findings_store=None, metadata_index=None):
+        self.work_dir = work_dir
+        self.jobs_dir = os.path.join(work_dir, "jobs")
+        self.timeout_file = os.path.join(work_dir, "timeout_targets.txt")
+        self.findings_store = findings_store
+        # 官方模板列表和元数据索引，用于把选择折叠成目录/过滤参数；索引与列表同步后才设置 metadata_ready
+        self.templates = []
+        self.metadata_index = metadata_index
+        self.metadata_ready = False
+        # 扫描选项（rate_limit/max_concurrency/host_rate_limit 是所有进程合计的速率预算，None表示不限制）
+        self.reset_options()
+        # 多个引擎共用的速率预算（RateBudget），设置后忽略本引擎的速率选项；None 时每次扫描按选项新建
+        self.budget = None
+        # 所有nuclei子进程的监管者：取消、超时和退出时回收
+        self.supervisor = ProcessSupervisor()
+        # 当前（或最近一次）扫描的调度器、命令构建器和可恢复的批量任务
+        self.scheduler = None
+        self.builder = None
+        self.title = ''
+        self.batch_job = None
+        # 超时的目标，扫描结束后写入文件，可单独重试
+        self.timed_out_targets = []
+        # nuclei 统计输出间隔（秒，-stats -sj -si），None 表示不收集；当前扫描的遥测
+        self.stats_interval = STATS_INTERVAL
+        self.metrics = None
+        self.on_log = None
+        self.on_start = None
+        self.on_finish = None
+        self.idle = threading.Event()
+        self.idle.set()
+    
+    def log(self, text, color=None):
+        if self.on_log:
+            self.on_log(text, color)
+    
+    def reset_options(self):
+        for key, value in self.DEFAULT_OPTIONS.items():
+            setattr(self, key, value)
+    
+    def options(self):
+        """当前扫描选项（可保存到预设）"""
+        return {key: getattr(self, key) for key in self.DEFAULT_OPTIONS}
+    
+    @staticmethod
+    def new_scan_id():
+        """一次扫描的标识，写入结果库用于区分不同批次"""
+        return datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    
+    def is_running(self):
+        return self.scheduler is not None and not self.idle.is_set()
+    
+    def wait(self, timeout=None):
+        """等待当前扫描结束，返回是否已结束"""
+        return self.idle.wait(timeout)
+    
+    def handle_line(self, line, prefix='', scan_id='', stream='stdout'):
+        """处理扫描输出的一行：stdout 中的JSONL结果写入结果库并按严重级别着色输出，其余（nuclei日志）原样输出"""
+        row = parse_finding_line(line, scan_id) if stream == 'stdout' else None
+        if row is None:
+            self.log(prefix + line)
+            return
+        
+        if self.findings_store:
+            self.findings_store.add(row)
+        template_id, _, matcher, host, matched_at, severity, kind = row[:7]
+        name = f"{template_id}:{matcher}" if matcher else template_id
+        text = f"{prefix}[{name}] [{kind}] [{severity}] {matched_at}"
+        if row[9]:
+            text += f" {row[9]}"
+        self.log(text + "\n", SEVERITY_COLORS.get(severity, 'gray'))
+    
+    def _on_output(self, scheduler, scan_id, job, line, stream):
+        """进程输出的一行：统计行交给遥测，不显示；其余按结果/日志处理"""
+        stats = parse_stats_line(line)
+        if stats is not None:
+            self.metrics.update(job, stats)
+            return
+        self.handle_line(line, scheduler.tag(job), scan_id, stream)
+    
+    def command_builder(self, selected_templates, list_dir=None):
+        """按当前模板列表和元数据索引创建命令构建器"""
+        metadata_index = self.metadata_index if self.metadata_ready else None
+        return NucleiCommandBuilder(selected_templates, self.templates, metadata_index, list_dir)
+    
+    def scan_targets(self, targets, selected_templates):
+        """每个目标一个nuclei进程（-u 参数）按并发数扫描，返回调度器，出错时返回None"""
+        try:
+            os.makedirs(self.work_dir, exist_ok=True)
+            # 所有进程共用同一份模板参数（和列表文件）
+            builder = self.command_builder(selected_templates)
+        except OSError as e:
+            self.log(f"扫描出错: {e}\n", 'red')
+            return None
+        
+        jobs = []
+        try:
+            for i, target_url in enumerate(targets, 1):
+                # 多个目标时结果分别保存
+                name = "result.jsonl" if len(targets) == 1 else f"result_selected_{i}.jsonl"
+                output_file = os.path.join(self.work_dir, name)
+                cmd = builder.build(["-u", target_url], output_file, self.proxy)
+                jobs.append(ScanJob(i, target_url, cmd, output_file))
+        except OSError as e:
+            builder.cleanup()
+            self.log(f"扫描出错: {e}\n", 'red')
+            return None
+        
+        self.builder = builder
+        if len(jobs) > 1:
+            self.log(f"\n开始扫描 {len(jobs)} 个目标\n", 'blue')
+        self.log(f"模板: {builder.summary}\n", 'blue')
+        title = "扫描" if len(jobs) == 1 else "选中目标扫描"
+        return self.run_jobs(jobs, title, self.new_scan_id())
+    
+    def create_batch_job(self, targets, selected_templates, jobs_root=None):
+        """新建批量任务：目标、模板参数和代理保存在任务目录中（默认 work/jobs），出错时抛出 OSError"""
+        job = BatchJob.create(jobs_root or self.jobs_dir, targets)
+        # 模板列表文件放在任务目录中，恢复时继续使用
+        builder = self.command_builder(selected_templates, list_dir=job.path)
+        job.configure(builder.template_args(), self.proxy, builder.summary)
+        return job
+    
+    def scan_batch(self, targets, selected_templates):
+        """批量扫描 - 任务保存在磁盘上，目标分片后使用 -l 参数，中断后可以恢复"""
+        try:
+            job = self.create_batch_job(targets, selected_templates)
+        except OSError as e:
+            self.log(f"批量扫描出错: {e}\n", 'red')
+            return None
+        
+        self.log(f"\n批量扫描任务 {job.id}: {job.manifest['targets']} 个目标，"
+                 f"{job.shard_count()} 个分片\n", 'blue')
+        self.log(f"模板: {job.manifest['templates_summary']}\n", 'blue')
+        return self.run_batch_job(job)
+    
+    def resume(self, job):
+        """继续运行未完成的批量任务；正在扫描时不能恢复，返回None"""
+        if self.is_running():
+            self.log(f"扫描进行中，无法恢复批量扫描任务 {job.id}\n", 'red')
+            return None
+        self.log(f"\n恢复批量扫描任务 {job.id}: 剩余 {len(job.pending())}/{job.shard_count()} 个分片\n", 'blue')
+        return self.run_batch_job(job)
+    
+    def run_batch_job(self, job):
+        """运行批量任务中尚未完成的分片"""
+        pending = job.pending()
+        if not pending:
+            job.finish()
+            self.log(f"任务 {job.id} 已全部完成\n", 'green')
+            return None
+        
+        try:
+            counts = job.write_shards(pending)
+        except OSError as e:
+            job.cleanup()
+            self.log(f"批量扫描出错: {e}\n", 'red')
+            return None
+        
+        jobs = []
+        for n, shard in enumerate(pending, 1):
+            output_file = job.next_output_file(shard)
+            scan_job = ScanJob(n, f"分片 {shard + 1}/{job.shard_count()}（{counts.get(shard, 0)} 个目标）",
+                               job.command(shard, output_file), output_file)
+            scan_job.shard = shard
+            scan_job.target_count = counts.get(shard, 0) or 1
+            jobs.append(scan_job)
+        # 任务id同时作为结果库中的扫描标识，恢复后的结果归入同一批次
+        return self.run_jobs(jobs, "批量扫描", job.id, batch_job=job)
+    
+    def run_jobs(self, jobs, title, scan_id, batch_job=None, background=True):
+        """按并发数运行一组扫描任务（批量任务的每个分片也是一个任务）
+        
+        background 为False时在当前线程中运行到结束
+        """
+        workers = min(max(int(self.workers or 1), 1), len(jobs))
+        budget = self.budget
+        if budget is None:
+            budget = RateBudget(self.rate_limit, self.max_concurrency, self.host_rate_limit)
+        if self.stats_interval:
+            stats_args = ["-stats", "-sj", "-si", str(self.stats_interval)]
+            for job in jobs:
+                job.cmd = job.cmd + stats_args
+        self.metrics = ScanMetrics(jobs, os.path.join(self.work_dir, "metrics", f"{scan_id}.jsonl"))
+        scheduler = ScanScheduler(jobs, workers, self.supervisor, self.wall_timeout, self.idle_timeout, budget)
+        scheduler.on_output = functools.partial(self._on_output, scheduler, scan_id)
+        scheduler.on_job = self._on_job
+        scheduler.on_finish = self._on_finished
+        self.scheduler = scheduler
+        self.title = title
+        self.batch_job = batch_job
+        # 只记录本次扫描的超时目标（重新绑定而不是清空：重试时传入的目标列表可能就是旧列表）
+        self.timed_out_targets = []
+        self.idle.clear()
+        
+        if self.on_start:
+            self.on_start(scheduler)
+        self.log(f"任务数 {len(jobs)}，并发数 {scheduler.workers}\n", 'blue')
+        if budget:
+            self.log(f"速率预算: {budget.describe()}\n", 'blue')
+        self.log("-" * 50 + "\n", 'black')
+        if background:
+            scheduler.start()
+        else:
+            scheduler.run()
+        return scheduler
+    
+    def _on_job(self, job):
+        """任务状态变化（在进程事件循环线程中调用）"""
+        total = len(self.scheduler.jobs)
+        if job.status == ScanJob.RUNNING:
+            self.log(f"[{job.index}/{total}] 扫描目标: {job.target}\n", 'blue')
+            self.log(f"[{job.index}/{total}] 执行命令: {NucleiCommandBuilder.describe(job.command())}\n", 'blue')
+        elif job.error is not None:
+            self.log(f"[{job.index}/{total}] 扫描异常: {job.error}\n", 'red')
+        elif job.status == ScanJob.DONE:
+            if self.batch_job:
+                self.batch_job.mark_done(job.shard)
+            self.log(f"[{job.index}/{total}] 扫描完成 ✓ {job.target} ({format_duration(job.duration())})\n", 'green')
+        elif job.status == ScanJob.CANCELLED:
+            self.log(f"[{job.index}/{total}] 已取消 {job.target}\n", 'gray')
+        elif job.status == ScanJob.TIMEOUT:
+            reason = "无输出超时" if job.process and job.process.reason == 'idle' else "超时"
+            self.log(f"[{job.index}/{total}] {reason} ✗ {job.target} ({format_duration(job.duration())})\n", 'red')
+            self.record_timed_out(job)
+        else:
+            self.log(f"[{job.index}/{total}] 扫描失败 ✗ {job.target}\n", 'red')
+    
+    def record_timed_out(self, job):
+        """记录超时的目标（分片任务记录分片中的全部目标）"""
+        if job.shard is None:
+            self.timed_out_targets.append(job.target)
+            return
+        try:
+            with open(self.batch_job.shard_file(job.shard), 'r', encoding='utf-8') as f:
+                self.timed_out_targets.extend(line.strip() for line in f if line.strip())
+        except OSError:
+            pass
+    
+    def load_timed_out(self):
+        """本次会话记录的超时目标，没有时读取上次写入的超时文件"""
+        if self.timed_out_targets:
+            return self.timed_out_targets
+        try:
+            with open(self.timeout_file, 'r', encoding='utf-8') as f:
+                return [line.strip() for line in f if line.strip()]
+        except OSError:
+            return []
+    
+    def _on_finished(self, scheduler):
+        """全部任务结束：清理临时文件，输出汇总，记录超时目标和批量任务检查点"""
+        try:
+            self._summarize(scheduler)
+        finally:
+            self.idle.set()
+        if self.on_finish:
+            self.on_finish(scheduler)
+    
+    def _summarize(self, scheduler):
+        if self.builder:
+            self.builder.cleanup()
+            self.builder = None
+        counts = scheduler.counts()
+        elapsed = format_duration(scheduler.finished - scheduler.started)
+        self.log(f"\n{self.finish_title(scheduler)}！用时 {elapsed}\n", 'green')
+        summary = f"成功: {counts[ScanJob.DONE]}, 失败: {counts[ScanJob.FAILED]}"
+        if counts[ScanJob.TIMEOUT]:
+            summary += f", 超时: {counts[ScanJob.TIMEOUT]}"
+        if counts[ScanJob.CANCELLED]:
+            summary += f", 取消: {counts[ScanJob.CANCELLED]}"
+        self.log(f"{summary}, 总计: {len(scheduler.jobs)}\n", 'green')
+        
+        metrics = self.metrics
+        metrics.close()
+        if metrics.latest:
+            total = metrics.aggregate()
+            text = f"请求 {total['requests']}，错误 {total['errors']}，匹配 {total['matched']}"
+            if metrics.path:
+                text += f"；监控数据: {metrics.path}"
+            self.log(text + "\n", 'blue')
+        
+        if self.timed_out_targets:
+            try:
+                atomic_write_text(self.timeout_file, '\n'.join(self.timed_out_targets) + '\n')
+                self.log(f"{len(self.timed_out_targets)} 个超时目标已记录到 {self.timeout_file}，"
+                         f"可单独重新扫描\n", 'red')
+            except OSError as e:
+                self.log(f"记录超时目标失败: {e}\n", 'red')
+        
+        job = self.batch_job
+        if job:
+            job.finish()
+            if job.finished:
+                self.log(f"结果已保存到 {os.path.join(job.path, 'results')}\n", 'green')
+            else:
+                self.log(f"任务 {job.id} 还有 {len(job.pending())} 个分片未完成，可以恢复后继续\n", 'red')
+            self.batch_job = None
+    
+    def finish_title(self, scheduler):
+        return f"{self.title}已停止" if scheduler.cancelled else f"{self.title}完成"
+    
+    def stop(self):
+        """停止当前扫描：排队的任务不再启动，运行中的nuclei进程组被终止；返回是否有扫描在运行"""
+        if self.is_running():
+            self.scheduler.cancel_all()
+            return True
+        return False
+    
+    def shutdown(self):
+        """退出前终止并回收所有nuclei进程，记录批量任务的检查点"""
+        self.supervisor.shutdown()
+        if self.builder:
+            self.builder.cleanup()
+        if self.batch_job:
+            self.batch_job.flush(force=True)
+            self.batch_job.cleanup()
+
+
+class ScanQueue:
+    """持久化的扫描任务队列，保存在本地SQLite中，程序重启后继续运行
+    
+    每个任务是一个批量任务（目标、模板参数和代理保存在 work/queue/<任务id>/ 下）加上扫描选项和优先级；
+    按优先级（大的在前）和队列位置依次启动。上次运行中的任务在打开队列时重新排队，恢复时只运行未完成的分片
+    """
+    
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    PAUSED = 'paused'
+    DONE = 'done'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+    
+    STATE_NAMES = {QUEUED: "排队", RUNNING: "运行中", PAUSED: "已暂停", DONE: "完成", FAILED: "未完成",
+                   CANCELLED: "已取消"}
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS queue (
+            id INTEGER PRIMARY KEY,
+            title TEXT NOT NULL,
+            priority INTEGER NOT NULL DEFAULT 0,
+            position INTEGER NOT NULL,
+            state TEXT NOT NULL,
+            job_path TEXT NOT NULL,
+            options TEXT NOT NULL DEFAULT '{}',
+            targets INTEGER NOT NULL DEFAULT 0,
+            shards INTEGER NOT NULL DEFAULT 0,
+            completed INTEGER NOT NULL DEFAULT 0,
+            created TEXT,
+            started TEXT,
+            finished TEXT,
+            message TEXT NOT NULL DEFAULT ''
+        );
+        CREATE INDEX IF NOT EXISTS idx_queue_order ON queue(state, priority DESC, position);
+        CREATE TABLE IF NOT EXISTS queue_settings (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """
+    
+    ORDER = "ORDER BY priority DESC, position"
+    
+    def __init__(self, db_path="./work/queue.db"):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.db_path = db_path
+        # 队列任务的批量任务目录，与 work/jobs 分开，不出现在“恢复任务”中
+        self.jobs_dir = os.path.join(os.path.dirname(db_path), "queue")
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(self.SCHEMA)
+            self._conn.execute("UPDATE queue SET state = ? WHERE state = ?", (self.QUEUED, self.RUNNING))
+    
+    def _query(self, sql, params=()):
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(sql, params)]
+    
+    def _execute(self, sql, params=()):
+        with self._lock, self._conn:
+            return self._conn.execute(sql, params)
+    
+    def add(self, title, job, options=None, priority=0):
+        """把批量任务加入队列末尾，返回队列任务id"""
+        with self._lock, self._conn:
+            position = self._conn.execute("SELECT COALESCE(MAX(position), 0) + 1 FROM queue").fetchone()[0]
+            cursor = self._conn.execute(
+                "INSERT INTO queue (title, priority, position, state, job_path, options, targets, shards, "
+                "completed, created) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (title, int(priority), position, self.QUEUED, job.path, json.dumps(options or {}),
+                 job.manifest['targets'], job.shard_count(), len(job.completed),
+                 datetime.now().isoformat(timespec='seconds')))
+            return cursor.lastrowid
+    
+    def get(self, entry_id):
+        rows = self._query("SELECT * FROM queue WHERE id = ?", (entry_id,))
+        return rows[0] if rows else None
+    
+    def entries(self):
+        """全部任务：未结束的按启动顺序在前，已结束的在后"""
+        ended = (self.DONE, self.FAILED, self.CANCELLED)
+        return self._query(f"SELECT * FROM queue ORDER BY state IN {ended}, priority DESC, position")
+    
+    def next_queued(self):
+        rows = self._query(f"SELECT * FROM queue WHERE state = ? {self.ORDER} LIMIT 1", (self.QUEUED,))
+        return rows[0] if rows else None
+    
+    def counts(self):
+        counts = dict.fromkeys(self.STATE_NAMES, 0)
+        for row in self._query("SELECT state, COUNT(*) AS n FROM queue GROUP BY state"):
+            counts[row['state']] = row['n']
+        return counts
+    
+    def set_state(self, entry_id, state, message=None, completed=None):
+        """修改任务状态；开始运行和结束时记录时间"""
+        now = datetime.now().isoformat(timespec='seconds')
+        fields = {'state': state}
+        if state == self.RUNNING:
+            fields.update(started=now, finished=None)
+        elif state in (self.DONE, self.FAILED, self.CANCELLED):
+            fields['finished'] = now
+        if message is not None:
+            fields['message'] = message
+        if completed is not None:
+            fields['completed'] = completed
+        assignments = ', '.join(f"{key} = ?" for key in fields)
+        self._execute(f"UPDATE queue SET {assignments} WHERE id = ?", (*fields.values(), entry_id))
+    
+    def set_priority(self, entry_id, priority):
+        self._execute("UPDATE queue SET priority = ? WHERE id = ?", (int(priority), entry_id))
+    
+    def move(self, entry_id, delta):
+        """在未结束的任务中上移（delta<0）或下移一位；越过不同优先级的任务时采用对方的优先级"""
+        ended = (self.DONE, self.FAILED, self.CANCELLED)
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                f"SELECT id, priority, position FROM queue WHERE state NOT IN {ended} {self.ORDER}").fetchall()
+            ids = [row['id'] for row in rows]
+            if entry_id not in ids:
+                return False
+            index = ids.index(entry_id)
+            other = index + (1 if delta > 0 else -1)
+            if not 0 <= other < len(rows):
+                return False
+            this, that = rows[index], rows[other]
+            self._conn.execute("UPDATE queue SET priority = ?, position = ? WHERE id = ?",
+                               (that['priority'], that['position'], this['id']))
+            self._conn.execute("UPDATE queue SET position = ? WHERE id = ?", (this['position'], that['id']))
+        return True
+    
+    def remove(self, entry_id):
+        self._execute("DELETE FROM queue WHERE id = ?", (entry_id,))
+    
+    def setting(self, key, default=None):
+        rows = self._query("SELECT value FROM queue_settings WHERE key = ?", (key,))
+        return json.loads(rows[0]['value']) if rows else default
+    
+    def set_setting(self, key, value):
+        self._execute("INSERT OR REPLACE INTO queue_settings (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class QueueRunner:
+    """按全局并发上限（同时运行的队列任务数）启动队列中的任务，每个运行中的任务使用独立的扫描引擎
+    
+    make_engine(work_dir) 创建引擎（共享结果库、日志回调等），任务的监控数据和超时记录都写在任务目录中；
+    任务结束回调在进程事件循环线程中调用，结束后立即启动下一个排队的任务。
+    external() 返回队列之外正在运行的扫描数（如界面直接发起的扫描），同样计入并发上限
+    """
+    
+    def __init__(self, scan_queue, make_engine, limit=None, external=None):
+        self.queue = scan_queue
+        self.make_engine = make_engine
+        self.limit = max(int(limit or scan_queue.setting('limit', 1)), 1)
+        self.external = external or (lambda: 0)
+        # 队列任务id -> (扫描引擎, 批量任务)
+        self.running = {}
+        # 暂停启动新任务（如更新模板时），运行中的任务不受影响
+        self.held = False
+        self.closed = False
+        self._lock = threading.RLock()
+    
+    def set_limit(self, limit):
+        self.limit = max(int(limit), 1)
+        self.queue.set_setting('limit', self.limit)
+        self.dispatch()
+    
+    def hold(self):
+        self.held = True
+    
+    def release(self):
+        self.held = False
+        self.dispatch()
+    
+    def full(self):
+        """运行中的扫描（队列任务和外部扫描）是否已达到并发上限"""
+        return len(self.running) + self.external() >= self.limit
+    
+    def dispatch(self):
+        """按优先级启动排队的任务，直到达到并发上限"""
+        with self._lock:
+            while not self.closed and not self.held and not self.full():
+                entry = self.queue.next_queued()
+                if entry is None:
+                    break
+                self._start(entry)
+    
+    def _start(self, entry):
+        try:
+            job = BatchJob(entry['job_path'])
+        except (OSError, ValueError) as e:
+            self.queue.set_state(entry['id'], ScanQueue.FAILED, f"任务目录无法读取: {e}")
+            return
+        engine = self.make_engine(job.path)
+        apply_options(engine, json.loads(entry['options']))
+        engine.on_finish = functools.partial(self._on_finished, entry['id'], job)
+        self.queue.set_state(entry['id'], ScanQueue.RUNNING, '')
+        self.running[entry['id']] = (engine, job)
+        engine.log(f"\n队列任务 #{entry['id']} {entry['title']}: {job.manifest['targets']} 个目标，"
+                   f"剩余 {len(job.pending())}/{job.shard_count()} 个分片\n", 'blue')
+        if engine.run_batch_job(job) is None:
+            # 没有剩余分片或写分片文件失败，不会有结束回调
+            del self.running[entry['id']]
+            state = ScanQueue.DONE if job.finished else ScanQueue.FAILED
+            self.queue.set_state(entry['id'], state, completed=len(job.completed))
+    
+    def _on_finished(self, entry_id, job, scheduler):
+        with self._lock:
+            if self.closed:
+                return
+            self.running.pop(entry_id, None)
+            entry = self.queue.get(entry_id)
+            # 用户暂停或取消的任务保持原状态；已删除的任务不再记录
+            if entry is not None:
+                state = entry['state']
+                message = entry['message']
+                if state == ScanQueue.RUNNING:
+                    state = ScanQueue.DONE if job.finished else ScanQueue.FAILED
+                    if not job.finished:
+                        message = f"{len(job.pending())} 个分片未完成，可继续运行重试"
+                self.queue.set_state(entry_id, state, message, completed=len(job.completed))
+        # 写分片文件可能较慢，不在进程事件循环线程中启动下一个任务
+        threading.Thread(target=self.dispatch, daemon=True).start()
+    
+    def progress(self, entry):
+        """(已完成分片数, 分片总数)，运行中的任务取实时值"""
+        running = self.running.get(entry['id'])
+        if running:
+            return len(running[1].completed), running[1].shard_count()
+        return entry['completed'], entry['shards']
+    
+    def pause(self, entry_id):
+        """暂停任务：排队的不再启动，运行中的停止（已完成的分片保留，继续时只运行剩余分片）"""
+        return self._interrupt(entry_id, ScanQueue.PAUSED, (ScanQueue.QUEUED, ScanQueue.RUNNING))
+    
+    def cancel(self, entry_id):
+        return self._interrupt(entry_id, ScanQueue.CANCELLED,
+                               (ScanQueue.QUEUED, ScanQueue.RUNNING, ScanQueue.PAUSED))
+    
+    def _interrupt(self, entry_id, state, allowed):
+        with self._lock:
+            entry = self.queue.get(entry_id)
+            if entry is None or entry['state'] not in allowed:
+                return False
+            self.queue.set_state(entry_id, state)
+            running = self.running.get(entry_id)
+            if running:
+                running[0].stop()
+        return True
+    
+    def resume(self, entry_id):
+        """暂停、取消或未完成的任务重新排队"""
+        with self._lock:
+            entry = self.queue.get(entry_id)
+            if entry is None or entry['state'] in (ScanQueue.QUEUED, ScanQueue.RUNNING, ScanQueue.DONE):
+                return False
+            self.queue.set_state(entry_id, ScanQueue.QUEUED, '')
+        self.dispatch()
+        return True
+    
+    def remove(self, entry_id):
+        """从队列中删除未在运行的任务，返回任务目录（由调用方决定是否删除），不能删除时返回None"""
+        with self._lock:
+            entry = self.queue.get(entry_id)
+            if entry is None or entry_id in self.running:
+                return None
+            self.queue.remove(entry_id)
+        return entry['job_path']
+    
+    def shutdown(self):
+        """退出前终止所有运行中的任务并记录检查点；任务保持运行状态，下次打开队列时重新排队"""
+        with self._lock:
+            self.closed = True
+            running = list(self.running.values())
+        for engine, job in running:
+            engine.shutdown()
+
+
+# ---------------------------------------------------------------- 诊断和计时
+
+class SpanStats:
+    """一个计时点的统计：次数、总耗时、最大值、按2的幂分桶的直方图（毫秒），最近的样本用于计算分位数"""
+    
+    RECENT = 2048
+    # 桶上限（毫秒）：<0.125, <0.25, ... <65536，最后一桶收纳更慢的
+    BUCKETS = [2.0 ** n for n in range(-3, 17)]
+    
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(self.BUCKETS) + 1)
+        self.recent = deque(maxlen=self.RECENT)
+    
+    def add(self, ms):
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+        bucket = 0 if ms < self.BUCKETS[0] else min(math.floor(math.log2(ms)) + 4, len(self.BUCKETS))
+        self.buckets[bucket] += 1
+        self.recent.append(ms)
+    
+    def summary(self):
+        recent = sorted(self.recent)
+        
+        def percentile(p):
+            return round(recent[min(int(len(recent) * p / 100), len(recent) - 1)], 3) if recent else None
+        
+        return {
+            'count': self.count,
+            'total_ms': round(self.total, 3),
+            'mean_ms': round(self.total / self.count, 3) if self.count else None,
+            'p50_ms': percentile(50),
+            'p95_ms': percentile(95),
+            'max_ms': round(self.max, 3),
+            'histogram_ms': {f"<{bound:g}": n for bound, n in zip(self.BUCKETS, self.buckets) if n} |
+                            ({f">={self.BUCKETS[-1]:g}": self.buckets[-1]} if self.buckets[-1] else {}),
+        }
+
+
+class Diagnostics:
+    """运行时诊断：热点路径的计时（span/timed）、可选的性能采集（cProfile 或线程栈采样），导出为JSON
+    
+    计时可在任意线程记录；cProfile 只采集调用 start_profile() 的线程，采样模式定时抓取所有线程的调用栈
+    """
+    
+    def __init__(self):
+        self.started = time.time()
+        self.spans = {}
+        self._lock = threading.Lock()
+        self._profiler = None
+        self._sampler = None
+        self._samples = None
+        # 最近一次采集的结果
+        self.profile = None
+    
+    def record(self, name, ms):
+        with self._lock:
+            stats = self.spans.get(name)
+            if stats is None:
+                stats = self.spans[name] = SpanStats()
+            stats.add(ms)
+    
+    @contextlib.contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - start) * 1000)
+    
+    def timed(self, name):
+        """装饰器：记录函数每次调用的耗时"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.record(name, (time.perf_counter() - start) * 1000)
+            return wrapper
+        return decorator
+    
+    def summary(self):
+        with self._lock:
+            return {name: stats.summary() for name, stats in sorted(self.spans.items())}
+    
+    def profiling(self):
+        return self._profiler is not None or self._sampler is not None
+    
+    def start_profile(self, sampling=False, interval=0.005):
+        """开始性能采集；sampling 为True时在后台线程每 interval 秒采样一次所有线程的调用栈"""
+        if self.profiling():
+            return
+        if not sampling:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+            return
+        self._samples = {}
+        stop = threading.Event()
+        thread = threading.Thread(target=self._sample, args=(stop, interval), name="diagnostics-sampler", daemon=True)
+        self._sampler = (thread, stop)
+        thread.start()
+    
+    def _sample(self, stop, interval):
+        own = threading.get_ident()
+        samples = self._samples
+        while not stop.wait(interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                # 按 线程/最内层函数 计数（自身耗时），调用栈上的每个函数计入累计耗时
+                seen = set()
+                inner = True
+                while frame is not None:
+                    code = frame.f_code
+                    key = f"{code.co_filename}:{code.co_firstlineno}({code.co_name})"
+                    entry = samples.setdefault((names.get(ident, str(ident)), key), [0, 0])
+                    if inner:
+                        entry[0] += 1
+                        inner = False
+                    if key not in seen:
+                        seen.add(key)
+                        entry[1] += 1
+                    frame = frame.f_back
+    
+    def stop_profile(self, limit=40):
+        """结束采集，返回并保存按累计耗时排序的前 limit 个函数"""
+        if self._profiler is not None:
+            profiler, self._profiler = self._profiler, None
+            profiler.disable()
+            rows = []
+            for (filename, line, name), (_, calls, tottime, cumtime, _) in pstats.Stats(profiler).stats.items():
+                rows.append({'function': f"{filename}:{line}({name})", 'calls': calls,
+                             'self_ms': round(tottime * 1000, 3), 'cumulative_ms': round(cumtime * 1000, 3)})
+            rows.sort(key=lambda row: row['cumulative_ms'], reverse=True)
+            self.profile = {'mode': 'cprofile', 'functions': rows[:limit]}
+        elif self._sampler is not None:
+            (thread, stop), self._sampler = self._sampler, None
+            stop.set()
+            thread.join()
+            rows = [{'thread': thread_name, 'function': key, 'self_samples': own, 'cumulative_samples': total}
+                    for (thread_name, key), (own, total) in self._samples.items()]
+            rows.sort(key=lambda row: row['cumulative_samples'], reverse=True)
+            self.profile = {'mode': 'sampling', 'functions': rows[:limit]}
+            self._samples = None
+        return self.profile
+    
+    def dump(self, path, extra=None):
+        """把诊断数据写入JSON文件（附在问题报告中），返回写入的数据"""
+        data = {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'uptime_s': round(time.time() - self.started, 1),
+            'python': sys.version,
+            'platform': platform.platform(),
+            'threads': sorted(thread.name for thread in threading.enumerate()),
+            'spans': self.summary(),
+            'profile': self.profile,
+        }
+        if extra:
+            data.update(extra)
+        atomic_write_text(path, json.dumps(data, ensure_ascii=False, indent=2))
+        return data
+
+
+# 进程内共用的诊断数据（界面和引擎的计时点都记录到这里）
+DIAGNOSTICS = Diagnostics()
+
+
+# ---------------------------------------------------------------- 命令行和守护进程
+
+ANSI_COLORS = {
+    'red': '31', 'lightcoral': '91', 'magenta': '35', 'green': '32', 'blue': '34', 'gray': '90',
+}
+
+
+def console_logger(stream=sys.stdout):
+    """命令行日志输出：终端中按颜色名加ANSI颜色"""
+    use_color = stream.isatty() and not os.environ.get('NO_COLOR')
+    lock = threading.Lock()
+    
+    def log(text, color=None):
+        code = ANSI_COLORS.get(color) if use_color else None
+        if code:
+            text = f"\x1b[{code}m{text.rstrip(chr(10))}\x1b[0m" + ('\n' if text.endswith('\n') else '')
+        with lock:
+            stream.write(text)
+            stream.flush()
+    return log
+
+
+def create_engine(work_dir="./work", log=None):
+    """创建无界面的扫描引擎（打开结果库和模板元数据索引）"""
+    store = FindingsStore(os.path.join(work_dir, "findings.db"))
+    try:
+        metadata_index = TemplateMetadataIndex()
+    except sqlite3.Error:
+        metadata_index = None
+    engine = ScanEngine(work_dir, store, metadata_index)
+    engine.on_log = log
+    store.on_error = lambda text: engine.log(f"{text}\n", 'red')
+    return engine
+
+
+def prepare_templates(engine, preset=None, templates=()):
+    """加载官方模板列表，把预设中的模板和搜索条件展开成要扫描的模板列表"""
+    try:
+        engine.templates = load_official_templates(supervisor=engine.supervisor)
+    except (subprocess.CalledProcessError, FileNotFoundError) as e:
+        engine.log(f"获取官方模板列表失败，不折叠模板参数: {e}\n", 'red')
+        engine.templates = []
+    
+    selected = list(templates)
+    query = ''
+    if preset:
+        selected.extend(preset.get('templates', []))
+        query = preset.get('query', '')
+    
+    templates_dir = find_templates_dir()
+    if engine.metadata_index and engine.templates and templates_dir:
+        # 元数据索引只解析有变化的文件，同步后可按严重级别/标签折叠参数，也可以执行搜索条件
+        engine.metadata_index.update(
+            'official', engine.templates, lambda path: os.path.join(templates_dir, path))
+        engine.metadata_ready = True
+    if query:
+        lookup = engine.metadata_index.lookup if engine.metadata_ready else None
+        index = TemplateSearchIndex(engine.templates, lookup)
+        matched = [engine.templates[i] for i in index.search(query)]
+        engine.log(f"搜索条件 {query} 匹配 {len(matched)} 个模板\n", 'blue')
+        selected.extend(matched)
+    return list(dict.fromkeys(selected))
+
+
+def apply_options(engine, options):
+    """把预设或命令行中的扫描选项设置到引擎上（值为None的选项忽略）"""
+    for key in ScanEngine.DEFAULT_OPTIONS:
+        if options.get(key) is not None:
+            setattr(engine, key, options[key])
+    # 0 表示不限制
+    for key in ('wall_timeout', 'idle_timeout', 'rate_limit', 'max_concurrency', 'host_rate_limit'):
+        setattr(engine, key, max(getattr(engine, key) or 0, 0) or None)
+
+
+def coerce_options(options):
+    """检查并转换扫描选项的类型（来自客户端JSON或预设文件），返回新字典；类型不对时抛出ValueError"""
+    result = {}
+    for key in ScanEngine.DEFAULT_OPTIONS:
+        value = options.get(key)
+        if value is None:
+            continue
+        if key == 'proxy':
+            if not isinstance(value, str):
+                raise ValueError(f"选项 {key} 必须是字符串")
+            result[key] = value
+            continue
+        # bool 是 int 的子类，单独排除
+        if isinstance(value, bool):
+            raise ValueError(f"选项 {key} 必须是整数")
+        try:
+            number = int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"选项 {key} 必须是整数: {value!r}") from None
+        if key == 'workers' and number < 1:
+            raise ValueError("选项 workers 必须大于0")
+        result[key] = number
+    return result
+
+
+def start_scan(engine, targets, templates, batch=None):
+    """单个目标直接扫描，多个目标默认作为可恢复的批量任务"""
+    if batch is None:
+        batch = len(targets) > 1
+    if batch:
+        return engine.scan_batch(targets, templates)
+    return engine.scan_targets(targets, templates)
+
+
+def scan_options(args):
+    return {key: getattr(args, key) for key in ScanEngine.DEFAULT_OPTIONS}
+
+
+def wait_interruptible(engine):
+    """等待扫描结束；Ctrl+C 时停止扫描并等待进程回收"""
+    try:
+        while not engine.wait(0.5):
+            pass
+    except KeyboardInterrupt:
+        engine.log("正在停止扫描...\n", 'red')
+        engine.stop()
+        while not engine.wait(0.5):
+            pass
+
+
+def command_run(args):
+    log = console_logger()
+    try:
+        preset = load_preset(args.templates_from) if args.templates_from else None
+        preset_options = coerce_options(preset.get('options', {})) if preset else {}
+        if args.resume:
+            job = next((job for job in BatchJob.unfinished(os.path.join(args.work_dir, "jobs"))
+                        if job.id == args.resume), None)
+            if job is None:
+                raise ValueError(f"没有未完成的批量任务 {args.resume}")
+            targets = []
+        else:
+            skipped = []
+            targets = load_targets(args.targets, skipped)
+            if skipped:
+                log(format_skipped_targets(skipped), 'red')
+            if not targets:
+                raise ValueError(f"{args.targets} 中没有目标")
+    except (OSError, ValueError) as e:
+        log(f"错误: {e}\n", 'red')
+        return 2
+    
+    os.makedirs(args.work_dir, exist_ok=True)
+    engine = create_engine(args.work_dir, log)
+    apply_options(engine, preset_options)
+    apply_options(engine, scan_options(args))
+    try:
+        if args.resume:
+            scheduler = engine.resume(job)
+        else:
+            templates = prepare_templates(engine, preset, args.template or ())
+            if not templates:
+                log("错误: 没有要扫描的模板，请使用 --templates-from 或 -t 指定\n", 'red')
+                return 2
+            scheduler = start_scan(engine, targets, templates, True if args.batch else None)
+        if scheduler is None:
+            return 1
+        wait_interruptible(engine)
+    finally:
+        engine.shutdown()
+        engine.findings_store.close()
+    counts = scheduler.counts()
+    return 0 if counts[ScanJob.DONE] == len(scheduler.jobs) else 1
+
+
+class ScanDaemon:
+    """守护进程：通过本地Unix套接字接收扫描任务，按提交顺序逐个运行
+    
+    协议为每行一个JSON请求、返回一行JSON：
+    {"cmd": "run", "targets_file": 路径, "preset": 预设, "templates": [...], 选项...} -> {"ok": true, "id": n}
+    {"cmd": "status"} -> 当前、排队和最近完成的任务；{"cmd": "cancel", "id": n} 取消排队或运行中的任务
+    """
+    
+    HISTORY = 50
+    
+    def __init__(self, engine, socket_path):
+        self.engine = engine
+        self.socket_path = socket_path
+        self.requests = queue.Queue()
+        self.tasks = {}
+        self.next_id = 1
+        self.current = None
+        self._lock = threading.Lock()
+        self.server = None
+    
+    def submit(self, request):
+        request = self.validate(request)
+        if request.get('preset'):
+            load_preset(request['preset'])
+        with self._lock:
+            task = {'id': self.next_id, 'status': 'queued', 'preset': request.get('preset', ''),
+                    'submitted': datetime.now().isoformat(timespec='seconds'), 'request': request}
+            self.next_id += 1
+            self.tasks[task['id']] = task
+        self.requests.put(task)
+        return task['id']
+    
+    @staticmethod
+    def validate(request):
+        """检查客户端请求的字段类型，返回只含已知字段的请求；不合法时抛出ValueError"""
+        if not request.get('targets_file') and not request.get('targets'):
+            raise ValueError("缺少 targets_file 或 targets")
+        if not request.get('preset') and not request.get('templates'):
+            raise ValueError("缺少 preset 或 templates")
+        for key in ('targets_file', 'preset'):
+            if request.get(key) is not None and not isinstance(request[key], str):
+                raise ValueError(f"{key} 必须是字符串")
+        for key in ('targets', 'templates'):
+            value = request.get(key)
+            if value is not None and not (isinstance(value, list) and all(isinstance(v, str) for v in value)):
+                raise ValueError(f"{key} 必须是字符串列表")
+        if request.get('batch') is not None and not isinstance(request['batch'], bool):
+            raise ValueError("batch 必须是 true/false")
+        
+        checked = {key: request[key] for key in ('targets_file', 'targets', 'preset', 'templates', 'batch')
+                   if request.get(key) is not None}
+        checked.update(coerce_options(request))
+        return checked
+    
+    def cancel(self, task_id):
+        with self._lock:
+            task = self.tasks.get(task_id)
+            if task is None or task['status'] not in ('queued', 'running'):
+                return False
+            if task['status'] == 'queued':
+                task['status'] = 'cancelled'
+                return True
+        return self.engine.stop()
+    
+    def status(self):
+        with self._lock:
+            tasks = [{key: value for key, value in task.items() if key != 'request'}
+                     for task in self.tasks.values()]
+        scheduler = self.engine.scheduler
+        if self.current is not None and scheduler is not None:
+            ended, total, eta = scheduler.progress()
+            for task in tasks:
+                if task['id'] == self.current:
+                    task['progress'] = {'ended': ended, 'total': total, 'eta': eta}
+        return {'ok': True, 'tasks': tasks}
+    
+    def _run_loop(self):
+        while True:
+            task = self.requests.get()
+            if task is None:
+                return
+            with self._lock:
+                if task['status'] == 'cancelled':
+                    continue
+                task['status'] = 'running'
+                self.current = task['id']
+            try:
+                result = self._run_task(task['request'])
+            except Exception as e:
+                # 任何意外错误只让当前任务失败，工作线程继续处理后续任务
+                self.engine.log(f"任务出错: {e}\n", 'red')
+                result = {'status': 'failed', 'error': f"{type(e).__name__}: {e}"}
+            task.update(result)
+            with self._lock:
+                self.current = None
+                self._trim()
+    
+    def _run_task(self, request):
+        engine = self.engine
+        started = time.monotonic()
+        try:
+            preset = load_preset(request['preset']) if request.get('preset') else None
+            skipped = []
+            if request.get('targets'):
+                targets = TargetStore()
+                targets.add_lines(request['targets'], skipped=skipped)
+            else:
+                targets = load_targets(request['targets_file'], skipped)
+            if skipped:
+                engine.log(format_skipped_targets(skipped), 'red')
+            if not targets:
+                raise ValueError("没有目标")
+            engine.reset_options()
+            apply_options(engine, coerce_options(preset.get('options', {})) if preset else {})
+            apply_options(engine, request)
+            templates = prepare_templates(engine, preset, request.get('templates', ()))
+            scheduler = start_scan(engine, targets, templates, request.get('batch'))
+        except (OSError, ValueError, sqlite3.Error) as e:
+            engine.log(f"任务出错: {e}\n", 'red')
+            return {'status': 'failed', 'error': str(e)}
+        if scheduler is None:
+            return {'status': 'failed'}
+        engine.wait()
+        counts = scheduler.counts()
+        if scheduler.cancelled:
+            status = 'cancelled'
+        else:
+            status = 'done' if counts[ScanJob.DONE] == len(scheduler.jobs) else 'failed'
+        return {'status': status, 'duration': round(time.monotonic() - started, 1),
+                'counts': {key: value for key, value in counts.items() if value}}
+    
+    def _trim(self):
+        ended = [task_id for task_id, task in self.tasks.items() if task['status'] not in ('queued', 'running')]
+        for task_id in ended[:-self.HISTORY]:
+            del self.tasks[task_id]
+    
+    def handle(self, request):
+        """处理一个请求，返回响应字典"""
+        cmd = request.get('cmd')
+        try:
+            if cmd == 'run':
+                return {'ok': True, 'id': self.submit(request)}
+            if cmd == 'status':
+                return self.status()
+            if cmd == 'cancel':
+                return {'ok': self.cancel(int(request.get('id', 0)))}
+        except (OSError, ValueError, TypeError) as e:
+            return {'ok': False, 'error': str(e)}
+        return {'ok': False, 'error': f"未知命令: {cmd}"}
+    
+    def serve_forever(self):
+        if not hasattr(socket, 'AF_UNIX'):
+            raise OSError("当前系统不支持Unix套接字")
+        if os.path.exists(self.socket_path):
+            # 上次异常退出留下的套接字文件；仍能连上说明已有守护进程在运行
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+                raise OSError(f"守护进程已在运行: {self.socket_path}")
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.remove(self.socket_path)
+            finally:
+                probe.close()
+        
+        daemon = self
+        
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    try:
+                        request = json.loads(line)
+                        if not isinstance(request, dict):
+                            raise ValueError("请求必须是JSON对象")
+                        response = daemon.handle(request)
+                    except ValueError as e:
+                        response = {'ok': False, 'error': str(e)}
+                    self.wfile.write((json.dumps(response, ensure_ascii=False) + '\n').encode('utf-8'))
+        
+        self.server = socketserver.ThreadingUnixStreamServer(self.socket_path, Handler)
+        self.server.daemon_threads = True
+        # 只允许当前用户提交任务
+        os.chmod(self.socket_path, 0o600)
+        threading.Thread(target=self._run_loop, daemon=True).start()
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            try:
+                os.remove(self.socket_path)
+            except OSError:
+                pass
+    
+    def stop(self):
+        if self.server:
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+
+
+def command_daemon(args):
+    log = console_logger()
+    os.makedirs(args.work_dir, exist_ok=True)
+    engine = create_engine(args.work_dir, log)
+    daemon = ScanDaemon(engine, args.socket)
+    if hasattr(signal, 'SIGTERM'):
+        signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+    log(f"守护进程已启动，监听 {args.socket}\n", 'green')
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        log(f"错误: {e}\n", 'red')
+        return 2
+    finally:
+        engine.shutdown()
+        engine.findings_store.close()
+    return 0
+
+
+def command_submit(args):
+    if args.status:
+        request = {'cmd': 'status'}
+    elif args.cancel is not None:
+        request = {'cmd': 'cancel', 'id': args.cancel}
+    else:
+        if not args.targets or not (args.templates_from or args.template):
+            print("错误: 需要 --targets 以及 --templates-from 或 -t", file=sys.stderr)
+            return 2
+        request = dict(scan_options(args), cmd='run', targets_file=os.path.abspath(args.targets),
+                       templates=args.template or [], batch=True if args.batch else None)
+        if args.templates_from:
+            # 守护进程的工作目录可能不同，预设按绝对路径传递
+            request['preset'] = os.path.abspath(preset_path(args.templates_from))
+    
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.connect(args.socket)
+            client.sendall((json.dumps(request, ensure_ascii=False) + '\n').encode('utf-8'))
+            response = client.makefile('r', encoding='utf-8').readline()
+    except (OSError, AttributeError) as e:
+        print(f"无法连接守护进程 {args.socket}: {e}", file=sys.stderr)
+        return 2
+    print(response.rstrip('\n'))
+    try:
+        return 0 if json.loads(response).get('ok') else 1
+    except ValueError:
+        return 1
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="nuclei-gui", description="Nuclei扫描（无界面模式）")
+    commands = parser.add_subparsers(dest='command', required=True)
+    
+    def add_scan_options(sub):
+        sub.add_argument('--targets', help="目标文件，每行一个URL或主机")
+        sub.add_argument('--templates-from', metavar='PRESET', help="扫描预设名（presets/<名称>.json）或预设文件路径")
+        sub.add_argument('-t', '--template', action='append', help="额外的模板路径，可重复")
+        sub.add_argument('--workers', type=int, help="并发nuclei进程数（默认4）")
+        sub.add_argument('--batch', action='store_true', help="作为可恢复的批量任务运行（多个目标时默认）")
+        sub.add_argument('--proxy', help="代理地址")
+        sub.add_argument('--wall-timeout', type=int, help="每个目标的整体超时（秒）")
+        sub.add_argument('--idle-timeout', type=int, help="无输出超时（秒）")
+        sub.add_argument('--rate-limit', type=int, help="所有nuclei进程合计的请求速率上限（每秒）")
+        sub.add_argument('--max-concurrency', type=int, help="所有nuclei进程合计的并发请求上限")
+        sub.add_argument('--host-rate-limit', type=int, help="单个主机的请求速率上限（每秒）")
+    
+    run = commands.add_parser('run', help="扫描目标并等待结束")
+    add_scan_options(run)
+    run.add_argument('--resume', metavar='JOB_ID', help="继续未完成的批量任务")
+    run.add_argument('--work-dir', default="./work")
+    
+    daemon = commands.add_parser('daemon', help="后台运行，通过Unix套接字接收任务")
+    daemon.add_argument('--socket', default="./work/engine.sock")
+    daemon.add_argument('--work-dir', default="./work")
+    
+    submit = commands.add_parser('submit', help="向守护进程提交任务或查询状态")
+    add_scan_options(submit)
+    submit.add_argument('--status', action='store_true', help="查询任务状态")
+    submit.add_argument('--cancel', type=int, metavar='ID', help="取消任务")
+    submit.add_argument('--socket', default="./work/engine.sock")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == 'run':
+        if not args.targets and not args.resume:
+            print("错误: 需要 --targets 或 --resume", file=sys.stderr)
+            return 2
+        return command_run(args)
+    if args.command == 'daemon':
+        return command_daemon(args)
+    return command_submit(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())